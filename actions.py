@@ -322,7 +322,7 @@ class PickupAction(Action):
                     if len(inventory.items) >= inventory.capacity:
                         raise exceptions.Impossible("Your inventory is full.")
 
-                    self.engine.game_map.entities.remove(item)
+                    self.engine.game_map.remove_entity(item)
                     if item.ammo:
                         exists_ammo = False
                         for existing_item in inventory.items:
@@ -0,0 +1,85 @@
+"""Save the game every so many turns, and on every change of floor, without stopping play to write the file."""
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+import color
+import savefile
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from journal import ActionJournal
+
+AUTOSAVE_INTERVAL = 100  # Turns between autosaves.
+
+
+class Autosaver:
+    """
+    Saves the game to `filename` every `interval` turns, and after the player changes floor.
+
+    The save is split in two. The SaveSnapshot is taken on the main thread at the end of a turn: it pickles a copy
+    of the game without the floors that haven't changed, which takes about 8ms for the root chunk and the current
+    floor and 40ms when every floor of five has to be written. Comparing the copy's entities with their prototypes,
+    encoding, compressing and moving the new file over the old one are done on a worker thread while play goes on.
+    A save that's due while the last one is still being written waits for the next turn, so the main thread never
+    waits for the worker. `snapshot_ms` is how long the last snapshot took, and is also in the profiler as the
+    "autosave.snapshot" phase.
+    Each autosave is a checkpoint of `journal`, if it's given one.
+    """
+
+    def __init__(self, filename: str, interval: int = AUTOSAVE_INTERVAL, journal: Optional[ActionJournal] = None):
+        self.filename = filename
+        self.interval = interval
+        self.journal = journal
+        self.turns = 0  # Turns since the last autosave.
+        self.floor: Optional[int] = None  # The floor of the last autosave.
+        self.saves = 0
+        self.snapshot_ms = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def end_turn(self, engine: Engine) -> None:
+        archive = engine.game_world.archive
+        if archive and archive.writing and archive.writing[1].done():
+            self.report(engine, archive.settle())
+
+        self.turns += 1
+        floor = engine.game_world.current_floor
+        if self.floor is None:
+            self.floor = floor
+        if self.turns < self.interval and floor == self.floor:
+            return
+        if archive and archive.writing:
+            return  # Still writing the last one.
+        if engine.player.is_alive:
+            self.save(engine)
+
+    def save(self, engine: Engine) -> None:
+        """Take a snapshot of the game now and write it on the worker thread."""
+        start = time.perf_counter()
+        with engine.profiler.phase("autosave.snapshot"):
+            snapshot = savefile.SaveSnapshot(engine, self.filename, self.journal)
+        self.snapshot_ms = (time.perf_counter() - start) * 1000
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+        snapshot.archive.writing = snapshot, self._executor.submit(snapshot.write)
+        self.turns = 0
+        self.floor = engine.game_world.current_floor
+        self.saves += 1
+
+    def wait(self, engine: Engine) -> None:
+        """Wait for the save being written, if there is one."""
+        archive = engine.game_world.archive
+        if archive:
+            self.report(engine, archive.settle())
+
+    @staticmethod
+    def report(engine: Engine, error: Optional[BaseException]) -> None:
+        if error is not None:
+            engine.message_log.add_message(f"Autosave failed: {error}", color.error)
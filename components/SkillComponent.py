@@ -160,20 +160,19 @@ class CombatAoe(CombatUnit):
                 raise Impossible("You cannot target an area that you cannot see.")
 
             targets_hit = False
-            for actor in self.user.gamemap.actors:
-                if actor.distance(x, y) <= self.radius:
-                    if weapon:
-                        if weapon.equippable.type != "Magic":
-                            weapon = None
-                    damageCalc = DamageCalculator(self.user, "Magic", actor, weapon, self.owner, self)
-                    damage = damageCalc.calculate_damage()
-                    actor.gamemap.engine.message_log.add_message(
-                        f"The {actor.name} is engulfed in a fiery explosion, taking {damage} damage!"
-                    )
-                    actor.fighter.create_damage_log(category="Attack", source_entity=self.user,
-                                                    details=f"The {actor.name} is engulfed in a fiery explosion, taking {damage} damage!")
-                    actor.fighter.take_damage(damage)
-                    targets_hit = True
+            for actor in self.user.gamemap.actors_in_radius(x, y, self.radius):
+                if weapon:
+                    if weapon.equippable.type != "Magic":
+                        weapon = None
+                damageCalc = DamageCalculator(self.user, "Magic", actor, weapon, self.owner, self)
+                damage = damageCalc.calculate_damage()
+                actor.gamemap.engine.message_log.add_message(
+                    f"The {actor.name} is engulfed in a fiery explosion, taking {damage} damage!"
+                )
+                actor.fighter.create_damage_log(category="Attack", source_entity=self.user,
+                                                details=f"The {actor.name} is engulfed in a fiery explosion, taking {damage} damage!")
+                actor.fighter.take_damage(damage)
+                targets_hit = True
 
             if not targets_hit:
                 if self.is_child:
@@ -185,20 +184,18 @@ class CombatAoe(CombatUnit):
                     unit.execute(xy)
         else:
             # If it's a melee AOE, we'll inflict damage to all enemies in the user's reach (within 1 tile).
-            for target in self.user.gamemap.actors:
+            for target in self.user.gamemap.actors_in_radius(self.user.x, self.user.y, 1):
                 if target is not self.user and target.is_alive:
-                    distance = self.user.distance(target.x, target.y)
-                    if distance <= 1:
-                        # Since it's melee, defense is used.
-                        if weapon:
-                            if weapon.equippable.type != "Melee":
-                                weapon = None
-                        damageCalc = DamageCalculator(self.user, "Melee", target, weapon, self.owner, self)
-                        damage = damageCalc.calculate_damage()
-                        if damage > 0:
-                            target.fighter.create_damage_log(category="Attack", source_entity=self.user,
-                                                             details=f"The {target.name} is engulfed in a fiery explosion, taking {damage} damage!")
-                            target.fighter.hp -= damage
+                    # Since it's melee, defense is used.
+                    if weapon:
+                        if weapon.equippable.type != "Melee":
+                            weapon = None
+                    damageCalc = DamageCalculator(self.user, "Melee", target, weapon, self.owner, self)
+                    damage = damageCalc.calculate_damage()
+                    if damage > 0:
+                        target.fighter.create_damage_log(category="Attack", source_entity=self.user,
+                                                         details=f"The {target.name} is engulfed in a fiery explosion, taking {damage} damage!")
+                        target.fighter.hp -= damage
             if self.units:
                 for unit in self.units:
                     unit.execute(xy)
@@ -5,7 +5,6 @@ from typing import List, Tuple, TYPE_CHECKING, Optional, Type, Union
 
 import numpy as np  # type: ignore
 import tcod
-from tcod.map import compute_fov
 
 import actions
 from equipment_types import EquipmentType
@@ -16,15 +15,32 @@ if TYPE_CHECKING:
 from actions import Action, MeleeAction, MovementAction, WaitAction, BumpAction
 from abc import ABC, abstractmethod
 
+# Destinations further than this are routed through the room graph instead of searched for over the whole map.
+ROOM_ROUTE_DISTANCE = 12
+# How many steps ahead a detour around a blocked step may rejoin the path, and how much longer than the skipped
+# part of the path it may be.
+PATH_REPAIR_LOOKAHEAD = 5
+PATH_REPAIR_SLACK = 3
+
+# Placeholder for the maps an ApproachMap hasn't made yet. Shared and read-only, since they're replaced, not filled.
+UNSET_MAP = tcod.path.maxarray((2, 2), dtype=np.int32, order="F")
+UNSET_MAP.flags.writeable = False
+
 
 class BaseAI(Action):
 
     def __init__(self, entity: Actor):
         super().__init__(entity)
         self.path: List[Tuple[int, int]] = []
+        self.path_revision = -1  # The tiles revision the path was made for.
         self.approach_map = ApproachMap(entity)
         self.flee_map = FleeMap(entity)  # Not used in HostileEnemy, but useful in other AIs
 
+    @property
+    def rng(self) -> random.Random:
+        """This actor's own random stream, for its decisions."""
+        return self.engine.rng.actor(self.entity)
+
     def vision_compute(self) -> List[Entity]:
         visible_map = self.return_visible_map()
         visible_entities = []
@@ -34,22 +50,15 @@ class BaseAI(Action):
         return visible_entities
 
     def return_visible_map(self):
-        return compute_fov(self.entity.gamemap.tiles["transparent"], (self.entity.x, self.entity.y),
-                           radius=self.entity.fighter.sight_range, )
+        return self.entity.gamemap.compute_fov(self.entity.x, self.entity.y, self.entity.fighter.sight_range)
 
     def actors_search(self) -> List[Actor]:
-        visible_map = compute_fov(self.entity.gamemap.tiles["transparent"], (self.entity.x, self.entity.y),
-                                  radius=self.entity.fighter.sight_range, )
-        visible_actors = []
-        for actor in self.entity.gamemap.actors:
-            if visible_map[actor.x, actor.y] and actor is not self.entity:
-                visible_actors.append(actor)
-        return visible_actors
+        return self.entity.gamemap.visibility.visible_actors(self.entity)
 
     def detect_player(self) -> Actor or None:
-        for actor in self.actors_search():
-            if actor == self.entity.gamemap.engine.player:
-                return actor
+        player = self.entity.gamemap.engine.player
+        if self.entity.gamemap.visibility.can_see(self.entity, player):
+            return player
         return
 
     def has_path(self) -> bool:
@@ -58,6 +67,7 @@ class BaseAI(Action):
     def set_path(self, new_path: List[Tuple[int, int]]) -> None:
         if new_path:
             self.path = new_path
+            self.path_revision = self.entity.gamemap.tiles_revision
 
     def clear_path(self) -> None:
         self.path.clear()
@@ -67,39 +77,86 @@ class BaseAI(Action):
             return self.path[0]
         return self.entity.x, self.entity.y
 
+    def path_is_valid(self) -> bool:
+        """Return True if the path was made for the current tiles and starts next to the entity."""
+        if self.path_revision != self.entity.gamemap.tiles_revision:
+            return False
+        next_x, next_y = self.path[0]
+        return max(abs(next_x - self.entity.x), abs(next_y - self.entity.y)) == 1
+
+    def repair_path(self) -> bool:
+        """Replace the blocked start of the path with a detour that rejoins it a few steps further on.
+
+        Returns False, leaving the path alone, if there is no short enough detour.
+        """
+        gamemap = self.entity.gamemap
+        ahead = self.path[1:PATH_REPAIR_LOOKAHEAD + 1]
+        if not ahead:
+            return False
+        points = [(self.entity.x, self.entity.y)] + ahead
+        x1 = max(0, min(x for x, _ in points) - 2)
+        y1 = max(0, min(y for _, y in points) - 2)
+        x2 = min(gamemap.width, max(x for x, _ in points) + 3)
+        y2 = min(gamemap.height, max(y for _, y in points) + 3)
+        cost = np.array(gamemap.tiles["walkable"][x1:x2, y1:y2], dtype=np.int8)
+        cost[gamemap.spatial_index.blockers[x1:x2, y1:y2] > 0] = 0
+        cost[self.entity.x - x1, self.entity.y - y1] = 1
+        pathfinder = tcod.path.Pathfinder(tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3))
+        pathfinder.add_root((self.entity.x - x1, self.entity.y - y1))
+
+        # Rejoin as far along the path as possible.
+        for i in range(len(ahead) - 1, -1, -1):
+            rejoin_x, rejoin_y = ahead[i]
+            if not cost[rejoin_x - x1, rejoin_y - y1]:
+                continue
+            detour = pathfinder.path_to((rejoin_x - x1, rejoin_y - y1))[1:].tolist()
+            if detour and len(detour) <= i + 1 + PATH_REPAIR_SLACK:
+                self.path = [(x + x1, y + y1) for x, y in detour] + self.path[i + 2:]
+                gamemap.engine.profiler.count("path_repaired")
+                return True
+        gamemap.engine.profiler.count("path_repair_failed")
+        return False
+
     def move_along_path(self) -> None:
+        if self.path and not self.path_is_valid():
+            # The map changed or the entity was moved, head for the same destination from here.
+            destination = self.path[-1]
+            self.clear_path()
+            self.set_path(self.get_path_to(*destination))
         if self.path:
-            dest_x, dest_y = self.path[0]
-            dx = dest_x - self.entity.x
-            dy = dest_y - self.entity.y
-            movement_action = MovementAction(self.entity, dx, dy)
-            if self.entity.fighter.time >= movement_action.time_cost and not self.entity.gamemap.get_actor_at_location(
-                    dest_x, dest_y):
-                self.path.pop(0)
-                return movement_action.perform()
-            else:
+            if self.entity.fighter.time < MovementAction(self.entity, 0, 0).time_cost:
+                return WaitAction(self.entity).perform()
+            if self.entity.gamemap.get_actor_at_location(*self.path[0]) and not self.repair_path():
                 self.clear_path()
                 return WaitAction(self.entity).perform()
+            dest_x, dest_y = self.path.pop(0)
+            return MovementAction(self.entity, dest_x - self.entity.x, dest_y - self.entity.y).perform()
+        # There's nowhere to go, so the turn is spent waiting.
+        return WaitAction(self.entity).perform()
 
     def perform(self) -> None:
         raise NotImplementedError()
 
-    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]] or None:
+    def planned_map(self) -> Optional[Tuple[str, List[Tuple[int, int]], int]]:
+        """Return the kind of distance map ("approach" or "flee"), its goal tiles and cost coefficient that this AI
+        will most likely ask for on its turn, so it can be computed ahead of time. None if it won't need one."""
+        return None
+
+    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
         """Compute and return a path to the target position.
 
         If there is no valid path then returns an empty list.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.gamemap.tiles["walkable"], dtype=np.int8)
+        if max(abs(dest_x - self.entity.x), abs(dest_y - self.entity.y)) > ROOM_ROUTE_DISTANCE:
+            path = self.entity.gamemap.room_graph.route((self.entity.x, self.entity.y), (dest_x, dest_y))
+            if path:
+                return path
 
-        for entity in self.entity.gamemap.entities:
-            # Check that an enitiy blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
+        # The walkable array, with the cost of tiles with a blocking entity raised.
+        # A lower number means more enemies will crowd behind each other in
+        # hallways.  A higher number means enemies will take longer paths in
+        # order to surround the player.
+        cost = self.entity.gamemap.path_costs.cost(10)
 
         # Create a graph from the cost array and pass that graph to a new pathfinder.
         graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
@@ -111,10 +168,22 @@ class BaseAI(Action):
         path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
 
         # Convert from List[List[int]] to List[Tuple[int, int]].
-        if path:
-            return [(index[0], index[1]) for index in path]
-        if not path:
-            return WaitAction(self.entity).perform()
+        return [(index[0], index[1]) for index in path]
+
+    def get_path_to_room(self, room: int) -> List[Tuple[int, int]]:
+        """Return a path to the center of a room, or an empty list if there is none.
+
+        Trips of several rooms follow the room graph's stored edge paths. Near rooms, or rooms the graph can't reach,
+        are found by hill-climbing the room's cached distance field.
+        """
+        center = self.entity.gamemap.rooms[room].center
+        if max(abs(center[0] - self.entity.x), abs(center[1] - self.entity.y)) > ROOM_ROUTE_DISTANCE:
+            path = self.entity.gamemap.room_graph.route((self.entity.x, self.entity.y), center)
+            if path:
+                return path
+        field = self.entity.gamemap.room_distance_field(room)
+        path = tcod.path.hillclimb2d(field, (self.entity.x, self.entity.y), True, True)[1:].tolist()
+        return [(index[0], index[1]) for index in path]
 
 
 class HostileEnemy(BaseAI):
@@ -135,9 +204,13 @@ class HostileEnemy(BaseAI):
         return self.target is not None
 
     def target_is_visible(self) -> bool:
-        if self.target in self.actors_search():
-            return True
-        return False
+        return self.entity.gamemap.visibility.can_see(self.entity, self.target)
+
+    def planned_map(self) -> Optional[Tuple[str, List[Tuple[int, int]], int]]:
+        if self.has_target() and self.target_is_visible():
+            if max(abs(self.target.x - self.entity.x), abs(self.target.y - self.entity.y)) > 1:
+                return "approach", [(self.target.x, self.target.y)], self.approach_map.cost_coefficient
+        return None
 
     def perform(self) -> None:
         # If the enemy has a target, check if it is visible.
@@ -166,7 +239,7 @@ class HostileEnemy(BaseAI):
                 else:
                     self.forget_target()
                     # If the enemy doesn't have a path, it will wait or move to the nearest room.
-                    if random.random() < 0.5:
+                    if self.rng.random() < 0.5:
                         return WaitAction(self.entity).perform()
                     else:
                         self.set_path(self.get_path_to_nearest_room())
@@ -180,7 +253,7 @@ class HostileEnemy(BaseAI):
             return self.move_along_path()
         else:
             # If the enemy couldn't find a target (player) or a path to it, it will wait or move to the nearest room.
-            if random.random() < 0.5:
+            if self.rng.random() < 0.5:
                 return WaitAction(self.entity).perform()
             else:
                 if not self.path:
@@ -188,15 +261,15 @@ class HostileEnemy(BaseAI):
                 return self.move_along_path()
 
     def get_path_to_nearest_room(self) -> List[Tuple[int, int]]:
-        room = random.choice(self.entity.gamemap.rooms)
-        return self.get_path_to(*room.center)
-        # Implement the logic to calculate and return the path to the nearest room.
-        # You can use your existing pathfinding method in the BaseAI class to achieve this.
-        # Return an empty list if no valid path is found.
-        pass  # Replace this with your implementation.
+        return self.get_path_to_room(self.rng.randrange(len(self.entity.gamemap.rooms)))
 
 
 class FleeingAI(HostileEnemy):
+    def planned_map(self) -> Optional[Tuple[str, List[Tuple[int, int]], int]]:
+        if self.has_target() and self.target_is_visible():
+            return "flee", [(self.target.x, self.target.y)], self.flee_map.cost_coefficient
+        return None
+
     def perform(self) -> None:
         if self.has_target():
             if self.target_is_visible():
@@ -214,7 +287,7 @@ class FleeingAI(HostileEnemy):
                     self.forget_target()
                     # If the enemy doesn't have a path then it should believe it has evaded its pursuer,
                     # It will wait or move to the nearest room.
-                    if random.random() < 0.5:
+                    if self.rng.random() < 0.5:
                         return WaitAction(self.entity).perform()
                     else:
                         self.set_path(self.get_path_to_nearest_room())
@@ -229,7 +302,7 @@ class FleeingAI(HostileEnemy):
                 return self.move_along_path()
         else:
             # If the enemy couldn't find a target (player) or a path to it, it will wait or move to the nearest room.
-            if random.random() < 0.5:
+            if self.rng.random() < 0.5:
                 return WaitAction(self.entity).perform()
             else:
                 if not self.path:
@@ -241,33 +314,33 @@ class ApproachMap:
     def __init__(self, entity: Actor, cost_coefficient: int = 10):
         self.entity = entity
         self.cost_coefficient = cost_coefficient
-        self.cost_map = tcod.path.maxarray((2, 2), dtype=np.int32, order="F")
+        self.cost_map = UNSET_MAP
         self.goal_points = []
-        self.approach_map = tcod.path.maxarray((2, 2), dtype=np.int32, order="F")
+        self.approach_map = UNSET_MAP
 
-    # Generates the cost_map
-    def generate_cost_map(self) -> np.ndarray:
-        # Copy the walkable array.
-        cost = np.array(np.where(self.entity.gamemap.tiles["walkable"], 1, 0), dtype=np.int8)
+    MAPS = ("cost_map", "approach_map")
 
-        for entity in self.entity.gamemap.entities:
-            # Check that an parent blocks movement and the cost isn't zero (blocking).
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                cost[entity.x, entity.y] += self.cost_coefficient
+    def __getstate__(self) -> dict:
+        # The maps are rebuilt from the goal points before every use.
+        state = self.__dict__.copy()
+        for name in self.MAPS:
+            del state[name]
+        return state
 
-        return cost
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        for name in self.MAPS:
+            setattr(self, name, UNSET_MAP)
 
-    # Generates the distance map based on current goal_points.
-    def generate_map(self) -> np.ndarray:
-        dist = tcod.path.maxarray(self.cost_map.shape, dtype=np.int32, order="F")
-
-        if self.goal_points:
-            for target in self.goal_points:
-                dist[target.x, target.y] = 0
+    # Returns the cost_map, shared with every other actor on the map this round.
+    def generate_cost_map(self) -> np.ndarray:
+        return self.entity.gamemap.distance_maps.cost_map(self.cost_coefficient)
 
-        tcod.path.dijkstra2d(dist, self.cost_map, 1, 2, out=dist)
-        return dist
+    # Returns the distance map based on current goal_points, computed once per round for everyone chasing them.
+    def generate_map(self) -> np.ndarray:
+        return self.entity.gamemap.distance_maps.approach(
+            [(target.x, target.y) for target in self.goal_points], self.cost_coefficient
+        )
 
     # Processes the map and returns the given path.
     def process_map(self, dist: np.ndarray) -> List[Tuple[int, int]]:
@@ -299,21 +372,20 @@ class ApproachMap:
 
 
 class FleeMap(ApproachMap):
+    MAPS = ApproachMap.MAPS + ("flee_map",)
+
     def __init__(self, entity: Actor, cost_coefficient: int = 10):
         super().__init__(entity, cost_coefficient)
-        self.flee_map = tcod.path.maxarray((2, 2), dtype=np.int32, order="F")
+        self.flee_map = UNSET_MAP
 
     def set_flee_map(self, targets: List[Optional[Actor]] = None, coefficient: int = None) -> np.ndarray:
         self.update_map(targets, coefficient)
 
-        # Generate the inverse map by multiplying every value in the approach map with a negative coefficient.
-        dist = self.approach_map * -1.2
-        dist = dist.astype(np.int64)
-
-        # Recalculate the distances using Dijkstra's algorithm.
-        tcod.path.dijkstra2d(dist, self.cost_map, 1, 2, out=dist)
-
-        return dist
+        # The inverse of the approach map, rescanned with Dijkstra's algorithm. Shared by everyone fleeing the same
+        # targets this round.
+        return self.entity.gamemap.distance_maps.flee(
+            [(target.x, target.y) for target in self.goal_points], self.cost_coefficient
+        )
 
     def get_flee_path_from(self, targets: List[Optional[Actor]] = None, coefficient: int = None) -> List[
         Tuple[int, int]]:
@@ -331,31 +403,44 @@ class GeneralAI(FleeingAI):
         self.flee_map.entity = self.entity
         self.item = None
         self.state = "Hostile"
+        self.desire_map = DesireMap(entity)
 
     def hostile_actors(self):
         actors = self.actors_search()
-        hostile = set()
+        hostile = {}  # Used as an ordered set, so the choice between them is reproducible.
         f = self.entity.faction_manager
         for actor in actors:
             af = actor.faction_manager
             for faction in af.member_factions:
                 if faction in f.hostile_factions:
-                    hostile.add(actor)
+                    hostile[actor] = None
             for faction in f.member_factions:
                 if faction in af.hostile_factions:
-                    hostile.add(actor)
+                    hostile[actor] = None
         return list(hostile)
 
+    def planned_map(self) -> Optional[Tuple[str, List[Tuple[int, int]], int]]:
+        if self.state == "Fleeing":
+            return None  # Escapes mix several desires, which aren't planned ahead.
+        return HostileEnemy.planned_map(self)
+
+    def get_escape_path(self) -> List[Tuple[int, int]]:
+        """Return a path away from the target and every other hostile actor in sight, preferring the open space of
+        the rooms to dead ends."""
+        self.desire_map.clear_desires()
+        self.desire_map.flee_actors(list(dict.fromkeys([self.target, *self.hostile_actors()])))
+        self.desire_map.seek_rooms()
+        return self.desire_map.get_path_to()
+
     def random_hostile(self):
         if self.hostile_actors():
-            return random.choice(self.hostile_actors())
+            return self.rng.choice(self.hostile_actors())
     def perform(self) -> None:
         if self.state == "Fleeing":
             if self.has_target():
                 if self.target_is_visible():
-                    # Calculate fleeing path using the FleeMap
-                    self.flee_map.set_goal_points([self.target])
-                    self.set_path(self.flee_map.get_flee_path_from())
+                    # Run from everything hostile in sight at once.
+                    self.set_path(self.get_escape_path())
                     if self.path:
                         return self.move_along_path()
                     else:
@@ -367,7 +452,7 @@ class GeneralAI(FleeingAI):
                         self.forget_target()
                         # If the enemy doesn't have a path then it should believe it has evaded its pursuer,
                         # It will wait or move to the nearest room.
-                        if random.random() < 0.5:
+                        if self.rng.random() < 0.5:
                             return WaitAction(self.entity).perform()
                         else:
                             self.set_path(self.get_path_to_nearest_room())
@@ -375,15 +460,14 @@ class GeneralAI(FleeingAI):
             # If the enemy doesn't have a target, look for the player.
             self.set_target(self.random_hostile())
             if self.has_target():
-                # Calculate fleeing path using the FleeMap
-                self.flee_map.set_goal_points([self.target])
-                self.set_path(self.flee_map.get_flee_path_from())
+                # Run from everything hostile in sight at once.
+                self.set_path(self.get_escape_path())
                 if self.path:
                     return self.move_along_path()
             else:
                 # If the enemy couldn't find a target or a path to it, it will wait or move to the nearest room,
                 self.state = "Hostile"
-                if random.random() < 0.5:
+                if self.rng.random() < 0.5:
                     return WaitAction(self.entity).perform()
 
         elif self.state == "Hostile":
@@ -392,8 +476,7 @@ class GeneralAI(FleeingAI):
                 if self.target_is_visible():
                     if self.run_away_check():
                         self.state = "Fleeing"
-                        self.flee_map.set_goal_points([self.target])
-                        self.set_path(self.flee_map.get_flee_path_from())
+                        self.set_path(self.get_escape_path())
                         if self.path:
                             return self.move_along_path()
                         else:
@@ -421,7 +504,7 @@ class GeneralAI(FleeingAI):
                     else:
                         self.forget_target()
                         # If the enemy doesn't have a path, it will wait or move to the nearest room.
-                        if random.random() < 0.5:
+                        if self.rng.random() < 0.5:
                             return WaitAction(self.entity).perform()
                         else:
                             self.set_path(self.get_path_to_nearest_room())
@@ -435,7 +518,7 @@ class GeneralAI(FleeingAI):
                 return self.move_along_path()
             else:
                 # If the enemy couldn't find a target (player) or a path to it, it will wait or move to the nearest room.
-                if random.random() < 0.5:
+                if self.rng.random() < 0.5:
                     return WaitAction(self.entity).perform()
                 else:
                     if not self.path:
@@ -444,22 +527,59 @@ class GeneralAI(FleeingAI):
 
     def run_away_check(self):
         if self.entity.personality.has_trait("Fearful"):
-            chance = random.randint(1, 100)
+            chance = self.rng.randint(1, 100)
             if self.entity.personality.get_trait_value("Fearful") > chance:
                 return True
             else:
                 return False
 
-    def get_path_to_nearest_room(self) -> List[Tuple[int, int]]:
-        room = random.choice(self.entity.gamemap.rooms)
-        return self.get_path_to(*room.center)
-        # Implement the logic to calculate and return the path to the nearest room.
-        # You can use your existing pathfinding method in the BaseAI class to achieve this.
-        # Return an empty list if no valid path is found.
-        pass  # Replace this with your implementation.
+
+class DesireMap(ApproachMap):
+    """
+    Hill-climbs a weighted mix of desires: approaching or fleeing actors, picking up items, heading for rooms.
+    Positive weights pull the actor towards the points, negative weights push it away.
+    Not part of BaseAI: an AI that weighs several goals at once makes its own, like GeneralAI does to flee. The desires
+    are what the actor wants on this turn, so clear them before adding the next turn's.
+    """
+
+    def __init__(self, entity: Actor, cost_coefficient: int = 10):
+        super().__init__(entity, cost_coefficient)
+        self.desires: List[Tuple[List[Tuple[int, int]], float]] = []
+
+    def clear_desires(self) -> None:
+        self.desires = []
+
+    def add_desire(self, points: List[Tuple[int, int]], weight: float) -> None:
+        if points:
+            self.desires.append((points, weight))
+
+    def approach_actors(self, actors: List[Actor], weight: float = 1.0) -> None:
+        self.add_desire([(actor.x, actor.y) for actor in actors], weight)
+
+    def flee_actors(self, actors: List[Actor], weight: float = 1.2) -> None:
+        self.add_desire([(actor.x, actor.y) for actor in actors], -weight)
+
+    def seek_items(self, items: List[Item], weight: float = 0.5) -> None:
+        self.add_desire([(item.x, item.y) for item in items], weight)
+
+    def seek_rooms(self, weight: float = 0.1) -> None:
+        self.add_desire([room.center for room in self.entity.gamemap.rooms], weight)
+
+    def generate_map(self) -> np.ndarray:
+        return self.entity.gamemap.distance_maps.desire(self.desires, self.cost_coefficient)
+
+    # Hill-climbs the current desires. Passing targets replaces them with approaching those actors.
+    def get_path_to(self, targets: List[Optional[Actor]] = None, coefficient: int = None) -> List[Tuple[int, int]]:
+        if coefficient:
+            self.set_cost_coefficient(coefficient)
+        if targets:
+            self.clear_desires()
+            self.approach_actors(targets)
+        self.approach_map = self.generate_map()
+        path = self.process_map(self.approach_map)
+        return [(index[0], index[1]) for index in path]
 
 
-# TODO: Implement Desire Driven Dijkstra maps.
 # TODO: Consider an AI State Machine
 
 class ConfusedEnemy(BaseAI):
@@ -485,7 +605,7 @@ class ConfusedEnemy(BaseAI):
             self.entity.ai = self.previous_ai
         else:
             # Pick a random direction
-            direction_x, direction_y = random.choice(
+            direction_x, direction_y = self.rng.choice(
                 [
                     (-1, -1),  # Northwest
                     (0, -1),  # North
@@ -82,8 +82,10 @@ class LightningDamageConsumable(Consumable):
         target = None
         closest_distance = self.maximum_range + 1.0
 
-        for actor in self.engine.game_map.actors:
-            if actor is not consumer and self.parent.gamemap.visible[actor.x, actor.y]:
+        for actor in self.engine.game_map.actors_in_radius(
+                consumer.x, consumer.y, closest_distance, visible_only=True
+        ):
+            if actor is not consumer:
                 distance = consumer.distance(actor.x, actor.y)
 
                 if distance < closest_distance:
@@ -164,13 +166,12 @@ class FireballDamageConsumable(Consumable):
             raise Impossible("You cannot target an area that you cannot see.")
 
         targets_hit = False
-        for actor in self.engine.game_map.actors:
-            if actor.distance(*target_xy) <= self.radius:
-                self.engine.message_log.add_message(
-                    f"The {actor.name} is engulfed in a fiery explosion, taking {self.damage} damage!"
-                )
-                actor.fighter.take_damage(self.damage)
-                targets_hit = True
+        for actor in self.engine.game_map.actors_in_radius(*target_xy, self.radius):
+            self.engine.message_log.add_message(
+                f"The {actor.name} is engulfed in a fiery explosion, taking {self.damage} damage!"
+            )
+            actor.fighter.take_damage(self.damage)
+            targets_hit = True
 
         if not targets_hit:
             raise Impossible("There are no targets in the radius.")
@@ -49,10 +49,10 @@ class Weapon(Equippable):
         # Implement logic to calculate the combat rating based on the weapon's properties
         pass
 
-    def roll_damage(self) -> int:
+    def roll_damage(self, rng: random.Random) -> int:
         """Roll the damage for the weapon."""
         num_dice, num_sides = self.damage_dice
-        total_damage = sum(random.randint(1, num_sides) for _ in range(num_dice))
+        total_damage = sum(rng.randint(1, num_sides) for _ in range(num_dice))
         return total_damage
 
     def damage_range(self) -> str:
@@ -251,7 +251,7 @@ class Wand(MagicWeapon):
         if self.active_skill:
             return self.active_skill.unit
 
-    def roll_damage(self) -> int:
+    def roll_damage(self, rng: random.Random) -> int:
         # Wands don't have damage die, so they can't deal damage.
         return 0
 
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import math
-from typing import TYPE_CHECKING, List
+from collections import deque
+from typing import TYPE_CHECKING, Deque
 
 import color
 from components.base_component import BaseComponent
@@ -10,6 +11,9 @@ from render_order import RenderOrder
 if TYPE_CHECKING:
     from entity import Actor
 
+# Damage log entries kept per fighter. Only the last one is read, to credit whoever landed the killing blow.
+DAMAGE_LOG_LENGTH = 16
+
 
 class Fighter(BaseComponent):
     parent: Actor
@@ -40,7 +44,7 @@ class Fighter(BaseComponent):
         self.critical_damage: float
         self.max_time: float = 6
         self._time = self.max_time
-        self.damage_log: List[DamageLogEntry] = []
+        self.damage_log: Deque[DamageLogEntry] = deque(maxlen=DAMAGE_LOG_LENGTH)
 
     @property
     def time(self) -> float:
@@ -73,6 +77,7 @@ class Fighter(BaseComponent):
         return amount_recovered
 
     def take_damage(self, amount: int) -> None:
+        self.engine.dormancy.make_noise(self.parent.x, self.parent.y)
         self.hp -= amount
 
     @property
@@ -99,6 +104,7 @@ class Fighter(BaseComponent):
         self.parent.ai = None
         self.parent.name = f"remains of {self.parent.name}"
         self.parent.render_order = RenderOrder.CORPSE
+        self.gamemap.actor_died(self.parent)
         if self.parent != self.engine.player:
             most_recent_damage_entry = self.damage_log[-1]
             attacker = most_recent_damage_entry.source_entity
@@ -228,6 +234,8 @@ class Fighter(BaseComponent):
     #             return
 
     def create_damage_log(self, category: str, source_entity: Actor, details: str = None):
+        # Fighting is loud, wake up anything sleeping nearby.
+        self.engine.dormancy.make_noise(self.parent.x, self.parent.y)
         self.add_damage_log_entry(DamageLogEntry(category, source_entity, details))
 
     def set_stats(self):
@@ -254,7 +262,18 @@ class Fighter(BaseComponent):
 
 
 class DamageLogEntry:
+    # A save reads an attacker on another floor without loading that floor, until the attacker is asked for.
+    lazy_references = ("_source_entity",)
+
     def __init__(self, category: str, source_entity: Actor, details: str):
         self.type = category
-        self.source_entity = source_entity
+        self._source_entity = source_entity
         self.details = details
+
+    @property
+    def source_entity(self) -> Actor:
+        from savefile import EntityReference
+
+        if isinstance(self._source_entity, EntityReference):
+            self._source_entity = self._source_entity.resolve()
+        return self._source_entity
@@ -34,10 +34,14 @@ class DamageCalculator:
                 self.skill = skill
                 self.unit = unit
 
+    @property
+    def rng(self) -> random.Random:
+        return self.attacker.gamemap.engine.rng.combat
+
     def base_damage(self):
         base_damage = 0
         if self.weapon:
-            base_damage += self.weapon.equippable.roll_damage()
+            base_damage += self.weapon.equippable.roll_damage(self.rng)
         if self.unit:
             base_damage += self.unit.calculate_base_damage(self.unit.damage_components)
         return base_damage
@@ -173,7 +177,7 @@ class DamageCalculator:
             final_damage = damage - defense
         else:
             # Try to crit:
-            if base_critical_hit_chance > 100 or random.randint(1, 100) < base_critical_hit_chance:
+            if base_critical_hit_chance > 100 or self.rng.randint(1, 100) < base_critical_hit_chance:
                 print("Crit")
                 final_damage = (damage - (defense / 2)) * base_critical_hit_multiplier
             else:
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Hashable, Iterable, Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore
+import tcod
+
+if TYPE_CHECKING:
+    from game_map import GameMap
+
+FLEE_WEIGHT = 1.2  # How strongly fleeing actors are pushed away from their threats.
+# Desire maps are summed in fixed point, in steps of 1 / DESIRE_SCALE of a tile's cost, so that small weights aren't
+# truncated away when the weighted distances are cast back to integers.
+DESIRE_SCALE = 10
+
+
+def approach_map(cost: np.ndarray, goals: Iterable[Tuple[int, int]]) -> np.ndarray:
+    """Return the distance from every tile to the nearest of the goal tiles."""
+    dist = tcod.path.maxarray(cost.shape, dtype=np.int32, order="F")
+    for x, y in goals:
+        dist[x, y] = 0
+    tcod.path.dijkstra2d(dist, cost, 1, 2, out=dist)
+    return dist
+
+
+def desire_map(cost: np.ndarray, weighted_maps: Iterable[Tuple[np.ndarray, float]]) -> np.ndarray:
+    """Sum approach maps scaled by their weights, and rescan the result with Dijkstra."""
+    dist = np.zeros(cost.shape, dtype=np.int64, order="F")
+    for approach, weight in weighted_maps:
+        dist += (approach * (weight * DESIRE_SCALE)).astype(np.int64)
+    tcod.path.dijkstra2d(dist, cost, DESIRE_SCALE, 2 * DESIRE_SCALE, out=dist)
+    return dist
+
+
+class PathCosts:
+    """
+    The walking cost of every tile, kept up to date instead of being rebuilt for each path request.
+
+    The base layer is the walkable array as int8 and is only rebuilt when the tiles change. For each coefficient in
+    use there is a cost array of base plus `coefficient` per blocking entity, which the map's SpatialIndex keeps
+    current by calling blocker_changed whenever a blocker arrives on or leaves a tile.
+    `revision` is bumped every time that happens, so with the tiles revision it names the costs as they are.
+    The arrays are shared and must not be written to by their users.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self.tiles_revision = -1
+        self.revision = 0
+        self.base = np.zeros((0, 0), dtype=np.int8)
+        self.costs: Dict[int, np.ndarray] = {}
+
+    def __getstate__(self) -> dict:
+        # Rebuilt from the tiles and spatial index on first use.
+        state = self.__dict__.copy()
+        state.update(tiles_revision=-1, base=np.zeros((0, 0), dtype=np.int8), costs={})
+        return state
+
+    def cost(self, coefficient: int) -> np.ndarray:
+        """Return the cost array for blockers weighing `coefficient`."""
+        gamemap = self.gamemap
+        if self.tiles_revision != gamemap.tiles_revision:
+            self.base = np.array(gamemap.tiles["walkable"], dtype=np.int8, order="F")
+            self.costs.clear()
+            self.tiles_revision = gamemap.tiles_revision
+        cost = self.costs.get(coefficient)
+        if cost is None:
+            cost = self.base + (coefficient * gamemap.spatial_index.blockers * self.base).astype(np.int8)
+            self.costs[coefficient] = cost
+        return cost
+
+    def blocker_changed(self, x: int, y: int, delta: int) -> None:
+        """Called when `delta` blockers arrive on (positive) or leave (negative) a tile."""
+        self.revision += 1
+        if self.costs and self.base[x, y]:
+            for coefficient, cost in self.costs.items():
+                cost[x, y] += coefficient * delta
+
+
+class DistanceMapRegistry:
+    """
+    Dijkstra distance maps shared by every actor on a GameMap, keyed by their goals.
+
+    The first actor that wants to approach a set of goal tiles in a round pays for the map, and every other actor
+    heading to the same tiles that round hill-climbs the same array. Flee maps and other weighted mixes of approach
+    maps ("desire maps") are cached the same way, so every actor running from the same threats shares one map.
+    The costs come from the map's PathCosts. Keys include the tiles revision and the costs' revision, so a map is
+    only reused while the tiles are the same and no blocker has moved, and an actor always gets the map of the costs
+    as they are on its turn, whether it was computed then or earlier. Everything is dropped when the scheduler's
+    round changes.
+    Returned arrays are shared and read-only.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self.round = -1
+        self.maps: Dict[Hashable, np.ndarray] = {}
+
+    def __getstate__(self) -> dict:
+        # Only valid for the round they were made in.
+        state = self.__dict__.copy()
+        state.update(round=-1, maps={})
+        return state
+
+    def _check_round(self) -> None:
+        current_round = self.gamemap.scheduler.current_round
+        if current_round != self.round:
+            self.round = current_round
+            self.maps.clear()
+
+    def cost_map(self, coefficient: int) -> np.ndarray:
+        """Return the walking cost of every tile, with `coefficient` added for each entity blocking it."""
+        return self.gamemap.path_costs.cost(coefficient)
+
+    def revision(self) -> Tuple[int, int]:
+        """Name the state the maps are computed from: the tiles and the blockers on them."""
+        return self.gamemap.tiles_revision, self.gamemap.path_costs.revision
+
+    @staticmethod
+    def approach_key(goals: Iterable[Tuple[int, int]], coefficient: int, revision: Tuple[int, int]) -> Hashable:
+        return "approach", tuple(sorted(set(goals))), coefficient, revision
+
+    @staticmethod
+    def desire_key(
+            desires: Sequence[Tuple[Iterable[Tuple[int, int]], float]], coefficient: int, revision: Tuple[int, int]
+    ) -> Hashable:
+        desires = tuple((tuple(sorted(set(goals))), float(weight)) for goals, weight in desires)
+        return "desire", desires, coefficient, revision
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._check_round()
+        return key in self.maps
+
+    def store(self, key: Hashable, dist: np.ndarray) -> np.ndarray:
+        """Add a map computed elsewhere, keeping the existing one if there is one."""
+        self._check_round()
+        if key not in self.maps:
+            dist.flags.writeable = False
+            self.maps[key] = dist
+        return self.maps[key]
+
+    def _get(self, key: Hashable) -> Optional[np.ndarray]:
+        self._check_round()
+        dist = self.maps.get(key)
+        if dist is not None:
+            self.gamemap.engine.profiler.count("distance_map_hit")
+        return dist
+
+    def approach(self, goals: Iterable[Tuple[int, int]], coefficient: int) -> np.ndarray:
+        """Return the distance from every tile to the nearest of the goal tiles."""
+        goals = tuple(goals)
+        key = self.approach_key(goals, coefficient, self.revision())
+        dist = self._get(key)
+        if dist is None:
+            dist = self.store(key, approach_map(self.cost_map(coefficient), goals))
+            self.gamemap.engine.profiler.count("distance_map_miss")
+        return dist
+
+    def desire(self, desires: Sequence[Tuple[Iterable[Tuple[int, int]], float]], coefficient: int) -> np.ndarray:
+        """Combine the approach maps of several sets of goals, each scaled by a weight, into one map to hill-climb.
+
+        Positive weights attract and negative weights repel. The sum is rescanned with Dijkstra so that actors
+        being pushed away look for the best way out rather than just the nearest tile further from the goals.
+        """
+        desires = [(tuple(goals), weight) for goals, weight in desires]
+        key = self.desire_key(desires, coefficient, self.revision())
+        dist = self._get(key)
+        if dist is None:
+            weighted_maps = [(self.approach(goals, coefficient), weight) for goals, weight in desires]
+            dist = self.store(key, desire_map(self.cost_map(coefficient), weighted_maps))
+            self.gamemap.engine.profiler.count("distance_map_miss")
+        return dist
+
+    def flee(self, threats: Iterable[Tuple[int, int]], coefficient: int, weight: float = FLEE_WEIGHT) -> np.ndarray:
+        """Return the map for running away from the threat tiles."""
+        return self.desire([(threats, -weight)], coefficient)
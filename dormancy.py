@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+    from game_map import GameMap
+
+
+class DormancyManager:
+    """
+    Moves actors that are far away from the player into the turn scheduler's sleep tier, so their AI isn't run.
+
+    An actor falls asleep when it is further than `sleep_radius` from the player, is not in view, has no target and
+    is not in the player's room or a room connected to it. It wakes as soon as one of those stops being true, or when
+    a noise is made within earshot. On waking, it catches up on the status effects, conditions and cooldowns of the
+    rounds it slept through.
+    Sleeping actors don't move or pick targets, so they only need checking when the player's view changes, and then
+    only the ones near the player or in the rooms around them: the spatial index finds the first, and sleeping actors
+    are filed by the rooms they're in for the second. Awake actors are checked again when they or the player's view
+    have changed.
+    """
+
+    def __init__(self, engine: Engine, wake_radius: int = 12, sleep_radius: int = 16, catch_up_limit: int = 30):
+        self.engine = engine
+        self.wake_radius = wake_radius
+        self.sleep_radius = sleep_radius
+        self.catch_up_limit = catch_up_limit
+        self.enabled = True
+        self._reset(None)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for name in ("_game_map", "_view", "_checked", "_sleeping_in", "_rooms"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._reset(None)
+
+    def _reset(self, game_map: Optional[GameMap]) -> None:
+        """Start tracking a map, filing the actors already asleep on it by room."""
+        self._game_map = game_map
+        self._view: Optional[Tuple[int, int, int, int]] = None  # The player's view at the last update.
+        self._checked: Dict[Actor, Tuple[int, int, bool]] = {}  # Awake actor -> where it was last checked.
+        self._sleeping_in: Dict[Actor, Set[int]] = {}  # Sleeping actor -> the rooms it's filed under.
+        self._rooms: Dict[int, Dict[Actor, None]] = {}  # Room -> the actors asleep in it.
+        if game_map is not None:
+            for actor in game_map.scheduler.dormant:
+                self._file(actor)
+
+    def _file(self, actor: Actor) -> None:
+        rooms = self._sleeping_in[actor] = self._game_map.rooms_at(actor.x, actor.y)
+        for room in rooms:
+            self._rooms.setdefault(room, {})[actor] = None
+
+    def _unfile(self, actor: Actor) -> None:
+        for room in self._sleeping_in.pop(actor, ()):
+            self._rooms[room].pop(actor, None)
+
+    def active_rooms(self) -> Set[int]:
+        """Return the rooms the player is in or next to, where no actor is allowed to sleep."""
+        game_map = self.engine.game_map
+        player = self.engine.player
+        rooms = game_map.rooms_at(player.x, player.y)
+        active = set(rooms)
+        for room in rooms:
+            active |= game_map.room_neighbours(room)
+        return active
+
+    def is_active(self, actor: Actor, radius: int, active_rooms: Set[int]) -> bool:
+        player = self.engine.player
+        game_map = self.engine.game_map
+        if max(abs(actor.x - player.x), abs(actor.y - player.y)) <= radius:
+            return True
+        if game_map.visible[actor.x, actor.y]:
+            return True
+        if getattr(actor.ai, "target", None) is not None:
+            return True
+        return not game_map.rooms_at(actor.x, actor.y).isdisjoint(active_rooms)
+
+    def wake_candidates(self, active_rooms: Set[int]) -> List[Actor]:
+        """Return the sleeping actors that could be close enough, in view, or in the active rooms."""
+        game_map = self.engine.game_map
+        dormant = game_map.scheduler.dormant
+        player = self.engine.player
+        sight_range = player.fighter.sight_range
+        if sight_range <= 0:  # An unlimited view could see anyone.
+            return list(dormant)
+        radius = max(self.wake_radius, sight_range)
+        candidates = {actor: None for actor in game_map.actors_in_square(player.x, player.y, radius) if actor in dormant}
+        for room in sorted(active_rooms):
+            candidates.update(self._rooms.get(room, {}))
+        return list(candidates)
+
+    def update(self) -> None:
+        """Wake the sleeping actors that have become relevant, then put the irrelevant ones to sleep."""
+        game_map = self.engine.game_map
+        scheduler = game_map.scheduler
+        if game_map is not self._game_map:
+            self._reset(game_map)
+        if not self.enabled:
+            for actor in list(scheduler.dormant):
+                self.wake(actor)
+            return
+
+        player = self.engine.player
+        view = (player.x, player.y, player.fighter.sight_range, game_map.tiles_revision)
+        view_changed = view != self._view
+        self._view = view
+        active_rooms: Optional[Set[int]] = None
+        if view_changed:
+            active_rooms = self.active_rooms()
+            for actor in self.wake_candidates(active_rooms):
+                if not actor.is_alive:
+                    self._unfile(actor)
+                    scheduler.unschedule(actor)
+                elif self.is_active(actor, self.wake_radius, active_rooms):
+                    self.wake(actor)
+
+        checked = {}
+        for actor in scheduler.awake():
+            if actor is player:
+                continue
+            place = (actor.x, actor.y, getattr(actor.ai, "target", None) is None)
+            if not view_changed and self._checked.get(actor) == place:
+                checked[actor] = place
+                continue
+            if active_rooms is None:
+                active_rooms = self.active_rooms()
+            if self.is_active(actor, self.sleep_radius, active_rooms):
+                checked[actor] = place
+            else:
+                scheduler.sleep(actor)
+                self._file(actor)
+        self._checked = checked
+
+    def wake(self, actor: Actor) -> None:
+        """Return an actor to the turn order and catch it up on what it slept through."""
+        if actor.gamemap is self._game_map:
+            self._unfile(actor)
+        rounds = actor.gamemap.scheduler.wake(actor)
+        for _ in range(min(rounds, self.catch_up_limit)):
+            actor.status_effect_manager.update_effects()
+            actor.conditions_manager.reduce_conditions_duration()
+            actor.abilities.update_cooldowns()
+        actor.fighter.time = actor.fighter.max_time
+
+    def make_noise(self, x: int, y: int, radius: int = 10) -> None:
+        """Wake every sleeping actor within `radius` tiles of a noise."""
+        game_map = self.engine.game_map
+        dormant = game_map.scheduler.dormant
+        for actor in game_map.actors_in_square(x, y, radius):
+            if actor in dormant:
+                self.wake(actor)
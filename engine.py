@@ -1,64 +1,122 @@
 from __future__ import annotations
 
-import lzma
-import random
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List, Optional
 
-import dill
 from tcod.console import Console
 from tcod.map import compute_fov
 
 import color
 import exceptions
 import render_functions
+import savefile
+from dormancy import DormancyManager
 from faction_factories import humanoid_faction, demihuman_faction, monster_faction
 from message_log import MessageLog
+from prefetch import AIPrefetcher
+from profiler import TurnProfiler
+from rng import RNGService
 
 if TYPE_CHECKING:
     from entity import Actor
     from game_map import GameMap, GameWorld
+    from journal import ActionJournal
 
 
 class Engine:
     game_map: GameMap
     game_world: GameWorld
 
-    def __init__(self, player: Actor):
+    def __init__(self, player: Actor, seed: Optional[int] = None):
         self.message_log = MessageLog()
+        self.rng = RNGService(seed)
         self.player = player
         self.mouse_location = (0, 0)
+        self.dormancy = DormancyManager(self)
+        self.profiler = TurnProfiler()
+        self.prefetcher = AIPrefetcher()
 
         # Create a turn based system
 
     def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
-            if entity.ai:
-                try:
-                    if entity.fighter.time > 0:
-                        while entity.fighter.time > 0:
-                            if entity.ai:
-                                entity.ai.perform()
-                                if entity.level.requires_level_up:
-                                    level_up_options = entity.level.level_up_options
-                                    level_up_option = random.choice(level_up_options)
-                                    level_up_option()
-                except exceptions.Impossible:
-                    pass  # Ignore impossible action exceptions from AI.
-                # parent.status_effect_manager.add_effect(regeneration_effect)
+        """Run one round of turns for every actor the current map's scheduler has due."""
+        scheduler = self.game_map.scheduler
+        profiler = self.profiler
+        with profiler.phase("dormancy"):
+            self.dormancy.update()
+        due = list(scheduler.due_actors())
+        try:
+            self.run_turns(due)
+        finally:
+            # An error in one actor's turn mustn't drop the rest of the round from the schedule.
+            scheduler.requeue_taken()
+
+    def run_turns(self, due: List[Actor]) -> None:
+        scheduler = self.game_map.scheduler
+        profiler = self.profiler
+        with profiler.phase("prefetch"):
+            self.prefetcher.prefetch(self.game_map, due)
+        for entity in due:
+            if entity is self.player or not entity.is_alive or entity.parent is not self.game_map:
+                scheduler.unschedule(entity)
+                continue
+            try:
+                with profiler.phase("ai.perform"):
+                    while entity.fighter.time > 0:
+                        if entity.ai:
+                            entity.ai.perform()
+                            if entity.level.requires_level_up:
+                                level_up_options = entity.level.level_up_options
+                                level_up_option = self.rng.actor(entity).choice(level_up_options)
+                                level_up_option()
+                        else:
+                            break
+            except exceptions.Impossible:
+                pass  # Ignore impossible action exceptions from AI.
+            # parent.status_effect_manager.add_effect(regeneration_effect)
+            with profiler.phase("status_effects"):
                 entity.status_effect_manager.update_effects()
+            with profiler.phase("conditions"):
                 entity.conditions_manager.reduce_conditions_duration()
+            with profiler.phase("cooldowns"):
                 entity.abilities.update_cooldowns()
-                entity.fighter.time = entity.fighter.max_time
+            if entity.is_alive:
+                scheduler.end_turn(entity)
+            else:
+                scheduler.unschedule(entity)
 
     def update_fov(self) -> None:
-        """Recompute the visible area based on the players point of view."""
-        self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=self.player.fighter.sight_range,
-        )
+        """Recompute the visible area based on the players point of view.
+
+        Nothing is done if the player hasn't moved and the tiles haven't changed since the last update. Otherwise, only
+        the box covered by the old view and the box covered by the new one are touched.
+        """
+        game_map = self.game_map
+        x, y, radius = self.player.x, self.player.y, self.player.fighter.sight_range
+        origin = (x, y, radius, game_map.tiles_revision)
+        if origin == game_map.fov_origin:
+            self.profiler.count("fov_update_skipped")
+            return
+
+        if radius > 0:
+            bounds = (
+                slice(max(0, x - radius), min(game_map.width, x + radius + 1)),
+                slice(max(0, y - radius), min(game_map.height, y + radius + 1)),
+            )
+            visible = compute_fov(
+                game_map.tiles["transparent"][bounds],
+                (x - bounds[0].start, y - bounds[1].start),
+                radius=radius,
+            )
+        else:  # A radius of 0 means an unlimited view.
+            bounds = (slice(0, game_map.width), slice(0, game_map.height))
+            visible = game_map.compute_fov(x, y, radius)
+
+        game_map.visible[game_map.fov_bounds] = False
+        game_map.visible[bounds] = visible
         # If a tile is "visible" it should be added to "explored".
-        self.game_map.explored |= self.game_map.visible
+        game_map.explored[bounds] |= visible
+        game_map.fov_origin = origin
+        game_map.fov_bounds = bounds
 
     def render(self, console: Console) -> None:
         self.game_map.render(console)
@@ -115,10 +173,10 @@ class Engine:
             console=console, x=21, y=44, engine=self
         )
         render_functions.render_equipment_details(console=console,player=self.player)
+        if self.profiler.enabled:
+            self.profiler.render(console)
 
 
-    def save_as(self, filename: str) -> None:
-        """Save this Engine instance as a compressed file."""
-        save_data = lzma.compress(dill.dumps(self))
-        with open(filename, "wb") as f:
-            f.write(save_data)
+    def save_as(self, filename: str, journal: Optional[ActionJournal] = None) -> None:
+        """Save this Engine instance in the save file format, as a checkpoint of the journal if there is one."""
+        savefile.save_engine(self, filename, journal)
@@ -1,11 +1,10 @@
 from __future__ import annotations
 
-import copy
 import math
 from typing import Tuple, TypeVar, TYPE_CHECKING, Optional, Type, Union, List
 
-from tcod.map import compute_fov
 
+import prototypes
 from components.Faction import FactionComponent
 from components.Personality import Personality
 from damageType import ElementalType
@@ -33,6 +32,10 @@ T = TypeVar("T", bound="Entity")
 
 class Entity:
     parent: Union[GameMap, Inventory]
+    prototype_id: Optional[str] = None  # The entity_factories name of the prototype this was made from.
+    rng_number: Optional[int] = None  # The number of this actor's stream in the RNGService, once it has one.
+    save_uid: Optional[int] = None  # Names this entity in every chunk of a save, from the first time it's saved.
+    paged_floor: Optional[int] = None  # The floor this was paged out with, while something else still refers to it.
 
     """
     A generic object to represent players, enemies, items, etc.
@@ -59,7 +62,7 @@ class Entity:
         if parent:
             # If gamemap isn't provided now then it will be set later.
             self.parent = parent
-            parent.entities.add(self)
+            parent.add_entity(self)
 
     @property
     def gamemap(self) -> GameMap:
@@ -67,11 +70,11 @@ class Entity:
 
     def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
         """Spawn a copy of this instance at the given location."""
-        clone = copy.deepcopy(self)
+        clone = prototypes.instantiate(self)
         clone.x = x
         clone.y = y
         clone.parent = gamemap
-        gamemap.entities.add(clone)
+        gamemap.add_entity(clone)
         return clone
 
     def distance(self, x: int, y: int) -> float:
@@ -84,6 +87,7 @@ class Entity:
         # Move the parent by a given amount
         self.x += dx
         self.y += dy
+        self.gamemap.spatial_index.update(self)
 
     def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
         """Place this parent at a new location.  Handles moving across GameMaps."""
@@ -92,9 +96,11 @@ class Entity:
         if gamemap:
             if hasattr(self, "parent"):  # Possibly uninitialized.
                 if self.parent is self.gamemap:
-                    self.gamemap.entities.remove(self)
+                    self.gamemap.remove_entity(self)
             self.parent = gamemap
-            gamemap.entities.add(self)
+            gamemap.add_entity(self)
+        elif hasattr(self, "parent"):
+            self.gamemap.spatial_index.update(self)
 
 
 class Actor(Entity):
@@ -169,14 +175,24 @@ class Actor(Entity):
         self.faction_manager.init_racial_faction()
 
     def spawn(self: T, gamemap: GameMap, x: int, y: int) -> T:
-        super().spawn(gamemap, x, y)
-        if gamemap:
-            if hasattr(self, "parent"):  # Possibly uninitialized.
-                if self.parent is self.gamemap:
-                    self.gamemap.entities.remove(self)
-            self.parent = gamemap
-            gamemap.entities.add(self)
+        """Spawn a copy of this actor and queue it on the map's turn scheduler."""
+        clone = super().spawn(gamemap, x, y)
+        gamemap.scheduler.schedule(clone)
+        gamemap.visibility.invalidate()
+        return clone
 
+    def move(self, dx: int, dy: int) -> None:
+        super().move(dx, dy)
+        self.gamemap.visibility.refresh_actor(self)
+
+    def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
+        super().place(x, y, gamemap)
+        if gamemap:
+            gamemap.visibility.invalidate()
+            if self.is_alive and self is not gamemap.engine.player:
+                gamemap.scheduler.schedule(self)
+        else:
+            self.gamemap.visibility.refresh_actor(self)
 
     @property
     def is_alive(self) -> bool:
@@ -185,8 +201,7 @@ class Actor(Entity):
 
     def has_direct_los(self, target_x: int, target_y: int):
         # Perform ray casting to check for direct line of sight
-        visible_map = compute_fov(self.gamemap.tiles["transparent"], (self.x, self.y),
-                                  radius=self.fighter.sight_range, )
+        visible_map = self.gamemap.compute_fov(self.x, self.y, self.fighter.sight_range)
         if target_x == self.x and target_y == self.y:
             return False
         dx = int(target_x - self.x)
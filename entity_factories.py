@@ -1,4 +1,5 @@
 import components
+import prototypes
 from components import consumable, equippable_factories
 from components.Faction import FactionComponent
 from components.Personality import Personality
@@ -173,3 +174,5 @@ Mage_Orb = Item(char="*", color=(0, 0, 255), name="Mage Orb", equippable=equippa
 
 Fireball_Wand = Item(char="~", color=(255, 30, 0), name="Wand of Fireball",
                      equippable=equippable_factories.fireball_wand)
+
+prototypes.register(globals())
@@ -1,18 +1,28 @@
 from __future__ import annotations
 
-from typing import Iterable, TYPE_CHECKING, Optional, Iterator, List
+from collections import OrderedDict
+from typing import Callable, Iterable, TYPE_CHECKING, Optional, Dict, KeysView, List, Set, Tuple
 
 import numpy as np  # type: ignore
+import tcod.los
+import tcod.path
 from tcod.console import Console
+from tcod.map import compute_fov
 from entity import Actor, Item
 import tile_types
+from distance_maps import DistanceMapRegistry, PathCosts
 from exceptions import Impossible
+from room_graph import RoomGraph
+from scheduler import TurnScheduler
+from spatial_index import SpatialIndex
+from visibility import VisibilityTable
 
 
 if TYPE_CHECKING:
     from entity import Entity
     from engine import Engine
     from procgen import RectangularRoom
+    from savefile import FloorArchive
 
 
 class GameMap:
@@ -21,7 +31,15 @@ class GameMap:
     ):
         self.engine = engine
         self.width, self.height = width, height
-        self.entities = set(entities)
+        self.entities = set()
+        # Insertion ordered, so iterating them is the same from run to run.
+        self._live_actors: Dict[Actor, None] = {}
+        self._corpses: Dict[Actor, None] = {}
+        self._items: Dict[Item, None] = {}
+        self.path_costs = PathCosts(self)
+        self.spatial_index = SpatialIndex(width, height, on_blocker_change=self.path_costs.blocker_changed)
+        for entity in entities:
+            self.add_entity(entity)
         self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
         self.visible = np.full(
             (width, height), fill_value=False, order="F"
@@ -33,6 +51,33 @@ class GameMap:
         self.corridors = []
         self.downstairs_location = (0, 0)
         self.upstairs_location = (0, 0)
+        self.scheduler = TurnScheduler()
+        self._room_index: Optional[np.ndarray] = None
+        self._corridor_index: Optional[np.ndarray] = None
+        self._room_neighbours: List[Set[int]] = []
+        self._corridor_rooms: List[Set[int]] = []
+        # Bumped whenever tiles change, so anything derived from them knows to recompute.
+        self.tiles_revision = 0
+        self.fov_cache_size = 256
+        self.fov_cache_hits = 0
+        self.fov_cache_misses = 0
+        self._fov_cache: OrderedDict[Tuple[int, int, int, int], np.ndarray] = OrderedDict()
+        self.room_field_cache_size = 16
+        self._room_fields: OrderedDict[Tuple[int, int], np.ndarray] = OrderedDict()
+        self.visibility = VisibilityTable(self)
+        self.distance_maps = DistanceMapRegistry(self)
+        self.room_graph = RoomGraph(self)
+        # The player's view the visible array was last computed for, and the part of the map it covers.
+        self.fov_origin: Optional[Tuple[int, int, int, int]] = None
+        self.fov_bounds: Tuple[slice, slice] = (slice(0, width), slice(0, height))
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_fov_cache"] = OrderedDict()  # Cheap to rebuild, so don't save it.
+        state["_room_fields"] = OrderedDict()
+        # Rebuilt from the rooms and corridors on first use.
+        state.update(_room_index=None, _corridor_index=None, _room_neighbours=[], _corridor_rooms=[])
+        return state
 
     def in_bounds(self, x: int, y: int) -> bool:
         """Return True if x and y are inside the bounds of this map."""
@@ -43,18 +88,206 @@ class GameMap:
         return self
 
     @property
-    def items(self) -> Iterator[Item]:
-        yield from (entity for entity in self.entities if isinstance(entity, Item))
+    def items(self) -> KeysView[Item]:
+        """The items lying on this map. Iterate over a copy if items may be picked up while iterating."""
+        return self._items.keys()
+
+    @property
+    def actors(self) -> KeysView[Actor]:
+        """This maps living actors. Iterate over a copy if actors may die while iterating."""
+        return self._live_actors.keys()
 
     @property
-    def actors(self) -> Iterator[Actor]:
-        """Iterate over this maps living actors."""
-        yield from (
-            entity
-            for entity in self.entities
-            if isinstance(entity, Actor) and entity.is_alive
+    def corpses(self) -> KeysView[Actor]:
+        return self._corpses.keys()
+
+    def add_entity(self, entity: Entity) -> None:
+        self.entities.add(entity)
+        self.spatial_index.add(entity)
+        if isinstance(entity, Actor):
+            if entity.is_alive:
+                self._live_actors[entity] = None
+            else:
+                self._corpses[entity] = None
+        elif isinstance(entity, Item):
+            self._items[entity] = None
+
+    def remove_entity(self, entity: Entity) -> None:
+        self.entities.remove(entity)
+        self.spatial_index.remove(entity)
+        self._live_actors.pop(entity, None)
+        self._corpses.pop(entity, None)
+        self._items.pop(entity, None)
+
+    def actor_died(self, actor: Actor) -> None:
+        """Move an actor that just died from the living actors to the corpses."""
+        if actor in self._live_actors:
+            del self._live_actors[actor]
+            self._corpses[actor] = None
+        self.spatial_index.update(actor)
+        self.engine.rng.forget(actor)
+
+    def entities_at(self, x: int, y: int) -> List[Entity]:
+        """Return every entity on this tile."""
+        return self.spatial_index.at(x, y)
+
+    def _actors_in_box(
+            self, x: int, y: int, radius: int, shape: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]],
+            visible_only: bool,
+    ) -> List[Actor]:
+        """Return the living actors within `radius` of (x, y), where shape(dx, dy) is True if a shape is given."""
+        x0, x1 = max(0, x - radius), min(self.width, x + radius + 1)
+        y0, y1 = max(0, y - radius), min(self.height, y + radius + 1)
+        if x0 >= x1 or y0 >= y1:
+            return []
+        mask = None
+        if shape is not None:
+            dx, dy = np.ogrid[x0 - x:x1 - x, y0 - y:y1 - y]
+            mask = shape(dx, dy)
+        if visible_only:
+            visible = self.visible[x0:x1, y0:y1]
+            mask = visible if mask is None else mask & visible
+        return [
+            actor
+            for actor in self.spatial_index.blocking_in(x0, y0, x1, y1, mask)
+            if isinstance(actor, Actor) and actor.is_alive
+        ]
+
+    def actors_in_radius(self, x: int, y: int, radius: float, visible_only: bool = False) -> List[Actor]:
+        """Return the living actors whose Entity.distance from (x, y) is at most `radius`."""
+        return self._actors_in_box(
+            x, y, int(radius), lambda dx, dy: dx * dx + dy * dy <= radius * radius, visible_only
         )
 
+    def actors_in_square(self, x: int, y: int, radius: int, visible_only: bool = False) -> List[Actor]:
+        """Return the living actors at most `radius` steps away from (x, y), diagonals included."""
+        return self._actors_in_box(x, y, radius, None, visible_only)
+
+    def actors_in_cone(
+            self, x: int, y: int, target_x: int, target_y: int, radius: float, angle: float = 90,
+            visible_only: bool = False,
+    ) -> List[Actor]:
+        """Return the living actors within `radius` of (x, y) and `angle` degrees wide around the target direction."""
+        direction = np.arctan2(target_y - y, target_x - x)
+        half_angle = np.radians(angle) / 2 + 1e-9  # Keep tiles exactly on the edge.
+
+        def shape(dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+            offset = np.abs((np.arctan2(dy, dx) - direction + np.pi) % (2 * np.pi) - np.pi)
+            return (dx * dx + dy * dy <= radius * radius) & (offset <= half_angle) & ((dx != 0) | (dy != 0))
+
+        return self._actors_in_box(x, y, int(radius), shape, visible_only)
+
+    def actors_in_line(
+            self, x: int, y: int, target_x: int, target_y: int, visible_only: bool = False
+    ) -> List[Actor]:
+        """Return the living actors on the line from (x, y) to the target, nearest first, excluding (x, y)."""
+        found = []
+        for line_x, line_y in tcod.los.bresenham((x, y), (target_x, target_y)).tolist()[1:]:
+            if not self.in_bounds(line_x, line_y) or (visible_only and not self.visible[line_x, line_y]):
+                continue
+            actor = self.get_actor_at_location(line_x, line_y)
+            if actor:
+                found.append(actor)
+        return found
+
+    def mark_tiles_changed(self) -> None:
+        """Call after changing self.tiles, to invalidate everything computed from the old tiles."""
+        self.tiles_revision += 1
+        self._fov_cache.clear()
+        self._room_fields.clear()
+        self._room_index = None
+
+    def compute_fov(self, x: int, y: int, radius: int) -> np.ndarray:
+        """Return the field of view from (x, y), reusing a cached result when one exists.
+
+        The returned array is shared with the cache and is read-only.
+        """
+        key = (int(x), int(y), int(radius), self.tiles_revision)
+        fov = self._fov_cache.get(key)
+        if fov is not None:
+            self._fov_cache.move_to_end(key)
+            self.fov_cache_hits += 1
+            self.engine.profiler.count("fov_cache_hit")
+            return fov
+
+        self.fov_cache_misses += 1
+        self.engine.profiler.count("fov_cache_miss")
+        return self.store_fov(x, y, radius, compute_fov(self.tiles["transparent"], (key[0], key[1]), radius=key[2]))
+
+    def has_fov(self, x: int, y: int, radius: int) -> bool:
+        return (int(x), int(y), int(radius), self.tiles_revision) in self._fov_cache
+
+    def store_fov(self, x: int, y: int, radius: int, fov: np.ndarray) -> np.ndarray:
+        """Add a field of view computed elsewhere to the cache, and return it read-only."""
+        fov.flags.writeable = False
+        self._fov_cache[int(x), int(y), int(radius), self.tiles_revision] = fov
+        if len(self._fov_cache) > self.fov_cache_size:
+            self._fov_cache.popitem(last=False)
+        return fov
+
+    def room_distance_field(self, room: int) -> np.ndarray:
+        """Return the walking distance from every tile to the center of a room, computed on first use.
+
+        Only the `room_field_cache_size` most recently used fields are kept. The returned array is shared and read-only.
+        """
+        key = (room, self.tiles_revision)
+        field = self._room_fields.get(key)
+        if field is not None:
+            self._room_fields.move_to_end(key)
+            self.engine.profiler.count("room_field_hit")
+            return field
+
+        field = tcod.path.maxarray((self.width, self.height), dtype=np.int32, order="F")
+        field[self.rooms[room].center] = 0
+        tcod.path.dijkstra2d(field, self.tiles["walkable"].astype(np.int8), 2, 3, out=field)
+        field.flags.writeable = False
+        self._room_fields[key] = field
+        if len(self._room_fields) > self.room_field_cache_size:
+            self._room_fields.popitem(last=False)
+        self.engine.profiler.count("room_field_miss")
+        return field
+
+    def build_room_index(self) -> None:
+        """Map every tile to the room and corridor covering it, and work out which rooms corridors connect."""
+        self._room_index = np.full((self.width, self.height), fill_value=-1, dtype=np.int16, order="F")
+        self._corridor_index = np.full((self.width, self.height), fill_value=-1, dtype=np.int16, order="F")
+        for i, room in enumerate(self.rooms):
+            self._room_index[room.inner] = i
+        for i, corridor in enumerate(self.corridors):
+            for x, y in corridor.corridor_points:
+                if self.in_bounds(x, y):
+                    self._corridor_index[x, y] = i
+
+        room_numbers = {room: i for i, room in enumerate(self.rooms)}
+        self._room_neighbours = [set() for _ in self.rooms]
+        self._corridor_rooms = []
+        for corridor in self.corridors:
+            connected = {room_numbers[room] for room in corridor.connected_rooms if room in room_numbers}
+            self._corridor_rooms.append(connected)
+            for i in connected:
+                self._room_neighbours[i] |= connected - {i}
+
+    def rooms_at(self, x: int, y: int) -> Set[int]:
+        """Return the indices of the rooms at this tile: the room itself, or the rooms a corridor joins.
+
+        The set may be shared with the room index, so copy it before changing it.
+        """
+        if self._room_index is None:
+            self.build_room_index()
+        room = int(self._room_index[x, y])
+        if room >= 0:
+            return {room}
+        corridor = int(self._corridor_index[x, y])
+        if corridor >= 0:
+            return self._corridor_rooms[corridor]
+        return set()
+
+    def room_neighbours(self, room: int) -> Set[int]:
+        """Return the indices of the rooms directly connected to this one by a corridor."""
+        if self._room_index is None:
+            self.build_room_index()
+        return self._room_neighbours[room]
+
     def is_tile_blocked(self, x: int, y: int):
         x, y = int(x), int(y)
         if self.engine.game_map.tiles["transparent"][x, y]:
@@ -65,20 +298,12 @@ class GameMap:
     def get_blocking_entity_at_location(
             self, location_x: int, location_y: int,
     ) -> Optional[Entity]:
-        for entity in self.entities:
-            if (
-                    entity.blocks_movement
-                    and entity.x == location_x
-                    and entity.y == location_y
-            ):
-                return entity
-
-        return None
+        return self.spatial_index.blocking_at(location_x, location_y)
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-        for actor in self.actors:
-            if actor.x == x and actor.y == y:
-                return actor
+        for entity in self.spatial_index.at(x, y):
+            if isinstance(entity, Actor) and entity.is_alive:
+                return entity
 
         return None
 
@@ -113,6 +338,11 @@ class GameWorld:
     Holds the settings for the GameMap, and generates new maps when moving down the stairs.
     """
 
+    # The save this world was loaded from or last saved to, which holds the floors that haven't been loaded yet.
+    archive: Optional[FloorArchive] = None
+    # Floors kept in memory at most. The least recently visited of the rest are paged out to disk. None keeps all.
+    resident_limit: Optional[int] = None
+
     def __init__(
             self,
             *,
@@ -150,19 +380,63 @@ class GameWorld:
             engine=self.engine,
         )
         self.maps[self.current_floor] = self.engine.game_map
+        if self.archive:
+            self.archive.visit(self.current_floor)
+
+    def floor_archive(self) -> FloorArchive:
+        """Return the archive, making one for a world that hasn't been saved or loaded yet."""
+        if self.archive is None:
+            from savefile import FloorArchive
+
+            self.archive = FloorArchive(None, self.maps)
+        return self.archive
+
+    def has_floor(self, floor: int) -> bool:
+        archive = self.archive
+        return floor in self.maps or (archive is not None and (floor in archive.floors or floor in archive.pages))
+
+    def enter_floor(self, floor: int) -> None:
+        """Make a floor that has been generated the current one, loading it if it isn't loaded."""
+        self.current_floor = floor
+        if floor in self.maps:
+            self.engine.game_map = self.maps[floor]
+            if self.archive:
+                self.archive.stats["hits"] += 1
+        else:
+            with self.engine.profiler.phase("page_in"):
+                self.engine.game_map = self.archive.load_floor(floor)
+            self.archive.stats["misses"] += 1
+        if self.archive:
+            self.archive.clean.discard(floor)  # It's about to change, so the next save has to write it.
+            self.archive.visit(floor)
+
+    def limit_resident_floors(self) -> None:
+        """Page out the least recently visited floors, other than the current one, down to resident_limit."""
+        if self.resident_limit is None or len(self.maps) <= self.resident_limit:
+            return
+        archive = self.floor_archive()
+        # Floors read in for a reference, and never visited, go first, then the furthest away.
+        order = {floor: rank for rank, floor in enumerate(archive.visits)}
+        floors = sorted(
+            (floor for floor in self.maps if floor != self.current_floor),
+            key=lambda floor: (order.get(floor, -1), -abs(floor - self.current_floor)),
+        )
+        with self.engine.profiler.phase("page_out"):
+            for floor in floors[:len(self.maps) - max(self.resident_limit, 1)]:
+                archive.page_out(self.engine, floor)
 
     def move_up(self):
         if self.current_floor != 1:
-            self.current_floor -= 1
-            self.engine.game_map = self.maps[self.current_floor]
+            self.enter_floor(self.current_floor - 1)
             self.engine.player.place(*self.engine.game_map.downstairs_location, self.engine.game_map)
+            self.limit_resident_floors()
         else:
             raise Impossible("You are already on the top most floor.")
 
     def move_down(self):
-        if (self.current_floor + 1) in self.maps:
-            self.current_floor += 1
-            self.engine.game_map = self.maps[self.current_floor]
+        if self.has_floor(self.current_floor + 1):
+            self.enter_floor(self.current_floor + 1)
             self.engine.player.place(*self.engine.game_map.upstairs_location, self.engine.game_map)
         else:
             self.generate_floor()
+        self.limit_resident_floors()
@@ -0,0 +1,210 @@
+"""Run the game without a tcod context or console, for soak testing, balancing and throughput measurements."""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Type
+
+import numpy as np  # type: ignore
+import tcod
+
+import actions
+import setup_game
+from autosave import AUTOSAVE_INTERVAL, Autosaver
+from journal import ActionJournal
+from game_map import GameWorld
+from input_handlers import BaseEventHandler, MainGameEventHandler
+from replay import SessionRecorder
+from spatial_index import SpatialIndex
+
+if TYPE_CHECKING:
+    from actions import Action
+    from engine import Engine
+
+DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+class BotPolicy:
+    """Decides the player's next action. Subclasses implement choose_action."""
+
+    def choose_action(self, engine: Engine) -> Action:
+        raise NotImplementedError()
+
+
+class WaitBot(BotPolicy):
+    """Does nothing but wait, so every turn is spent on the rest of the floor."""
+
+    def choose_action(self, engine: Engine) -> Action:
+        return actions.WaitAction(engine.player)
+
+
+class RandomWalkBot(BotPolicy):
+    """Bumps in a random direction, attacking whatever is there, and waits when out of time."""
+
+    def choose_action(self, engine: Engine) -> Action:
+        player = engine.player
+        if player.fighter.time < actions.MovementAction(player, 0, 0).time_cost:
+            return actions.WaitAction(player)
+        return actions.BumpAction(player, *random.choice(DIRECTIONS))
+
+
+class DescendBot(BotPolicy):
+    """Attacks adjacent enemies, otherwise walks to the down stairs and takes them."""
+
+    def __init__(self):
+        self.path = []
+
+    def adjacent_enemy(self, engine: Engine):
+        player = engine.player
+        for actor in engine.game_map.actors:
+            if actor is not player and max(abs(actor.x - player.x), abs(actor.y - player.y)) == 1:
+                return actor
+        return None
+
+    def path_to_stairs(self, engine: Engine):
+        game_map = engine.game_map
+        cost = np.array(game_map.tiles["walkable"], dtype=np.int8)
+        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+        pathfinder = tcod.path.Pathfinder(graph)
+        pathfinder.add_root((engine.player.x, engine.player.y))
+        return [tuple(point) for point in pathfinder.path_to(game_map.downstairs_location)[1:].tolist()]
+
+    def choose_action(self, engine: Engine) -> Action:
+        player = engine.player
+        if (player.x, player.y) == engine.game_map.downstairs_location:
+            self.path = []
+            return actions.TakeDownStairsAction(player)
+        if player.fighter.time < actions.MovementAction(player, 0, 0).time_cost:
+            return actions.WaitAction(player)
+
+        enemy = self.adjacent_enemy(engine)
+        if enemy:
+            return actions.BumpAction(player, enemy.x - player.x, enemy.y - player.y)
+
+        if not self.path or max(abs(self.path[0][0] - player.x), abs(self.path[0][1] - player.y)) != 1:
+            self.path = self.path_to_stairs(engine)
+        if not self.path:
+            return actions.BumpAction(player, *random.choice(DIRECTIONS))
+        dest_x, dest_y = self.path.pop(0)
+        return actions.BumpAction(player, dest_x - player.x, dest_y - player.y)
+
+
+BOTS: Dict[str, Type[BotPolicy]] = {
+    "wait": WaitBot,
+    "random": RandomWalkBot,
+    "descend": DescendBot,
+}
+
+
+class HeadlessRunner:
+    """Drives an Engine with a bot policy and no rendering, counting turns as it goes."""
+
+    def __init__(self, engine: Engine, policy: BotPolicy):
+        self.engine = engine
+        self.policy = policy
+        self.handler = MainGameEventHandler(engine)
+        self.turns = 0
+        self.actions = 0
+        self.elapsed = 0.0
+
+    def step(self) -> bool:
+        """Perform one player action, and the enemy turns it triggers. Returns True if a turn passed."""
+        engine = self.engine
+        player = engine.player
+        time_before = player.fighter.time
+        turn_passed = self.handler.handle_action(self.policy.choose_action(engine))
+        if not turn_passed and player.fighter.time == time_before:
+            # The action was impossible, spend the turn instead of retrying it forever.
+            turn_passed = self.handler.handle_action(actions.WaitAction(player))
+        self.actions += 1
+
+        if player.is_alive and player.level.requires_level_up:
+            options = player.level.level_up_options
+            option = random.randrange(len(options))
+            if self.handler.recorder:
+                self.handler.recorder.record_level_up(option)
+            if self.handler.journal:
+                self.handler.journal.record_level_up(option)
+            options[option]()
+        if turn_passed:
+            self.turns += 1
+        return bool(turn_passed)
+
+    def run(self, max_turns: int, max_floors: Optional[int] = None) -> None:
+        """Run until the turn or floor limit is reached, or the player dies."""
+        start = time.perf_counter()
+        while self.turns < max_turns and self.engine.player.is_alive:
+            if max_floors and self.engine.game_world.current_floor > max_floors:
+                break
+            self.step()
+        self.elapsed += time.perf_counter() - start
+
+    @property
+    def turns_per_second(self) -> float:
+        return self.turns / self.elapsed if self.elapsed else 0.0
+
+    def report(self) -> str:
+        engine = self.engine
+        status = "alive" if engine.player.is_alive else "dead"
+        return (
+            f"{self.turns} turns ({self.actions} actions) in {self.elapsed:.2f}s: "
+            f"{self.turns_per_second:.1f} turns/sec, reached floor {engine.game_world.current_floor}, player {status}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the game headless with a bot player.")
+    parser.add_argument("--turns", type=int, default=1000, help="Number of turns to run.")
+    parser.add_argument("--floors", type=int, default=None, help="Stop after leaving this floor.")
+    parser.add_argument("--bot", choices=sorted(BOTS), default="descend", help="Player policy.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the game and the bots.")
+    parser.add_argument("--workers", type=int, default=None, help="Threads for the AI prefetch, 0 for none.")
+    parser.add_argument("--check-index", action="store_true", help="Verify the spatial index on every lookup.")
+    parser.add_argument("--profile", metavar="PATH", default=None, help="Write a per-turn profile trace here.")
+    parser.add_argument("--record", metavar="PATH", default=None, help="Record the session for replay.py.")
+    parser.add_argument("--autosave", metavar="PATH", default=None, help="Autosave the game to this file.")
+    parser.add_argument("--autosave-interval", type=int, default=AUTOSAVE_INTERVAL, help="Turns between autosaves.")
+    parser.add_argument("--journal", action="store_true", help="Journal the actions between autosaves.")
+    parser.add_argument("--resident-floors", type=int, default=None, help="Floors kept in memory, the rest paged out.")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    SpatialIndex.debug = args.check_index
+    GameWorld.resident_limit = args.resident_floors
+    engine = setup_game.new_game(args.seed)
+    if args.record:
+        BaseEventHandler.recorder = SessionRecorder(args.record, engine.rng.seed, "actions")
+    if args.autosave:
+        journal = None
+        if args.journal:
+            journal = BaseEventHandler.journal = ActionJournal(f"{args.autosave}.journal")
+            journal.reset()
+        BaseEventHandler.autosaver = Autosaver(args.autosave, args.autosave_interval, journal)
+    runner = HeadlessRunner(engine, BOTS[args.bot]())
+    if args.workers is not None:
+        runner.engine.prefetcher.workers = args.workers
+    if args.profile:
+        runner.engine.profiler.enabled = True
+    runner.run(args.turns, args.floors)
+    if runner.handler.recorder:
+        runner.handler.recorder.close(engine)
+    print(runner.report())
+    autosaver = runner.handler.autosaver
+    if autosaver:
+        autosaver.wait(engine)
+        print(f"{autosaver.saves} autosaves, last snapshot took {autosaver.snapshot_ms:.1f} ms on the main thread")
+    if runner.handler.journal:
+        runner.handler.journal.close()
+    archive = engine.game_world.archive
+    if archive:
+        print("  floor cache " + ", ".join(f"{name} {value}" for name, value in archive.metrics().items()))
+    if args.profile:
+        runner.engine.profiler.dump_json(args.profile)
+        for name, values in runner.engine.profiler.summary().items():
+            print(f"  {name:<18} p50 {values['p50']:8.3f} ms  p99 {values['p99']:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
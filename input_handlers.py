@@ -22,6 +22,9 @@ if TYPE_CHECKING:
     from engine import Engine
     from entity import Item
     from components.SkillComponent import ActiveSkill
+    from autosave import Autosaver
+    from journal import ActionJournal
+    from replay import SessionRecorder
 
 MOVE_KEYS = {
     # Arrow keys.
@@ -74,6 +77,10 @@ MainGameEventHandler will become the active handler.
 
 
 class BaseEventHandler(tcod.event.EventDispatch[ActionOrHandler]):
+    recorder: Optional[SessionRecorder] = None  # Set while a session is being recorded for replay.
+    autosaver: Optional[Autosaver] = None  # Set when the game saves itself every so many turns.
+    journal: Optional[ActionJournal] = None  # Set when the actions since the last save are journaled.
+
     def handle_events(self, event: tcod.event.Event) -> BaseEventHandler:
         """Handle an event and return the next active event handler."""
         state = self.dispatch(event)
@@ -115,20 +122,30 @@ class EventHandler(BaseEventHandler):
         """
         if action is None:
             return False
+        if self.recorder:
+            self.recorder.record_action(action)
+        if self.journal:
+            self.journal.record_action(action)
 
+        profiler = self.engine.profiler
         try:
             if self.engine.player.fighter.time >= action.time_cost:  # Check if player has enough time to perform the action.
-                action.perform()
-                self.engine.update_fov()
+                with profiler.phase("player_action"):
+                    action.perform()
+                with profiler.phase("update_fov"):
+                    self.engine.update_fov()
         except exceptions.Impossible as exc:
             self.engine.message_log.add_message(exc.args[0], color.impossible)
             return False  # Skip enemy turn on exceptions.
 
         if self.engine.player.fighter.time <= 0:
             # self.engine.player.status_effect_manager.add_effect(regeneration_effect)
-            self.engine.player.status_effect_manager.update_effects()
-            self.engine.player.abilities.update_cooldowns()
-            self.engine.player.conditions_manager.reduce_conditions_duration()
+            with profiler.phase("status_effects"):
+                self.engine.player.status_effect_manager.update_effects()
+            with profiler.phase("cooldowns"):
+                self.engine.player.abilities.update_cooldowns()
+            with profiler.phase("conditions"):
+                self.engine.player.conditions_manager.reduce_conditions_duration()
             if self.engine.player.equipment.weapon:
                 weapon = self.engine.player.equipment.weapon
                 if weapon.equippable.equipment_type == EquipmentType.WEAPON:
@@ -136,12 +153,22 @@ class EventHandler(BaseEventHandler):
                         if weapon.equippable.category == "Wand":
                             weapon.equippable.update_cooldowns()
             self.engine.player.fighter.time = self.engine.player.fighter.max_time
-            self.engine.handle_enemy_turns()
-            self.engine.update_fov()  # Update the FOV before the players next action.
+            with profiler.phase("enemy_turns"):
+                self.engine.handle_enemy_turns()
+            with profiler.phase("update_fov"):
+                self.engine.update_fov()  # Update the FOV before the players next action.
+            profiler.end_turn()
+            if self.recorder:
+                self.recorder.end_turn(self.engine)
+            if self.journal:
+                self.journal.end_turn()
+            if self.autosaver:
+                self.autosaver.end_turn(self.engine)
             return True
 
     def on_render(self, console: tcod.Console) -> None:
-        self.engine.render(console)
+        with self.engine.profiler.phase("render"):
+            self.engine.render(console)
 
     def ev_mousemotion(self, event: tcod.event.MouseMotion) -> None:
         if self.engine.game_map.in_bounds(event.tile.x, event.tile.y):
@@ -223,6 +250,11 @@ class MainGameEventHandler(EventHandler):
             return CharacterScreenEventHandler(self.engine)
         elif key == tcod.event.KeySym.SLASH:
             return LookHandler(self.engine)
+        elif key == tcod.event.KeySym.F3:
+            self.engine.profiler.toggle()
+        elif key == tcod.event.KeySym.F4:
+            self.engine.profiler.dump_json("turn_profile.json")
+            self.engine.message_log.add_message("Turn profile written to turn_profile.json.")
 
         # No valid key was pressed
         return action
@@ -243,8 +275,12 @@ class MainGameEventHandler(EventHandler):
 class GameOverEventHandler(EventHandler):
     def on_quit(self) -> None:
         """Handle exiting out of a finished game."""
+        if self.autosaver:
+            self.autosaver.wait(self.engine)  # Or it could write the save again after it's deleted.
         if os.path.exists("savegame.sav"):
             os.remove("savegame.sav")  # Deletes the active save file.
+        if self.journal:
+            self.journal.reset()
         raise exceptions.QuitWithoutSaving()  # Avoid saving a finished game.
 
     def ev_quit(self, event: tcod.event.Quit) -> None:
@@ -666,20 +702,19 @@ class LevelUpEventHandler(AskUserEventHandler):
         index = key - tcod.event.KeySym.a
 
         if 0 <= index <= 6:
-            if index == 0:
-                player.level.increase_constitution()
-            elif index == 1:
-                player.level.increase_strength()
-            elif index == 2:
-                player.level.increase_dexterity()
-            elif index == 3:
-                player.level.increase_agility()
-            elif index == 4:
-                player.level.increase_magic()
-            elif index == 5:
-                player.level.increase_awareness()
-            else:
-                player.level.increase_charisma()
+            level = player.level
+            choice = [
+                level.increase_constitution,
+                level.increase_strength,
+                level.increase_dexterity,
+                level.increase_agility,
+                level.increase_magic,
+                level.increase_awareness,
+                level.increase_charisma,
+            ][index]
+            if self.journal:
+                self.journal.record_level_up(level.level_up_options.index(choice))
+            choice()
         else:
             self.engine.message_log.add_message("Invalid entry.", color.invalid)
 
@@ -0,0 +1,138 @@
+"""Journal the player's actions between saves, so a game that crashes can be rebuilt from its last save."""
+from __future__ import annotations
+
+import json
+import os
+import traceback
+from typing import TYPE_CHECKING, List, Optional
+
+import color
+import input_handlers
+from replay import decode_action, encode_action
+
+if TYPE_CHECKING:
+    from actions import Action
+    from engine import Engine
+
+SYNC_INTERVAL = 10  # Turns between fsyncs of the journal.
+
+
+class ActionJournal:
+    """
+    An append-only log of every action the player takes, and every level-up choice, since the last save.
+
+    Each save is given a checkpoint token, kept in its manifest, and a ["checkpoint", token] record is appended when
+    it's taken. Loading the save then replays the records after its checkpoint on top of it, which brings the game
+    back to where it was when the journal was last written. A save written in the background only replaces the last
+    one once it's done, so the journal keeps the records since the last save that made it to disk, and is cut back to
+    start at the new checkpoint once the new save is in place.
+    Records are flushed to the OS at the end of every turn, which is enough to survive the game crashing, and synced
+    to disk every `sync_interval` turns, which bounds what a power cut loses.
+    """
+
+    def __init__(self, path: str, sync_interval: int = SYNC_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.turns = 0  # Turns since the last fsync.
+        self.checkpoint: Optional[str] = None  # The checkpoint of the last save on disk, if the journal follows one.
+        self.records: List[list] = []  # Everything in the file, to rewrite it from a checkpoint.
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: list) -> None:
+        self.records.append(record)
+        self.file.write(json.dumps(record, separators=(",", ":")))
+        self.file.write("\n")
+
+    def record_action(self, action: Action) -> None:
+        self.write(encode_action(action))
+
+    def record_level_up(self, option: int) -> None:
+        self.write(["level_up", option])
+
+    def record_checkpoint(self, checkpoint: str) -> None:
+        """Note that a save with this checkpoint has been taken, to replay the records that follow on top of it."""
+        self.write(["checkpoint", checkpoint])
+        self.sync()
+
+    def end_turn(self) -> None:
+        self.file.flush()
+        self.turns += 1
+        if self.turns >= self.sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.turns = 0
+
+    def committed(self, checkpoint: str) -> None:
+        """Drop the records from before a checkpoint whose save is now on disk."""
+        self.checkpoint = checkpoint
+        marker = ["checkpoint", checkpoint]
+        if marker in self.records:
+            start = len(self.records) - self.records[::-1].index(marker) - 1
+            self.rewrite(self.records[start:])
+
+    def reset(self) -> None:
+        """Empty the journal, for a new game, or one that's over."""
+        self.checkpoint = None
+        self.rewrite([])
+
+    def rewrite(self, records: List[list]) -> None:
+        """Replace the file with these records, in one step, so a crash leaves either the old or the new one."""
+        self.file.close()
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.records = list(records)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.turns = 0
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def recover(self, engine: Engine) -> int:
+        """Replay the records that follow the checkpoint of the save engine was loaded from.
+
+        Returns how many were replayed. The journal then carries on from that checkpoint.
+        """
+        archive = engine.game_world.archive
+        checkpoint = archive.checkpoint if archive else None
+        records = []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break  # The end of a record that was cut off by the crash.
+        except FileNotFoundError:
+            pass
+        marker = ["checkpoint", checkpoint]
+        if checkpoint is None or marker not in records:
+            self.reset()
+            return 0
+        records = records[len(records) - records[::-1].index(marker):]
+        records = [record for record in records if record[0] != "checkpoint"]
+
+        # Replaying doesn't journal, record or autosave the actions a second time.
+        handler = input_handlers.MainGameEventHandler(engine)
+        handler.journal = handler.recorder = handler.autosaver = None
+        for record in records:
+            try:
+                if record[0] == "level_up":
+                    engine.player.level.level_up_options[record[1]]()
+                else:
+                    handler.handle_action(decode_action(engine, record))
+            except Exception:  # Logged the same way as in the game loop, which then carries on.
+                engine.message_log.add_message(traceback.format_exc(), color.error)
+        self.checkpoint = checkpoint
+        self.rewrite([marker, *records])
+        return len(records)
@@ -1,4 +1,7 @@
+import argparse
+import random
 import traceback
+from typing import Optional
 
 import tcod
 
@@ -6,16 +9,25 @@ import color
 import exceptions
 import input_handlers
 import setup_game
+from autosave import AUTOSAVE_INTERVAL, Autosaver
+from game_map import GameWorld
+from journal import ActionJournal
+from replay import SessionRecorder
 
 
 def save_game(handler: input_handlers.BaseEventHandler, filename: str) -> None:
     """If the current event handler has an active Engine then save it."""
     if isinstance(handler, input_handlers.EventHandler):
-        handler.engine.save_as(filename)
+        handler.engine.save_as(filename, handler.journal)
         print("Game saved.")
 
 
-def main() -> None:
+def main(
+        record: Optional[str] = None,
+        seed: Optional[int] = None,
+        autosave_interval: int = AUTOSAVE_INTERVAL,
+        resident_floors: Optional[int] = None,
+) -> None:
     screen_width = 80
     screen_height = 50
 
@@ -23,7 +35,19 @@ def main() -> None:
         "dejavu10x10_gs_tc.png", 32, 8, tcod.tileset.CHARMAP_TCOD
     )
 
-    handler: input_handlers.BaseEventHandler = setup_game.MainMenu()
+    recorder = None
+    if record:
+        if seed is None:
+            seed = random.getrandbits(64)
+        recorder = input_handlers.BaseEventHandler.recorder = SessionRecorder(record, seed, "events")
+
+    GameWorld.resident_limit = resident_floors
+    # The journal is cleared or replayed by the main menu, when a game is started or continued.
+    journal = input_handlers.BaseEventHandler.journal = ActionJournal("savegame.sav.journal")
+    if autosave_interval > 0:
+        input_handlers.BaseEventHandler.autosaver = Autosaver("savegame.sav", autosave_interval, journal)
+
+    handler: input_handlers.BaseEventHandler = setup_game.MainMenu(seed)
     with tcod.context.new_terminal(
             screen_width,
             screen_height,
@@ -41,6 +65,8 @@ def main() -> None:
                 try:
                     for event in tcod.event.wait():
                         context.convert_event(event)
+                        if recorder:
+                            recorder.record_event(event)
                         handler = handler.handle_events(event)
                 except Exception:  # Handle exceptions in game.
                     traceback.print_exc()  # Print error to stderr.
@@ -55,9 +81,25 @@ def main() -> None:
             save_game(handler, "savegame.sav")
             raise
         except BaseException:  # Save on any other unexpected exception.
-            save_game(handler, "savegame.sav")
+            # The state may be halfway through a turn. If there's a save to replay the journal on, that has it all.
+            if journal.checkpoint is None:
+                save_game(handler, "savegame.sav")
             raise
+        finally:
+            journal.close()
+            if recorder:
+                recorder.close(getattr(handler, "engine", None))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Play the game.")
+    parser.add_argument("--record", metavar="PATH", default=None, help="Record the session for replay.py.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for new games.")
+    parser.add_argument(
+        "--autosave-interval", type=int, default=AUTOSAVE_INTERVAL, help="Turns between autosaves, 0 for none."
+    )
+    parser.add_argument(
+        "--resident-floors", type=int, default=None, help="Floors kept in memory, the rest paged out to disk."
+    )
+    args = parser.parse_args()
+    main(args.record, args.seed, args.autosave_interval, args.resident_floors)
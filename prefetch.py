@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np  # type: ignore
+from tcod.map import compute_fov
+
+from distance_maps import FLEE_WEIGHT, DistanceMapRegistry, approach_map, desire_map
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+
+def _fov_job(job: Tuple[np.ndarray, int, int, int]) -> np.ndarray:
+    transparent, x, y, radius = job
+    return compute_fov(transparent, (x, y), radius=radius)
+
+
+def _distance_job(job: Tuple[str, np.ndarray, Tuple[Tuple[int, int], ...], Optional[np.ndarray]]) -> List[np.ndarray]:
+    kind, cost, goals, approach = job
+    if approach is None:
+        approach = approach_map(cost, goals)
+    if kind == "flee":
+        return [approach, desire_map(cost, [(approach, -FLEE_WEIGHT)])]
+    return [approach]
+
+
+class AIPrefetcher:
+    """
+    Computes the fields of view and distance maps that the actors due this round are about to ask for, before any
+    of them act.
+
+    This is the read-only half of the AI's work, and the part spent in tcod, which releases the GIL, so with
+    `workers` above zero it runs on a thread pool. The main thread waits for the pool, so the workers all see the
+    map as it was at the start of the round. Results are then stored in the map's caches in the order the actors
+    are due, and the actors take their turns one at a time in the same order as before, each acting on the current
+    state of the map. Two actors heading for the same tile is therefore settled by turn order as usual.
+    Distance maps are stored under the revision of the path costs they were computed from, so an actor whose costs
+    have changed by its turn, because a blocker before it moved, gets a map of the costs as they are then, the same
+    as it would with prefetching turned off.
+    Nothing here depends on how many workers there are, so a seeded game plays out the same with any number,
+    including zero, where the same work is done on the main thread, and the same as with `enabled` off.
+    """
+
+    def __init__(self, workers: int = min(4, (os.cpu_count() or 1) - 1)):
+        self.enabled = True
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_workers = 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def _map(self, function: Callable, jobs: List) -> List:
+        if self.workers <= 0 or len(jobs) < 2:
+            return [function(job) for job in jobs]
+        if self._executor is None or self._executor_workers != self.workers:
+            if self._executor:
+                self._executor.shutdown()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ai-prefetch")
+            self._executor_workers = self.workers
+        return list(self._executor.map(function, jobs))
+
+    def prefetch(self, gamemap: GameMap, actors: Iterable[Actor]) -> None:
+        if not self.enabled:
+            return
+        actors = [actor for actor in actors if actor.is_alive and actor.parent is gamemap]
+        self.prefetch_fov(gamemap, actors)
+        self.prefetch_distance_maps(gamemap, actors)
+
+    def prefetch_fov(self, gamemap: GameMap, actors: List[Actor]) -> None:
+        """Compute the fields of view the visibility table will need for these actors."""
+        if gamemap.visibility.dirty:
+            actors = list(gamemap.actors)  # It'll be rebuilt, which needs everyone's.
+        views = [
+            (actor.x, actor.y, actor.fighter.sight_range)
+            for actor in actors
+            if not gamemap.has_fov(actor.x, actor.y, actor.fighter.sight_range)
+        ]
+        views = list(dict.fromkeys(views))
+        transparent = gamemap.tiles["transparent"]
+        for view, fov in zip(views, self._map(_fov_job, [(transparent, *view) for view in views])):
+            gamemap.store_fov(*view, fov)
+        gamemap.engine.profiler.count("prefetch_fov", len(views))
+
+    def prefetch_distance_maps(self, gamemap: GameMap, actors: List[Actor]) -> None:
+        """Compute the approach and flee maps the actors are planning to use."""
+        registry = gamemap.distance_maps
+        revision = registry.revision()
+        jobs: Dict[Hashable, Tuple[List[Hashable], tuple]] = {}
+        for actor in actors:
+            plan = actor.ai.planned_map()
+            if plan is None:
+                continue
+            kind, goals, coefficient = plan
+            goals = tuple(sorted(set(goals)))
+            keys = [DistanceMapRegistry.approach_key(goals, coefficient, revision)]
+            if kind == "flee":
+                keys.append(DistanceMapRegistry.desire_key([(goals, -FLEE_WEIGHT)], coefficient, revision))
+            if keys[-1] in registry or keys[-1] in jobs:
+                continue
+            approach = registry.maps.get(keys[0]) if keys[0] in registry else None
+            jobs[keys[-1]] = keys, (kind, registry.cost_map(coefficient), goals, approach)
+
+        batch = list(jobs.values())
+        for (keys, _), results in zip(batch, self._map(_distance_job, [job for _, job in batch])):
+            for key, dist in zip(keys, results):
+                registry.store(key, dist)
+        gamemap.engine.profiler.count("prefetch_distance_maps", len(batch))
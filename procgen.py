@@ -46,6 +46,7 @@ def get_entities_at_random(
         weighted_chances_by_floor: Dict[int, List[Tuple[Entity, int]]],
         number_of_entities: int,
         floor: int,
+        rng: random.Random,
 ) -> List[Entity]:
     entity_weighted_chances = {}
 
@@ -62,7 +63,7 @@ def get_entities_at_random(
     entities = list(entity_weighted_chances.keys())
     entity_weighted_chance_values = list(entity_weighted_chances.values())
 
-    chosen_entities = random.choices(
+    chosen_entities = rng.choices(
         entities, weights=entity_weighted_chance_values, k=number_of_entities
     )
 
@@ -144,6 +145,7 @@ def generate_dungeon(
     """Generate a new dungeon map."""
     player = engine.player
     dungeon = GameMap(engine, map_width, map_height, entities=[player])
+    rng = engine.rng.procgen(engine.game_world.current_floor)
 
     rooms: List[RectangularRoom] = []
     corridors: List[Corridor] = []
@@ -151,11 +153,11 @@ def generate_dungeon(
     center_of_last_room = (0, 0)
 
     for r in range(max_rooms):
-        room_width = random.randint(room_min_size, room_max_size)
-        room_height = random.randint(room_min_size, room_max_size)
+        room_width = rng.randint(room_min_size, room_max_size)
+        room_height = rng.randint(room_min_size, room_max_size)
 
-        x = random.randint(0, dungeon.width - room_width - 1)
-        y = random.randint(0, dungeon.height - room_height - 1)
+        x = rng.randint(0, dungeon.width - room_width - 1)
+        y = rng.randint(0, dungeon.height - room_height - 1)
 
         # "RectangularRoom" class makes rectangles easier to work with
         new_room = RectangularRoom(x, y, room_width, room_height)
@@ -180,9 +182,9 @@ def generate_dungeon(
         place_entities(new_room, dungeon, engine.game_world.current_floor)
         # Finally, append the new room to the list.
         rooms.append(new_room)
-    create_corridors(rooms, corridors)
+    create_corridors(rooms, corridors, rng)
     while any(r.connections is [] for r in rooms):
-        create_corridors(rooms, corridors)
+        create_corridors(rooms, corridors, rng)
     # print(corridors)
     for c in corridors:
         for x, y in c.corridor_points:
@@ -193,16 +195,17 @@ def generate_dungeon(
     dungeon.upstairs_location = upstairs_center
     dungeon.rooms = rooms
     dungeon.corridors = corridors
+    dungeon.mark_tiles_changed()
     return dungeon
 
 
 def tunnel_between(
-        start: Tuple[int, int], end: Tuple[int, int]
+        start: Tuple[int, int], end: Tuple[int, int], rng: random.Random
 ) -> Iterator[Tuple[int, int]]:
     """Return an L-shaped tunnel between these two points."""
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
+    if rng.random() < 0.5:  # 50% chance.
         # Move horizontally, then vertically.
         corner_x, corner_y = x2, y1
     else:
@@ -217,12 +220,12 @@ def tunnel_between(
 
 
 def tunnel_between2(
-        start: Tuple[int, int], end: Tuple[int, int]
+        start: Tuple[int, int], end: Tuple[int, int], rng: random.Random
 ) -> List:
     """Return an L-shaped tunnel between these two points."""
     x1, y1 = start
     x2, y2 = end
-    if random.random() < 0.5:  # 50% chance.
+    if rng.random() < 0.5:  # 50% chance.
         # Move horizontally, then vertically.
         corner_x, corner_y = x2, y1
     else:
@@ -235,15 +238,15 @@ def tunnel_between2(
     return points
 
 
-def create_corridors(rooms: List[RectangularRoom], corridors: List[Corridor]) -> None:
+def create_corridors(rooms: List[RectangularRoom], corridors: List[Corridor], rng: random.Random) -> None:
     for r in rooms:
-        if random.randint(1, 2) == 1:
+        if rng.randint(1, 2) == 1:
             choice = r
             while choice == r:
-                choice = random.choice(rooms)
+                choice = rng.choice(rooms)
             # Dig out a tunnel between this room and the previous one.
             new_corridor = Corridor(r.center, choice.center,
-                                    Algorithim.list_list_to_tuple_list(tunnel_between2(r.center, choice.center)))
+                                    Algorithim.list_list_to_tuple_list(tunnel_between2(r.center, choice.center, rng)))
             for point in new_corridor.corridor_points:
                 for e in rooms:
                     if Algorithim.is_point_inside_room(point,
@@ -327,22 +330,24 @@ def create_corridors(rooms: List[RectangularRoom], corridors: List[Corridor]) ->
 
 
 def place_entities(room: RectangularRoom, dungeon: GameMap, floor_number: int, ) -> None:
-    number_of_monsters = random.randint(
+    rng = dungeon.engine.rng.procgen(floor_number)
+    loot_rng = dungeon.engine.rng.loot(floor_number)
+    number_of_monsters = rng.randint(
         0, get_max_value_for_floor(max_monsters_by_floor, floor_number)
     )
-    number_of_items = random.randint(
+    number_of_items = loot_rng.randint(
         0, get_max_value_for_floor(max_items_by_floor, floor_number)
     )
 
     monsters: List[Entity] = get_entities_at_random(
-        enemy_chances, number_of_monsters, floor_number
+        enemy_chances, number_of_monsters, floor_number, rng
     )
     items: List[Entity] = get_entities_at_random(
-        item_chances, number_of_items, floor_number
+        item_chances, number_of_items, floor_number, loot_rng
     )
     for entity in monsters + items:
-        x = random.randint(room.x1 + 1, room.x2 - 1)
-        y = random.randint(room.y1 + 1, room.y2 - 1)
-        if not any(other.x == x and other.y == y for other in dungeon.entities):
+        x = rng.randint(room.x1 + 1, room.x2 - 1)
+        y = rng.randint(room.y1 + 1, room.y2 - 1)
+        if not dungeon.entities_at(x, y):
             entity.spawn(dungeon, x, y)
 
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Deque, Dict, Iterator
+
+import color
+
+if TYPE_CHECKING:
+    from tcod.console import Console
+
+
+class TurnProfiler:
+    """
+    Opt-in instrumentation that records how long each phase of a turn takes.
+
+    Code wraps a phase in `with profiler.phase("name"):`. Time spent in a phase is summed over the turn, along with
+    the number of times the phase ran, and end_turn closes the turn. The last `window` turns are kept for the rolling
+    p50/p99 overlay, and the last `trace_length` turns are kept in the trace that dump_json writes out, so a long
+    session with the profiler on doesn't keep growing.
+    While disabled, phase returns a do-nothing context manager.
+    """
+
+    def __init__(self, window: int = 200, trace_length: int = 10000):
+        self.enabled = False
+        self.window = window
+        self.trace_length = trace_length
+        self.turn = 0
+        self.samples: Dict[str, Deque[float]] = {}
+        self.trace: Deque[dict] = deque(maxlen=trace_length)
+        self._times: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+
+    def __getstate__(self) -> dict:
+        # Timings are only meaningful for the session they were taken in, so they aren't saved.
+        state = self.__dict__.copy()
+        state.update(enabled=False, samples={}, trace=None, _times={}, _counts={}, _counters={})
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        state.setdefault("trace_length", 10000)
+        state["trace"] = deque(maxlen=state["trace_length"])
+        self.__dict__.update(state)
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+
+    def phase(self, name: str):
+        """Return a context manager timing the code inside it as part of the given phase."""
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._times[name] = self._times.get(name, 0.0) + (time.perf_counter() - start) * 1000
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add to a named counter for this turn, such as cache hits."""
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def end_turn(self) -> None:
+        """Close the current turn, adding its timings to the rolling window and the trace."""
+        if not self.enabled:
+            return
+        self.turn += 1
+        for name, elapsed in self._times.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(elapsed)
+        self.trace.append(
+            {
+                "turn": self.turn,
+                "phases": {
+                    name: {"ms": round(elapsed, 4), "count": self._counts[name]}
+                    for name, elapsed in self._times.items()
+                },
+                "counters": dict(self._counters),
+            }
+        )
+        self._times.clear()
+        self._counts.clear()
+        self._counters.clear()
+
+    def percentile(self, name: str, percent: float) -> float:
+        samples = sorted(self.samples.get(name, ()))
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"p50": self.percentile(name, 50), "p99": self.percentile(name, 99)}
+            for name in sorted(self.samples)
+        }
+
+    def render(self, console: Console, width: int = 36) -> None:
+        """Draw the rolling p50/p99 of every phase in the top right corner of the console."""
+        summary = self.summary()
+        x = console.width - width
+        console.draw_frame(
+            x=x,
+            y=0,
+            width=width,
+            height=len(summary) + 3,
+            title="Turn profile (ms)",
+            clear=True,
+            fg=color.white,
+            bg=color.black,
+        )
+        console.print(x=x + 1, y=1, string=f"{'phase':<18}{'p50':>8}{'p99':>8}", fg=color.welcome_text)
+        for i, (name, values) in enumerate(summary.items()):
+            console.print(x=x + 1, y=i + 2, string=f"{name[:18]:<18}{values['p50']:>8.2f}{values['p99']:>8.2f}")
+
+    def dump_json(self, filename: str) -> None:
+        """Write the per-turn trace and the rolling summary to a JSON file."""
+        with open(filename, "w") as f:
+            json.dump({"summary": self.summary(), "turns": list(self.trace)}, f, indent=1)
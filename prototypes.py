@@ -0,0 +1,156 @@
+"""Make new entities from snapshots of their prototypes in entity_factories, instead of deep-copying them."""
+from __future__ import annotations
+
+import argparse
+import copy
+import io
+import pickle
+import threading
+import time
+import weakref
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type, TypeVar
+
+from damageType import ElementalType
+
+if TYPE_CHECKING:
+    from components.ai import BaseAI
+    from entity import Entity
+
+T = TypeVar("T", bound="Entity")
+
+# Definitions that are never changed after they're made, so every instance can point at the same object.
+SHARED_TYPES = (ElementalType,)
+
+
+class Snapshot:
+    """
+    A prototype pickled once, to be unpickled for every new instance of it.
+
+    Unpickling runs in C and skips the bookkeeping deepcopy does for every object, so it's several times faster.
+    Definition data is left out of the pickle and shared by reference instead: elemental types, and the race's
+    faction and skill tables. The AI isn't copied either, since its state is all per instance and it doesn't hold
+    anything set by the prototype; each instance gets a new one of the same class.
+    Prototypes are treated as read-only once they have been spawned from.
+    """
+
+    def __init__(self, prototype: Entity):
+        self.shared: List[object] = []
+        ai = getattr(prototype, "ai", None)
+        self.ai_cls: Optional[Type[BaseAI]] = type(ai) if ai else None
+
+        flyweights = {id(ai): None} if ai else {}
+        race = getattr(prototype, "race", None)
+        if race:
+            flyweights.update((id(table), table) for table in (race.factions, race.skills) if table is not None)
+
+        def persistent_id(obj: object) -> Optional[int]:
+            if isinstance(obj, SHARED_TYPES) or id(obj) in flyweights:
+                self.shared.append(flyweights.get(id(obj), obj))
+                return len(self.shared) - 1
+            return None
+
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(prototype)
+        self.data = buffer.getvalue()
+
+    def instantiate(self) -> Entity:
+        unpickler = pickle.Unpickler(io.BytesIO(self.data))
+        unpickler.persistent_load = self.shared.__getitem__
+        instance = unpickler.load()
+        if self.ai_cls:
+            instance.ai = self.ai_cls(instance)
+        return instance
+
+
+# Every prototype by name, filled in by register.
+_prototypes: Dict[str, Entity] = {}
+
+
+def register(namespace: Dict[str, object]) -> None:
+    """Name every entity in a module's namespace as a prototype.
+
+    Instances carry the name of the prototype they were made from, so saves can store them as that name plus their
+    changes.
+    """
+    from entity import Entity
+
+    for name, value in namespace.items():
+        if isinstance(value, Entity):
+            value.prototype_id = name
+            _prototypes[name] = value
+
+
+def get(name: str) -> Entity:
+    """Return the prototype registered under name."""
+    if not _prototypes:
+        import entity_factories  # noqa: F401  Registers the prototypes.
+    return _prototypes[name]
+
+
+# Prototypes that couldn't be pickled map to None, and are deep-copied instead.
+_snapshots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# The autosave worker reads and fills _snapshots while it encodes a save, as the main thread spawns entities.
+_snapshots_lock = threading.Lock()
+
+
+def instantiate(prototype: T) -> T:
+    """Return a new instance of a prototype entity, not yet placed anywhere."""
+    with _snapshots_lock:
+        try:
+            snapshot = _snapshots[prototype]
+        except KeyError:
+            try:
+                snapshot = Snapshot(prototype)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                snapshot = None
+            _snapshots[prototype] = snapshot
+    if snapshot is None:
+        return copy.deepcopy(prototype)
+    return snapshot.instantiate()
+
+
+def shared_objects() -> Dict[int, Tuple[str, int]]:
+    """Return, by id, the definition data that instances share with their prototypes instead of copying, and where
+    to find each one again with shared_object."""
+    found: Dict[int, Tuple[str, int]] = {}
+    with _snapshots_lock:
+        snapshots = list(_snapshots.items())
+    for prototype, snapshot in snapshots:
+        if snapshot and prototype.prototype_id:
+            for index, obj in enumerate(snapshot.shared):
+                if obj is not None:
+                    found.setdefault(id(obj), (prototype.prototype_id, index))
+    return found
+
+
+def shared_object(prototype_id: str, index: int) -> object:
+    """Return the definition data shared_objects found."""
+    prototype = get(prototype_id)
+    with _snapshots_lock:
+        return _snapshots[prototype].shared[index]
+
+
+def benchmark(count: int) -> None:
+    """Print how many of each prototype can be made per second, deep-copied and from snapshots."""
+    import entity_factories
+    from entity import Entity
+
+    prototypes = {name: value for name, value in vars(entity_factories).items() if isinstance(value, Entity)}
+    print(f"{'prototype':<20} {'deepcopy/s':>12} {'snapshot/s':>12} {'speedup':>8}")
+    for name, prototype in prototypes.items():
+        rates = []
+        for make in (copy.deepcopy, instantiate):
+            make(prototype)  # Builds the snapshot outside the timing.
+            start = time.perf_counter()
+            for _ in range(count):
+                make(prototype)
+            rates.append(count / (time.perf_counter() - start))
+        print(f"{name:<20} {rates[0]:>12.0f} {rates[1]:>12.0f} {rates[1] / rates[0]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare spawning from snapshots with deep-copying prototypes.")
+    parser.add_argument("--count", type=int, default=2000, help="Instances of each prototype to make.")
+    benchmark(parser.parse_args().count)
@@ -0,0 +1,249 @@
+"""Record play sessions to a compact log, and replay them without a window to reproduce or benchmark them."""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import lzma
+import time
+import traceback
+from typing import TYPE_CHECKING, List, Optional
+
+import tcod
+
+import actions
+import color
+import input_handlers
+import setup_game
+
+if TYPE_CHECKING:
+    from actions import Action
+    from engine import Engine
+
+REPLAY_VERSION = 1
+CHECKSUM_INTERVAL = 100  # Turns between state checksums.
+
+
+class ReplayDivergence(Exception):
+    """Raised when a replayed session stops matching the recorded one."""
+
+
+def state_checksum(engine: Engine) -> str:
+    """Return a short hash of the state a replay has to reproduce: the current floor, its entities, and the RNG."""
+    digest = hashlib.sha1()
+    digest.update(f"{engine.game_world.current_floor}:{engine.player.fighter.time};".encode())
+    for entity in sorted(engine.game_map.entities, key=lambda e: (e.x, e.y, e.name)):
+        fighter = getattr(entity, "fighter", None)
+        digest.update(f"{entity.name},{entity.x},{entity.y},{fighter.hp if fighter else ''};".encode())
+    for name, stream in sorted(engine.rng.streams.items()):
+        digest.update(f"{name}{stream.getstate()};".encode())
+    return digest.hexdigest()[:16]
+
+
+def encode_event(event: tcod.event.Event) -> Optional[list]:
+    """Return the log record for an input event, or None for events that don't affect the game."""
+    if isinstance(event, tcod.event.KeyDown):
+        return ["key", event.scancode, event.sym, event.mod, event.repeat]
+    if isinstance(event, tcod.event.TextInput):
+        return ["text", event.text]
+    if isinstance(event, tcod.event.MouseButtonDown):
+        return ["click", event.pixel.x, event.pixel.y, event.tile.x, event.tile.y, event.button]
+    if isinstance(event, tcod.event.MouseMotion):
+        return ["motion", event.tile.x, event.tile.y]
+    if isinstance(event, tcod.event.Quit):
+        return ["quit"]
+    return None
+
+
+def decode_event(record: list) -> tcod.event.Event:
+    kind = record[0]
+    if kind == "key":
+        scancode, sym, mod, repeat = record[1:]
+        return tcod.event.KeyDown(scancode, tcod.event.KeySym(sym), mod, repeat)
+    if kind == "text":
+        return tcod.event.TextInput(record[1])
+    if kind == "click":
+        x, y, tile_x, tile_y, button = record[1:]
+        return tcod.event.MouseButtonDown((x, y), (tile_x, tile_y), button)
+    if kind == "motion":
+        return tcod.event.MouseMotion(tile=(record[1], record[2]))
+    if kind == "quit":
+        return tcod.event.Quit()
+    raise ValueError(f"Unknown event record {record!r}")
+
+
+def encode_action(action: Action) -> list:
+    """Return the log record for an action of the player's.
+
+    Items are stored by their place in the inventory, and skills by their place in the player's active skills.
+    """
+    entity = action.entity
+    if isinstance(action, actions.ActionWithDirection):
+        args = [action.dx, action.dy]
+    elif isinstance(action, actions.ActionWithLocation):
+        args = [action.x, action.y]
+    elif isinstance(action, actions.ItemAction):
+        args = [entity.inventory.items.index(action.item), list(action.target_xy)]
+    elif isinstance(action, (actions.EquipAction, actions.LoadAction)):
+        args = [entity.inventory.items.index(action.item)]
+    elif isinstance(action, actions.ExecuteAction):
+        args = [entity.abilities.active_skills.index(action.skill), list(action.xy) if action.xy else None]
+    else:
+        args = []
+    return ["action", type(action).__name__, *args]
+
+
+def decode_action(engine: Engine, record: list) -> Action:
+    player = engine.player
+    name, args = record[1], record[2:]
+    action_class = getattr(actions, name)
+    if issubclass(action_class, (actions.ActionWithDirection, actions.ActionWithLocation)):
+        return action_class(player, *args)
+    if issubclass(action_class, actions.ItemAction):
+        return action_class(player, player.inventory.items[args[0]], tuple(args[1]))
+    if issubclass(action_class, (actions.EquipAction, actions.LoadAction)):
+        return action_class(player, player.inventory.items[args[0]])
+    if issubclass(action_class, actions.ExecuteAction):
+        return action_class(player, player.abilities.active_skills[args[0]], tuple(args[1]) if args[1] else None)
+    return action_class(player)
+
+
+class SessionRecorder:
+    """
+    Writes a session to an lzma-compressed log of JSON records, one per line.
+
+    The header gives the seed of the game, and whether it was driven by input events (the game window) or by actions
+    handed straight to the event handler (the headless runner). Events are logged as they reach the handlers, and
+    every action the player takes is logged as it reaches EventHandler.handle_action. Every `checksum_interval`
+    turns, and when the recorder is closed, a checksum of the game state is logged for the replay to compare against.
+    Recordings have to start from a new game, since loading a save brings in state the log doesn't have.
+    """
+
+    def __init__(self, path: str, seed: int, source: str, checksum_interval: int = CHECKSUM_INTERVAL):
+        self.file = lzma.open(path, "wt", encoding="utf-8")
+        self.checksum_interval = checksum_interval
+        self.turns = 0
+        self.last_motion: Optional[list] = None
+        self.write({"version": REPLAY_VERSION, "seed": seed, "source": source, "interval": checksum_interval})
+
+    def write(self, record) -> None:
+        self.file.write(json.dumps(record, separators=(",", ":")))
+        self.file.write("\n")
+
+    def record_event(self, event: tcod.event.Event) -> None:
+        record = encode_event(event)
+        if record is None:
+            return
+        if record[0] == "motion":
+            # Only the tile under the mouse matters, so skip motion within a tile.
+            if record == self.last_motion:
+                return
+            self.last_motion = record
+        self.write(record)
+
+    def record_action(self, action: Action) -> None:
+        self.write(encode_action(action))
+
+    def record_level_up(self, option: int) -> None:
+        self.write(["level_up", option])
+
+    def end_turn(self, engine: Engine) -> None:
+        self.turns += 1
+        if self.turns % self.checksum_interval == 0:
+            self.write(["check", self.turns, state_checksum(engine)])
+
+    def close(self, engine: Optional[Engine] = None) -> None:
+        if self.file.closed:
+            return
+        if engine:
+            self.write(["check", self.turns, state_checksum(engine)])
+        self.file.close()
+
+
+class SessionReplayer:
+    """Plays back a recorded session, feeding its events or actions to the handlers as the game would."""
+
+    def __init__(self, path: str):
+        with lzma.open(path, "rt", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+            self.records: List[list] = [json.loads(line) for line in f]
+        if self.header["version"] != REPLAY_VERSION:
+            raise ValueError(f"Replay version {self.header['version']} isn't supported.")
+        self.source = self.header["source"]
+        seed = self.header["seed"]
+        self.handler: input_handlers.BaseEventHandler
+        if self.source == "events":
+            self.handler = setup_game.MainMenu(seed=seed)
+        else:
+            self.handler = input_handlers.MainGameEventHandler(setup_game.new_game(seed))
+        self.turns = 0
+        self.checks = 0
+        self.elapsed = 0.0
+
+    @property
+    def engine(self) -> Optional[Engine]:
+        return getattr(self.handler, "engine", None)
+
+    def check(self, turn: int, expected: str) -> None:
+        actual = state_checksum(self.engine)
+        if actual != expected:
+            raise ReplayDivergence(f"State differs from the recording at turn {turn}: {actual} != {expected}")
+        self.checks += 1
+
+    def run(self, verify: bool = True) -> None:
+        """Replay the whole log, raising ReplayDivergence at the first checksum that doesn't match."""
+        start = time.perf_counter()
+        try:
+            for record in self.records:
+                kind = record[0]
+                if kind == "check":
+                    self.turns = record[1]
+                    if verify:
+                        self.check(record[1], record[2])
+                elif kind == "action":
+                    # Logs driven by events also hold the actions, but those come from replaying the events.
+                    if self.source == "actions":
+                        self.handler.handle_action(decode_action(self.engine, record))
+                elif kind == "level_up":
+                    self.engine.player.level.level_up_options[record[1]]()
+                else:
+                    self.handle_event(decode_event(record))
+        except SystemExit:
+            pass  # The player quit.
+        self.elapsed += time.perf_counter() - start
+
+    def handle_event(self, event: tcod.event.Event) -> None:
+        try:
+            self.handler = self.handler.handle_events(event)
+        except (SystemExit, ReplayDivergence):
+            raise
+        except Exception:  # Logged the same way as in the game loop, which then carries on.
+            if isinstance(self.handler, input_handlers.EventHandler):
+                self.handler.engine.message_log.add_message(traceback.format_exc(), color.error)
+
+    def report(self) -> str:
+        turns_per_second = self.turns / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{self.turns} turns in {self.elapsed:.2f}s: {turns_per_second:.1f} turns/sec, "
+            f"{self.checks} checksums matched"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded session without a window.")
+    parser.add_argument("path", help="Log written with --record.")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the state checksums, for timing only.")
+    parser.add_argument("--profile", metavar="PATH", default=None, help="Write a per-turn profile trace here.")
+    args = parser.parse_args()
+
+    replayer = SessionReplayer(args.path)
+    if args.profile and replayer.engine:
+        replayer.engine.profiler.enabled = True
+    replayer.run(verify=not args.no_verify)
+    print(replayer.report())
+    if args.profile and replayer.engine:
+        replayer.engine.profiler.dump_json(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import random
+from typing import TYPE_CHECKING, Dict, Optional
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+
+def derive_seed(seed: int, name: str) -> int:
+    """Return the seed for the stream called `name`, the same on every run and Python version."""
+    digest = hashlib.sha256(f"{seed}:{name}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class Stream(random.Random):
+    """
+    A random.Random that counts the 32-bit words it has drawn from its generator.
+
+    Every method of Random gets its numbers through random() or getrandbits(), so the count is exact, and the stream
+    can be saved as its seed and that count instead of the 2.5KB of Mersenne Twister state.
+    """
+
+    def __init__(self, seed: int):
+        self.initial_seed = seed
+        self.words = 0
+        super().__init__(seed)
+
+    def random(self) -> float:
+        self.words += 2
+        return super().random()
+
+    def getrandbits(self, k: int) -> int:
+        self.words += (k + 31) // 32
+        return super().getrandbits(k)
+
+    def __reduce__(self) -> tuple:
+        return self.resume, (self.initial_seed, self.words, self.getstate()[2])
+
+    @classmethod
+    def resume(cls, seed: int, words: int, gauss_next: Optional[float] = None) -> Stream:
+        """Return the stream with this seed, after it has drawn `words` words."""
+        stream = cls(seed)
+        while stream.words < words:
+            stream.getrandbits(32 * min(words - stream.words, 1 << 16))
+        if gauss_next is not None:
+            version, internal_state, _ = stream.getstate()
+            stream.setstate((version, internal_state, gauss_next))
+        return stream
+
+
+class RNGService:
+    """
+    Named random streams for the game, each seeded from the game's seed and its own name.
+
+    Every subsystem draws from its own stream: "procgen:<floor>" for the layout and monsters of each floor,
+    "loot:<floor>" for the items placed on it, "combat" for damage and critical rolls, and one "ai:<n>" stream per
+    actor for its decisions. A draw in one stream never shifts the numbers another one sees, so a game started with
+    the same seed and fed the same player actions plays out the same way, regardless of what else changed.
+    The streams are random.Random objects and are saved with the Engine.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.streams: Dict[str, Stream] = {}
+        # Actors' streams are numbered in the order they first need one. The number is kept on the actor, as
+        # rng_number, so the service doesn't refer to actors on floors that a save hasn't loaded.
+        self.next_actor_number = 0
+
+    def stream(self, name: str) -> random.Random:
+        """Return the stream called `name`, creating it on first use."""
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = Stream(derive_seed(self.seed, name))
+        return stream
+
+    def procgen(self, floor: int) -> random.Random:
+        return self.stream(f"procgen:{floor}")
+
+    def loot(self, floor: int) -> random.Random:
+        return self.stream(f"loot:{floor}")
+
+    @property
+    def combat(self) -> random.Random:
+        return self.stream("combat")
+
+    def actor(self, entity: Entity) -> random.Random:
+        """Return the stream for the AI decisions of this actor."""
+        number = entity.rng_number
+        if number is None:
+            number = entity.rng_number = self.next_actor_number
+            self.next_actor_number += 1
+        return self.stream(f"ai:{number}")
+
+    def forget(self, entity: Entity) -> None:
+        """Drop the stream of an actor that won't act again. Its number isn't reused."""
+        number = entity.rng_number
+        if number is not None:
+            entity.rng_number = None
+            self.streams.pop(f"ai:{number}", None)
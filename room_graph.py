@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import heapq
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np  # type: ignore
+import tcod
+
+if TYPE_CHECKING:
+    from game_map import GameMap
+    from procgen import RectangularRoom
+
+Box = Tuple[int, int, int, int]  # x1, y1, x2, y2, inclusive.
+
+
+class RoomGraph:
+    """
+    A coarse map of a floor: one node per room, with an edge for every pair of rooms a corridor joins.
+
+    Each edge stores a tile path between the two room centers, found once per floor with a search limited to the box
+    around the two rooms and their corridors. Corridors that procgen lists but that don't actually join the rooms are
+    left out. The shortest routes between every pair of rooms are worked out at the same time. A long route is then a
+    lookup of the rooms to pass through followed by their stored edge paths, with real searches only for the short
+    legs from the start to its room center and from the last center to the destination.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self.tiles_revision = -1
+        self.links: Dict[int, Dict[int, List[Tuple[int, int]]]] = {}
+        # The shortest distances between rooms, and the room before the destination on each of those routes.
+        self.distances: Dict[int, Dict[int, int]] = {}
+        self.previous: Dict[int, Dict[int, int]] = {}
+
+    def __getstate__(self) -> dict:
+        # Rebuilt on first use.
+        state = self.__dict__.copy()
+        state.update(tiles_revision=-1, links={}, distances={}, previous={})
+        return state
+
+    def ensure_current(self) -> None:
+        if self.tiles_revision != self.gamemap.tiles_revision:
+            self.build()
+
+    def build(self) -> None:
+        """Find the tile path along every edge of the room graph."""
+        gamemap = self.gamemap
+        rooms = gamemap.rooms
+        room_numbers = {room: i for i, room in enumerate(rooms)}
+        self.links = {i: {} for i in range(len(rooms))}
+        for corridor in gamemap.corridors:
+            connected = sorted({room_numbers[room] for room in corridor.connected_rooms if room in room_numbers})
+            for n, a in enumerate(connected):
+                for b in connected[n + 1:]:
+                    if b in self.links[a]:
+                        continue
+                    box = self._union_box(
+                        [self._room_box(rooms[a]), self._room_box(rooms[b])],
+                        corridor.corridor_points,
+                    )
+                    path = self.local_path(rooms[a].center, rooms[b].center, box)
+                    if path is not None:
+                        self.links[a][b] = path
+                        self.links[b][a] = path[::-1][1:] + [rooms[a].center]
+        for room in self.links:
+            self._search_from(room)
+        self.tiles_revision = gamemap.tiles_revision
+        gamemap.engine.profiler.count("room_graph_build")
+
+    @staticmethod
+    def _room_box(room: RectangularRoom) -> Box:
+        return room.x1, room.y1, room.x2, room.y2
+
+    def _union_box(self, boxes: List[Box], points: Iterable[Tuple[int, int]] = ()) -> Box:
+        x1 = min(box[0] for box in boxes)
+        y1 = min(box[1] for box in boxes)
+        x2 = max(box[2] for box in boxes)
+        y2 = max(box[3] for box in boxes)
+        for x, y in points:
+            x1, y1, x2, y2 = min(x1, x), min(y1, y), max(x2, x), max(y2, y)
+        return max(0, x1), max(0, y1), min(self.gamemap.width - 1, x2), min(self.gamemap.height - 1, y2)
+
+    def local_path(
+            self, start: Tuple[int, int], goal: Tuple[int, int], box: Box
+    ) -> Optional[List[Tuple[int, int]]]:
+        """Return the path from start to goal, excluding start, searching only the walkable tiles inside box."""
+        if start == goal:
+            return []
+        x1, y1, x2, y2 = box
+        cost = np.array(self.gamemap.tiles["walkable"][x1:x2 + 1, y1:y2 + 1], dtype=np.int8)
+        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+        pathfinder = tcod.path.Pathfinder(graph)
+        pathfinder.add_root((start[0] - x1, start[1] - y1))
+        path = pathfinder.path_to((goal[0] - x1, goal[1] - y1))[1:].tolist()
+        if not path:
+            return None
+        return [(x + x1, y + y1) for x, y in path]
+
+    def _search_from(self, source: int) -> None:
+        """Run Dijkstra over the rooms from source, recording each room's distance and previous room."""
+        distances = {source: 0}
+        previous: Dict[int, int] = {}
+        queue = [(0, source)]
+        while queue:
+            distance, room = heapq.heappop(queue)
+            if distance > distances[room]:
+                continue
+            for neighbour, path in self.links[room].items():
+                new_distance = distance + len(path)
+                if new_distance < distances.get(neighbour, new_distance + 1):
+                    distances[neighbour] = new_distance
+                    previous[neighbour] = room
+                    heapq.heappush(queue, (new_distance, neighbour))
+        self.distances[source] = distances
+        self.previous[source] = previous
+
+    def room_route(self, starts: Iterable[int], goals: Iterable[int]) -> Optional[List[int]]:
+        """Return the shortest sequence of rooms from any of the start rooms to any of the goal rooms."""
+        best = None
+        for start in sorted(starts):
+            distances = self.distances[start]
+            for goal in sorted(goals):
+                if goal in distances and (best is None or distances[goal] < best[0]):
+                    best = distances[goal], start, goal
+        if best is None:
+            return None
+        _, start, room = best
+        previous = self.previous[start]
+        route = [room]
+        while room != start:
+            room = previous[room]
+            route.append(room)
+        return route[::-1]
+
+    def route(self, start: Tuple[int, int], goal: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """Return a tile path from start to goal, excluding start, routed through the room graph.
+
+        Returns None if either end isn't in or next to a room, or the rooms aren't connected, in which case the
+        caller should fall back to a full search.
+        """
+        self.ensure_current()
+        gamemap = self.gamemap
+        start_rooms = gamemap.rooms_at(*start)
+        goal_rooms = gamemap.rooms_at(*goal)
+        if not start_rooms or not goal_rooms:
+            return None
+        rooms = self.room_route(start_rooms, goal_rooms)
+        if rooms is None:
+            return None
+
+        first, last = gamemap.rooms[rooms[0]], gamemap.rooms[rooms[-1]]
+        if len(rooms) == 1:
+            return self.local_path(start, goal, self._union_box([self._room_box(first)], [start, goal]))
+
+        head = self.local_path(start, first.center, self._union_box([self._room_box(first)], [start]))
+        tail = self.local_path(last.center, goal, self._union_box([self._room_box(last)], [goal]))
+        if head is None or tail is None:
+            return None
+        path = head
+        for a, b in zip(rooms, rooms[1:]):
+            path.extend(self.links[a][b])
+        path.extend(tail)
+        return path
@@ -0,0 +1,230 @@
+"""
+What a save can hold: every kind of object record, the class it's read back into, and the attributes it keeps.
+
+Records are written under the names given here rather than their class paths, so a class can be renamed or moved by
+changing its entry. Only the listed fields are written: saving an object of a class that isn't listed, or one with
+an attribute that isn't, raises a SaveError, so state added to the game has to be added here before it can be saved.
+
+Each record type has a version of its own, and each chunk of a save lists the versions of the record types in it.
+When the fields of a record type change in a way that older saves can't be read as they are, bump its version and
+add a function to its migrations that upgrades a record's attributes from the version before. Entities made from a
+prototype are written as the attributes that differ from a new instance of it, so a migration can be given only some
+of the fields, and has to leave alone the ones that aren't there.
+"""
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, Optional
+
+
+class RecordType:
+    """One kind of object record: the class it's read into, the version of its layout and the fields it keeps."""
+
+    def __init__(
+            self,
+            name: str,
+            path: str,
+            fields: Iterable[str],
+            version: int = 1,
+            migrations: Optional[Dict[int, Callable[[dict], dict]]] = None,
+            methods: Iterable[str] = (),
+    ):
+        self.name = name
+        self.path = path  # The "module:Class" the record is read into.
+        self.fields = frozenset(fields)
+        self.version = version
+        # Upgrades a record's attributes from the version in the key to the version after it.
+        self.migrations = migrations or {}
+        self.methods = frozenset(methods)  # Bound methods of these objects that can be saved, like callbacks.
+
+
+ENTITY_FIELDS = ("blocks_movement", "char", "color", "name", "parent", "render_order", "x", "y", "prototype_id",
+                 "rng_number", "paged_floor")
+ACTOR_FIELDS = ENTITY_FIELDS + ("abilities", "ai", "conditions_manager", "elemental_type", "equipment",
+                                "faction_manager", "fighter", "inventory", "level", "personality", "race",
+                                "status_effect_manager")
+ITEM_FIELDS = ENTITY_FIELDS + ("ammo", "consumable", "equippable")
+
+AI_FIELDS = ("entity", "time_cost", "approach_map", "flee_map", "path", "path_revision")
+CONDITION_FIELDS = ("accuracy", "category", "consumable", "duration", "name", "permanent", "type")
+CONSUMABLE_FIELDS = ("effect", "time_cost")
+EQUIPPABLE_FIELDS = ("combat_rating", "elemental_type", "enchantments", "equipment_type", "rarity")
+WEAPON_FIELDS = EQUIPPABLE_FIELDS + ("can_melee", "damage_dice", "category", "time_cost", "type")
+RANGED_WEAPON_FIELDS = WEAPON_FIELDS + ("current_ammo", "max_ammo", "range", "reload_time")
+MAGIC_WEAPON_FIELDS = WEAPON_FIELDS + ("mp_cost",)
+SKILL_FIELDS = ("activation_requirements", "description", "experience", "level", "name", "manager")
+UNIT_FIELDS = ("is_child", "type", "units", "owner")
+COMBAT_UNIT_FIELDS = UNIT_FIELDS + ("damage_components", "damage_type", "is_ranged", "max_damage")
+
+RECORDS: Dict[str, RecordType] = {record.name: record for record in (
+    # The game and its services.
+    RecordType("engine", "engine:Engine", (
+        "dormancy", "game_map", "game_world", "message_log", "mouse_location", "player", "prefetcher", "profiler",
+        "rng",
+    )),
+    RecordType("game_world", "game_map:GameWorld", (
+        "current_floor", "engine", "map_height", "map_width", "max_rooms", "room_max_size", "room_min_size",
+    )),
+    RecordType("message_log", "message_log:MessageLog", ("messages",)),
+    RecordType("message", "message_log:Message", ("count", "fg", "plain_text")),
+    RecordType("rng_service", "rng:RNGService", ("next_actor_number", "seed", "streams")),
+    RecordType("dormancy", "dormancy:DormancyManager", (
+        "catch_up_limit", "enabled", "engine", "sleep_radius", "wake_radius",
+    )),
+    RecordType("prefetcher", "prefetch:AIPrefetcher", ("_executor", "_executor_workers", "enabled", "workers")),
+    RecordType("profiler", "profiler:TurnProfiler", (
+        "_counters", "_counts", "_times", "enabled", "samples", "trace", "trace_length", "turn", "window",
+    )),
+
+    # Floors.
+    RecordType("game_map", "game_map:GameMap", (
+        "_corpses", "_corridor_index", "_corridor_rooms", "_fov_cache", "_items", "_live_actors", "_room_fields",
+        "_room_index", "_room_neighbours", "corridors", "distance_maps", "downstairs_location", "engine", "entities",
+        "explored", "fov_bounds", "fov_cache_hits", "fov_cache_misses", "fov_cache_size", "fov_origin", "height",
+        "path_costs", "room_field_cache_size", "room_graph", "rooms", "scheduler", "spatial_index", "tiles",
+        "tiles_revision", "upstairs_location", "visibility", "visible", "width",
+    )),
+    RecordType("room", "procgen:RectangularRoom", ("connections", "x1", "x2", "y1", "y2")),
+    RecordType("corridor", "procgen:Corridor", (
+        "connected_corridors", "connected_rooms", "corridor_points", "end_position", "start_position",
+    )),
+    RecordType("room_graph", "room_graph:RoomGraph", ("distances", "gamemap", "links", "previous", "tiles_revision")),
+    RecordType("path_costs", "distance_maps:PathCosts", ("base", "costs", "gamemap", "revision", "tiles_revision"),
+               methods=("blocker_changed",)),
+    RecordType("distance_maps", "distance_maps:DistanceMapRegistry", ("gamemap", "maps", "round")),
+    RecordType("scheduler", "scheduler:TurnScheduler", ("_next_order", "asleep", "current_round", "dormant", "queued")),
+    RecordType("spatial_index", "spatial_index:SpatialIndex", ("entities", "on_blocker_change", "shape")),
+    RecordType("visibility", "visibility:VisibilityTable", ("gamemap",)),
+
+    # Entities.
+    RecordType("entity", "entity:Entity", ENTITY_FIELDS),
+    RecordType("actor", "entity:Actor", ACTOR_FIELDS),
+    RecordType("item", "entity:Item", ITEM_FIELDS),
+
+    # Components.
+    RecordType("fighter", "components.fighter:Fighter", (
+        "_hp", "_mp", "_se", "_sp", "_time", "agility", "awareness", "charisma", "constitution", "critical_chance",
+        "critical_damage", "damage_log", "dexterity", "extra_hp", "extra_mp", "extra_se", "extra_sp", "magic",
+        "magical_defense", "max_hp", "max_mp", "max_se", "max_sp", "max_time", "strength", "parent",
+    )),
+    RecordType("damage_log_entry", "components.fighter:DamageLogEntry", ("_source_entity", "details", "type")),
+    RecordType("level", "components.level:Level", (
+        "current_level", "current_xp", "level_up_base", "level_up_factor", "xp_given", "parent",
+    )),
+    RecordType("inventory", "components.inventory:Inventory", ("capacity", "items", "parent")),
+    RecordType("equipment", "components.equipment:Equipment", ("armor", "back", "weapon", "parent")),
+    RecordType("ammo", "components.Ammo:Ammo", ("category", "damage", "damage_type", "effects", "stacks", "parent")),
+    RecordType("faction", "components.Faction:FactionComponent", ("hostile_factions", "member_factions", "parent")),
+    RecordType("personality", "components.Personality:Personality", ("preferences", "traits", "parent")),
+    RecordType("race", "components.Race:Race", (
+        "agility", "awareness", "charisma", "constitution", "dexterity", "elemental_type", "factions",
+        "level_up_base", "level_up_factor", "magic", "skills", "strength", "xp_given", "parent",
+    )),
+    RecordType("elemental_type", "damageType:ElementalType", ("immunities", "name", "resistances", "weaknesses")),
+    RecordType("enchantment", "enchantment:Enchantment", ("name",)),
+    RecordType("sharpness_enchantment", "enchantment:SharpnessEnchantment", ("name",)),
+
+    RecordType("equippable", "components.equippable:Equippable", EQUIPPABLE_FIELDS + ("parent",)),
+    RecordType("armor", "components.equippable:Armor", EQUIPPABLE_FIELDS + ("defense_bonus", "parent")),
+    RecordType("accessory", "components.equippable:Accessory", EQUIPPABLE_FIELDS + ("parent",)),
+    RecordType("container", "components.equippable:Container", EQUIPPABLE_FIELDS + (
+        "capacity", "category", "items", "parent",
+    )),
+    RecordType("weapon", "components.equippable:Weapon", WEAPON_FIELDS + ("parent",)),
+    RecordType("melee_weapon", "components.equippable:MeleeWeapon", WEAPON_FIELDS + ("parent",)),
+    RecordType("ranged_weapon", "components.equippable:RangedWeapon", RANGED_WEAPON_FIELDS + ("parent",)),
+    RecordType("bow", "components.equippable:Bow", RANGED_WEAPON_FIELDS + ("parent",)),
+    RecordType("crossbow", "components.equippable:Crossbow", RANGED_WEAPON_FIELDS + ("parent",)),
+    RecordType("gun", "components.equippable:Gun", RANGED_WEAPON_FIELDS + ("shot_time", "parent")),
+    RecordType("magic_weapon", "components.equippable:MagicWeapon", MAGIC_WEAPON_FIELDS + ("parent",)),
+    RecordType("staff", "components.equippable:Staff", MAGIC_WEAPON_FIELDS + ("parent",)),
+    RecordType("orb", "components.equippable:Orb", MAGIC_WEAPON_FIELDS + ("parent",)),
+    RecordType("wand", "components.equippable:Wand", MAGIC_WEAPON_FIELDS + ("active_skill", "skills", "parent")),
+
+    RecordType("consumable", "components.consumable:Consumable", CONSUMABLE_FIELDS + ("parent",)),
+    RecordType("healing_consumable", "components.consumable:HealingConsumable", CONSUMABLE_FIELDS + (
+        "amount", "parent",
+    )),
+    RecordType("lightning_consumable", "components.consumable:LightningDamageConsumable", CONSUMABLE_FIELDS + (
+        "damage", "maximum_range", "parent",
+    )),
+    RecordType("confusion_consumable", "components.consumable:ConfusionConsumable", CONSUMABLE_FIELDS + (
+        "number_of_turns", "parent",
+    )),
+    RecordType("fireball_consumable", "components.consumable:FireballDamageConsumable", CONSUMABLE_FIELDS + (
+        "damage", "radius", "parent",
+    )),
+
+    RecordType("abilities", "components.SkillComponent:Abilities", (
+        "active_skills", "hybrid_skills", "passive_skills", "parent",
+    )),
+    RecordType("skill", "components.SkillComponent:Skill", SKILL_FIELDS),
+    RecordType("active_skill", "components.SkillComponent:ActiveSkill", SKILL_FIELDS + (
+        "cooldown", "mp_cost", "remaining_cooldown", "se_cost", "sp_cost", "time_cost", "unit",
+    )),
+    RecordType("unit", "components.SkillComponent:Unit", UNIT_FIELDS),
+    RecordType("combat_unit", "components.SkillComponent:CombatUnit", COMBAT_UNIT_FIELDS),
+    RecordType("combat_aoe", "components.SkillComponent:CombatAoe", COMBAT_UNIT_FIELDS + ("radius",)),
+    RecordType("combat_single_target", "components.SkillComponent:CombatSingleTarget", COMBAT_UNIT_FIELDS + (
+        "num_hits", "radius", "turn_units",
+    )),
+    RecordType("movement_teleportation", "components.SkillComponent:MovementTeleportation", UNIT_FIELDS + (
+        "can_choose", "is_ranged", "range_limit",
+    )),
+    RecordType("movement_dash", "components.SkillComponent:MovementDash", UNIT_FIELDS + (
+        "can_choose", "direction", "distance",
+    )),
+    RecordType("status_unit", "components.SkillComponent:StatusUnit", UNIT_FIELDS + ("can_choose", "effects")),
+    RecordType("damage_component", "components.SkillComponent:DamageComponent", ()),
+    RecordType("base_damage", "components.SkillComponent:BaseDamageComponent", ("category", "value")),
+    RecordType("scaling_damage", "components.SkillComponent:ScalingDamageComponent", (
+        "category", "coefficient", "minimum", "stat",
+    )),
+    RecordType("stat_mod_damage", "components.SkillComponent:StatModComponent", (
+        "category", "divisor", "fixed", "minimum", "stat",
+    )),
+
+    RecordType("status_effect_manager", "components.Status:StatusEffectManager", ("active_effects", "parent")),
+    RecordType("status_effect", "components.Status:StatusEffect", (
+        "can_delay", "conditions", "cot_effect_data", "delay", "duration", "max_delay", "modifier_data", "name",
+        "permanent", "stacks", "type",
+    )),
+    RecordType("condition_manager", "components.conditions:ConditionManager", ("conditions", "parent")),
+    RecordType("condition", "components.conditions:Condition", CONDITION_FIELDS),
+    RecordType("drain_condition", "components.conditions:DrainCondition", CONDITION_FIELDS + ("percentage",)),
+    RecordType("chance_condition", "components.conditions:ChanceCondition", CONDITION_FIELDS + ("chance",)),
+    RecordType("target_condition", "components.conditions:TargetCondition", CONDITION_FIELDS + ("chance", "target")),
+    RecordType("accuracy_condition", "components.conditions:AccuracyCondition", CONDITION_FIELDS + (
+        "accuracy_penalty",
+    )),
+    RecordType("blinded_condition", "components.conditions:BlindedCondition", CONDITION_FIELDS + (
+        "accuracy_penalty", "sight_reduction",
+    )),
+
+    # AIs, and the maps they steer by.
+    RecordType("hostile_ai", "components.ai:HostileEnemy", AI_FIELDS + ("target",)),
+    RecordType("fleeing_ai", "components.ai:FleeingAI", AI_FIELDS + ("target",)),
+    RecordType("general_ai", "components.ai:GeneralAI", AI_FIELDS + ("desire_map", "item", "state", "target")),
+    RecordType("confused_ai", "components.ai:ConfusedEnemy", AI_FIELDS + ("previous_ai", "turns_remaining")),
+    RecordType("approach_map", "components.ai:ApproachMap", ("cost_coefficient", "entity", "goal_points")),
+    RecordType("flee_map", "components.ai:FleeMap", ("cost_coefficient", "entity", "goal_points")),
+    RecordType("desire_map", "components.ai:DesireMap", ("cost_coefficient", "desires", "entity", "goal_points")),
+)}
+
+# Enumerations, by name.
+ENUMS: Dict[str, str] = {
+    "render_order": "render_order:RenderOrder",
+    "equipment_type": "equipment_types:EquipmentType",
+}
+
+# Shared definitions, which load as the same object, by name.
+SHARED: Dict[str, str] = {
+    name: f"damageType:{name}" for name in (
+        "normal", "fire", "water", "wind", "earth", "light", "dark", "electric", "ice", "metal", "grass", "pure",
+        "primal",
+    )
+}
+
+BY_PATH: Dict[str, str] = {
+    path: name for table in ({name: record.path for name, record in RECORDS.items()}, ENUMS, SHARED)
+    for name, path in table.items()
+}
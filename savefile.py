@@ -0,0 +1,1002 @@
+"""
+A structured, versioned save format.
+
+A save is a zip archive holding:
+
+    manifest.json   The format name and version, the version of each record type in the chunk, the floors that
+                    have been generated, and the root chunk: the Engine as a tree of JSON records, and one record
+                    per entity in the chunk.
+    arrays/N.npy    Every numpy array in the root chunk, stored raw with np.save.
+    floors/N.sav    The chunk of floor N: its GameMap and the entities on it, laid out the same way (manifest.json
+                    and arrays/) in a zip archive of its own, stored as it is so it can be copied across.
+
+Each chunk's files are compressed with LZMA.
+
+The player, what the player carries and everything else that isn't on a floor go in the root chunk. Loading a save
+reads the root chunk and the current floor's, and other floors are only read when the player takes the stairs to
+them (GameWorld.enter_floor). A GameWorld remembers the save it was loaded from or last written to, in a
+FloorArchive, and which floors haven't changed since. Only the current floor changes, so saving again writes the
+root chunk, the current floor and the floors visited in between, and copies the rest across from the old file.
+
+Chunks refer to each other by names that stay the same from one save to the next: the Engine, entities by their
+save_uid, and entity components by the entity's uid and attribute name. References to an entity on a floor also
+give the floor, so that following one loads the floor it's on. Classes can list attributes in `lazy_references`,
+which are read as an EntityReference instead, and only load the floor when they're resolved. Any other object
+reachable from two chunks is written to both, and loads as two copies. Within a chunk, an object reachable from several places is written once
+and referred to by number after that.
+
+Objects are written as records of the types in save_schema, which name the class to read them into and the
+attributes kept, from the object's __dict__ or its __getstate__. Derived caches that classes already leave out of
+their pickled state are left out here too. Writing an object the schema doesn't have a record type for, or one with
+attributes its record type doesn't list, raises a SaveError.
+
+Entities made from a prototype in entity_factories are written as the prototype's name and the attributes that
+differ from a new instance of it. Their components are compared one attribute at a time, so a fresh orc with one
+hit point lost is stored as little more than {"fighter": {"_hp": ...}}. Loading makes a new instance of the
+prototype and applies the differences. Attributes added to a component since the save was written therefore get
+their default from the prototype instead of being missing.
+
+The game's random streams are stored as their seed and the number of words they have drawn, and are wound forward
+to the same point on loading.
+
+Shared definitions, like the elemental types, are written by their name in save_schema and loaded as that same
+object. When the fields of a record type change, bump its version in save_schema. When the layout of the chunks
+themselves changes, bump SAVE_VERSION and add a function to MIGRATIONS that upgrades a chunk's manifest from the
+version before.
+"""
+from __future__ import annotations
+
+import enum
+import functools
+import importlib
+import io
+import json
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import types
+import weakref
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np  # type: ignore
+
+import prototypes
+import save_schema
+from entity import Entity
+from game_map import GameMap, GameWorld
+from rng import Stream
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from journal import ActionJournal
+
+SAVE_FORMAT = "yarl-save"
+SAVE_VERSION = 1
+
+# Upgrades a manifest written with the version in the key to the version after it.
+MIGRATIONS: Dict[int, Callable[[dict], dict]] = {}
+
+
+class SaveError(Exception):
+    """Raised when something in the game can't be written to, or read from, a save."""
+
+
+def class_path(cls: type) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+@functools.lru_cache(maxsize=None)
+def find_class(path: str) -> Any:
+    module_name, _, qualname = path.partition(":")
+    value: Any = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        value = getattr(value, name)
+    return value
+
+
+def global_name(obj: object) -> Optional[str]:
+    """Return the path of a shared definition, from the module its class is defined in, or None for copies."""
+    module = sys.modules[type(obj).__module__]
+    for name, value in vars(module).items():
+        if value is obj:
+            return f"{module.__name__}:{name}"
+    return None
+
+
+def _component_of(value: object, entity: Entity) -> bool:
+    """Return True if value is one of entity's components, like its Fighter or its AI."""
+    if isinstance(value, Entity) or not hasattr(value, "__dict__"):
+        return False
+    attributes = vars(value)
+    return attributes.get("parent") is entity or attributes.get("entity") is entity
+
+
+def _state(obj: object) -> Any:
+    """Return what pickle would save of obj: its __getstate__ if its class defines one, otherwise its __dict__."""
+    getstate = getattr(type(obj), "__getstate__", None)
+    if getstate is None or getstate is getattr(object, "__getstate__", None):
+        return vars(obj)
+    return obj.__getstate__()
+
+
+def _same(a: Any, b: Any, pairs: Dict[int, object], seen: set) -> bool:
+    """Return True if a, from a live entity, holds the same state as b, from a new instance of its prototype.
+
+    `pairs` maps the ids of the live entity and its components to their counterparts in the new instance.
+    """
+    if a is b:
+        return True
+    counterpart = pairs.get(id(a))
+    if counterpart is not None:
+        return counterpart is b
+    if type(a) is not type(b) or isinstance(a, Entity):
+        return False
+    if isinstance(a, (list, tuple, deque)):
+        return len(a) == len(b) and all(_same(x, y, pairs, seen) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(value, b[key], pairs, seen) for key, value in a.items())
+    if isinstance(a, (set, frozenset)):
+        return a == b
+    if isinstance(a, np.ndarray):
+        return a.shape == b.shape and a.dtype == b.dtype and np.array_equal(a, b)
+    if isinstance(a, (enum.Enum, type, types.FunctionType, types.MethodType)):
+        return a == b
+    if hasattr(a, "__dict__"):
+        if (id(a), id(b)) in seen:
+            return True
+        seen.add((id(a), id(b)))
+        return _same(_state(a), _state(b), pairs, seen)
+    return bool(a == b)
+
+
+class SaveWriter:
+    """
+    Splits an Engine into the chunks of a save: the root chunk, and one for each floor that has changed since the
+    GameWorld's archive was written.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.world = engine.game_world
+        self.archive = self.world.archive
+        self.next_uid = self.archive.next_uid if self.archive else 0
+        self.floor_numbers = {id(gamemap): floor for floor, gamemap in self.world.maps.items()}
+        self.owners: Dict[int, Optional[int]] = {}  # id(entity) -> the floor it's written with, None for the root.
+        self.anchors: Dict[int, Tuple[Entity, str]] = {}  # id(component) -> its entity and attribute name.
+        self.fresh: Dict[str, Entity] = {}  # A new instance of each prototype, to compare entities with.
+        self.written: List[object] = []  # Keeps everything the chunks' memos refer to alive, so ids aren't reused.
+        self.chunks: Dict[Optional[int], ChunkWriter] = {}
+
+    def write(self) -> None:
+        self.claim_loaded()
+        self.chunks[None] = ChunkWriter(self, None)
+        self.chunks[None].write(self.engine)
+        clean = self.archive.clean if self.archive else set()
+        for floor, gamemap in sorted(self.world.maps.items()):
+            if isinstance(gamemap, GameMap) and (floor not in clean or floor == self.world.current_floor):
+                self.chunks[floor] = ChunkWriter(self, floor)
+                self.chunks[floor].write(gamemap)
+
+    def write_page(self, floor: int) -> ChunkWriter:
+        """Write only the chunk of one floor, to page it out of memory."""
+        self.claim_loaded()
+        chunk = self.chunks[floor] = ChunkWriter(self, floor)
+        chunk.write(self.world.maps[floor])
+        return chunk
+
+    def claim_loaded(self) -> None:
+        self.claim(self.engine.player, None)
+        for floor, gamemap in self.world.maps.items():
+            for entity in gamemap.entities:
+                self.claim(entity, floor)
+
+    def claim(self, entity: Entity, floor: Optional[int]) -> None:
+        """Write entity, and what it carries, with the chunk of floor, or with the root chunk if floor is None."""
+        if id(entity) in self.owners:
+            return
+        self.owners[id(entity)] = floor
+        if entity.save_uid is None:
+            entity.save_uid = self.next_uid
+            self.next_uid += 1
+        if self.archive:
+            self.archive.entities[entity.save_uid] = entity
+        if entity.prototype_id:
+            # Components that a new instance will also have are written as changes to that instance's, so
+            # anything else referring to them has to point there.
+            fresh_state = vars(self.fresh_instance(entity.prototype_id))
+            for name, value in vars(entity).items():
+                if _component_of(value, entity) and type(fresh_state.get(name)) is type(value):
+                    self.anchors.setdefault(id(value), (entity, name))
+        for item in getattr(getattr(entity, "inventory", None), "items", ()):
+            self.claim(item, floor)
+
+    def fresh_instance(self, prototype_id: str) -> Entity:
+        fresh = self.fresh.get(prototype_id)
+        if fresh is None:
+            fresh = self.fresh[prototype_id] = prototypes.instantiate(prototypes.get(prototype_id))
+        return fresh
+
+
+class ChunkWriter:
+    """Turns one chunk of a save, the Engine or a floor's GameMap, into a manifest and a list of arrays."""
+
+    def __init__(self, save: SaveWriter, floor: Optional[int]):
+        self.save = save
+        self.floor = floor
+        self.root: object = None
+        self.memo: Dict[int, Any] = {}  # id -> the record that refers back to an object already written.
+        self.objects = 0
+        self.arrays: List[np.ndarray] = []
+        self.entities: List[Entity] = []
+        self.entity_records: List[dict] = []
+        self.record_types: Set[str] = set()  # The names of the record types written, whose versions are noted.
+        self.manifest: dict = {}
+
+    def write(self, root: object) -> None:
+        self.root = root
+        root_record = self.encode(root)
+        # Entities can refer to more entities, so keep going until every one has a record.
+        while len(self.entity_records) < len(self.entities):
+            self.entity_records.append(self.encode_entity(self.entities[len(self.entity_records)]))
+        self.manifest = {
+            "format": SAVE_FORMAT,
+            "version": SAVE_VERSION,
+            "records": {name: save_schema.RECORDS[name].version for name in sorted(self.record_types)},
+            "root": root_record,
+            "entities": self.entity_records,
+        }
+
+    def reference(self, entity: Entity, name: Optional[str] = None) -> dict:
+        """Return a reference to an entity, or to one of its components, written with another chunk."""
+        record: Dict[str, Any] = {"component": [entity.save_uid, name]} if name else {"entity": entity.save_uid}
+        owner = self.save.owners[id(entity)]
+        if owner is not None and owner != self.floor:
+            record["floor"] = owner
+        return record
+
+    def add_entity(self, entity: Entity) -> dict:
+        ref = self.memo.get(id(entity))
+        if ref is None:
+            # Entities that aren't on any floor or carried by anyone, like the dead in a damage log, go with the
+            # first chunk that refers to them. Those on a floor that has been paged out are already in its chunk.
+            self.save.claim(entity, self.floor if entity.paged_floor is None else entity.paged_floor)
+            ref = self.memo[id(entity)] = self.reference(entity)
+            if self.save.owners[id(entity)] == self.floor:
+                self.entities.append(entity)
+                for item in getattr(getattr(entity, "inventory", None), "items", ()):
+                    self.add_entity(item)
+        return ref
+
+    def record_type(self, obj: object, fields: Iterable[str] = ()) -> save_schema.RecordType:
+        """Return the record type obj is written as, checking that it has one and that it keeps the fields."""
+        path = class_path(type(obj))
+        record_type = save_schema.RECORDS.get(save_schema.BY_PATH.get(path, ""))
+        if record_type is None or record_type.path != path:
+            raise SaveError(f"{path} isn't in the save schema.")
+        unknown = set(fields) - record_type.fields
+        if unknown:
+            raise SaveError(f"{record_type.name}.{min(unknown)} ({path}) isn't in the save schema.")
+        self.record_types.add(record_type.name)
+        return record_type
+
+    def encode_entity(self, entity: Entity) -> dict:
+        if not entity.prototype_id:
+            attributes = {name: value for name, value in _state(entity).items() if name != "save_uid"}
+            return {
+                "uid": entity.save_uid,
+                "record": self.record_type(entity, attributes).name,
+                "attributes": self.encode_attributes(attributes),
+            }
+        fresh = self.save.fresh_instance(entity.prototype_id)
+        fresh_state = vars(fresh)
+        pairs: Dict[int, object] = {id(entity): fresh}
+        for name, value in vars(entity).items():
+            if _component_of(value, entity) and type(fresh_state.get(name)) is type(value):
+                pairs[id(value)] = fresh_state[name]
+
+        self.record_type(entity)
+        record: Dict[str, Any] = {"uid": entity.save_uid, "prototype": entity.prototype_id}
+        attributes: Dict[str, Any] = {}
+        components: Dict[str, Dict[str, Any]] = {}
+        for name, value in _state(entity).items():
+            if name == "save_uid":
+                continue
+            counterpart = pairs.get(id(value))
+            if counterpart is not None and counterpart is not fresh:
+                changed = [
+                    key for key, sub_value in vars(value).items()
+                    if not _same(sub_value, vars(counterpart).get(key), pairs, set())
+                ]
+                if changed:
+                    self.record_type(entity, (name,))
+                    self.record_type(value, changed)
+                    components[name] = {key: self.encode(vars(value)[key]) for key in changed}
+            elif name not in fresh_state or not _same(value, fresh_state[name], pairs, set()):
+                self.record_type(entity, (name,))
+                attributes[name] = self.encode(value)
+        if attributes:
+            record["attributes"] = attributes
+        if components:
+            record["components"] = components
+        return record
+
+    def encode_attributes(self, state: dict) -> dict:
+        return {name: self.encode(value) for name, value in state.items()}
+
+    def number(self, value: object) -> int:
+        """Number an object that is written once, so later references to it can refer back."""
+        number = self.objects
+        self.objects += 1
+        self.memo[id(value)] = {"ref": number}
+        self.save.written.append(value)
+        return number
+
+    def encode(self, value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, np.generic):
+            return value.item()
+        ref = self.memo.get(id(value))
+        if ref is not None:
+            return ref
+        if isinstance(value, Entity):
+            return self.add_entity(value)
+        if isinstance(value, EntityReference):
+            return {"entity": value.uid, "floor": value.floor}
+        anchor = self.save.anchors.get(id(value))
+        if anchor is not None:
+            return self.reference(*anchor)
+        if isinstance(value, (GameMap, FloorStub)) and value is not self.root and id(value) in self.save.floor_numbers:
+            return {"floor": self.save.floor_numbers[id(value)]}
+        if value is self.save.engine and value is not self.root:
+            return {"engine": True}
+        if isinstance(value, (tuple, frozenset)):
+            items = [self.encode(item) for item in value]
+            record = {"tuple": items} if isinstance(value, tuple) else {"set": items, "frozen": True}
+            if not all(item is None or isinstance(item, (bool, int, float, str)) for item in value):
+                # Code can compare these by identity, like the scheduler's heap entries, so they're written once.
+                # They're numbered after their items, since they can't be built until those have been.
+                record["id"] = self.number(value)
+            return record
+        if isinstance(value, slice):
+            return {"slice": [value.start, value.stop, value.step]}
+        if isinstance(value, enum.Enum):
+            name = save_schema.BY_PATH.get(class_path(type(value)))
+            if name not in save_schema.ENUMS:
+                raise SaveError(f"{class_path(type(value))} isn't in the save schema.")
+            return {"enum": name, "name": value.name}
+        if isinstance(value, (type, types.FunctionType)):
+            raise SaveError(f"Can't save {value.__qualname__}: saves don't hold classes or functions.")
+        if isinstance(value, prototypes.SHARED_TYPES):
+            name = save_schema.BY_PATH.get(global_name(value) or "")
+            if name in save_schema.SHARED:
+                return {"shared": name}
+
+        number = self.number(value)
+        # Containers are written once like other objects, so two attributes holding the same list still do.
+        if isinstance(value, list):
+            return {"id": number, "list": [self.encode(item) for item in value]}
+        if isinstance(value, set):
+            return {"id": number, "set": [self.encode(item) for item in value], "frozen": False}
+        if isinstance(value, deque):
+            return {"id": number, "deque": [self.encode(item) for item in value], "maxlen": value.maxlen}
+        if isinstance(value, dict):
+            if type(value) not in (dict, OrderedDict):
+                raise SaveError(f"{class_path(type(value))} isn't in the save schema.")
+            record = {"id": number, "dict": [[self.encode(key), self.encode(item)] for key, item in value.items()]}
+            if type(value) is OrderedDict:
+                record["ordered"] = True
+            return record
+        if isinstance(value, types.MethodType):
+            method = value.__func__.__name__
+            if method not in self.record_type(value.__self__).methods:
+                raise SaveError(f"{class_path(type(value.__self__))}.{method} isn't in the save schema.")
+            return {"id": number, "method": method, "self": self.encode(value.__self__)}
+        if isinstance(value, np.ndarray):
+            self.arrays.append(value)
+            return {"id": number, "array": len(self.arrays) - 1}
+        if isinstance(value, Stream):
+            return {"id": number, "stream": value.initial_seed, "words": value.words, "gauss": value.getstate()[2]}
+        if isinstance(value, random.Random):
+            version, internal_state, gauss_next = value.getstate()
+            self.arrays.append(np.array(internal_state, dtype=np.uint32))
+            return {"id": number, "random": len(self.arrays) - 1, "version": version, "gauss": gauss_next}
+        if not hasattr(value, "__dict__"):
+            raise SaveError(f"Don't know how to save {type(value).__name__} objects.")
+        state = _state(value)
+        if isinstance(value, GameWorld):
+            # The floors are chunks of their own, and the archive is where they were last saved.
+            state = {name: item for name, item in state.items() if name not in ("maps", "archive")}
+        if not isinstance(state, dict):
+            raise SaveError(f"Can't save {class_path(type(value))}: its state isn't a dict of attributes.")
+        name = self.record_type(value, state).name
+        return {"id": number, "record": name, "attributes": self.encode_attributes(state)}
+
+class SaveReader:
+    """Rebuilds one chunk of a save from its manifest and arrays."""
+
+    def __init__(
+            self, archive: FloorArchive, manifest: dict, arrays: Callable[[int], np.ndarray], floor: Optional[int]
+    ):
+        self.archive = archive
+        self.manifest = manifest
+        self.arrays = arrays
+        self.floor = floor
+        self.objects: Dict[int, Any] = {}
+        self.versions: Dict[str, int] = manifest["records"]  # The version each record type was written with.
+        for name, version in self.versions.items():
+            record_type = save_schema.RECORDS.get(name)
+            if record_type is None:
+                raise SaveError(f"{archive.filename} holds {name} records, which this version of the game doesn't.")
+            if version > record_type.version:
+                raise SaveError(f"{archive.filename} has {name} records from a newer version of the game.")
+
+    def record_type(self, name: str) -> save_schema.RecordType:
+        if name not in self.versions:
+            raise SaveError(f"{self.archive.filename} has a {name} record without a version.")
+        return save_schema.RECORDS[name]
+
+    def upgrade(self, record_type: save_schema.RecordType, attributes: dict) -> dict:
+        """Bring the attributes of a record up from the version it was written with to the current one."""
+        version = self.versions[record_type.name]
+        while version < record_type.version:
+            attributes = record_type.migrations[version](attributes)
+            version += 1
+        self.check(record_type, attributes)
+        return attributes
+
+    def check(self, record_type: save_schema.RecordType, fields: Iterable[str]) -> None:
+        unknown = set(fields) - record_type.fields
+        if unknown:
+            raise SaveError(f"{self.archive.filename} has {record_type.name}.{min(unknown)}, which isn't in the schema.")
+
+    def type_of(self, obj: object) -> save_schema.RecordType:
+        return self.record_type(save_schema.BY_PATH.get(class_path(type(obj)), ""))
+
+    def read(self) -> Any:
+        # A floor read while reading another chunk can hold entities from that chunk, like the player, which don't
+        # have their positions yet. The floors' spatial indexes are filled in once every chunk being read is done.
+        archive = self.archive
+        archive.reading += 1
+        try:
+            root = self.read_chunk()
+        finally:
+            archive.reading -= 1
+        if isinstance(root, GameMap):
+            archive.unindexed.append(root)
+        if not archive.reading:
+            while archive.unindexed:
+                archive.unindexed.pop(0).spatial_index.finish_loading()
+        return root
+
+    def read_chunk(self) -> Any:
+        records = self.manifest["entities"]
+        # Every entity exists before anything is decoded, so references to them can be filled in straight away.
+        entities: List[Entity] = []
+        paged: List[Entity] = []
+        for record in records:
+            if "prototype" in record:
+                entity = prototypes.instantiate(prototypes.get(record["prototype"]))
+            else:
+                cls = find_class(self.record_type(record["record"]).path)
+                entity = cls.__new__(cls)
+            live = self.archive.entities.get(record["uid"])
+            if live is None:
+                entity.save_uid = record["uid"]
+                self.archive.entities[entity.save_uid] = entity
+            else:
+                # Written with another chunk as well, which has already been read, or paged out with this floor and
+                # kept as it was by something that refers to it. References go to the live one, and the record is
+                # read into a copy that's dropped, for the objects in it that other records refer to.
+                if live.paged_floor == self.floor:
+                    live.paged_floor = None
+                    paged.append(live)
+            entities.append(entity)
+        root = self.decode(self.manifest["root"])
+        for entity, record in zip(entities, records):
+            if "prototype" in record:
+                entity_type = self.type_of(entity)
+                for name, value in self.upgrade(entity_type, record.get("attributes", {})).items():
+                    setattr(entity, name, self.decode(value))
+                components = record.get("components", {})
+                self.check(entity_type, components)
+                for name, changes in components.items():
+                    component = getattr(entity, name)
+                    for key, value in self.upgrade(self.type_of(component), changes).items():
+                        setattr(component, key, self.decode(value))
+            else:
+                attributes = self.upgrade(self.record_type(record["record"]), record["attributes"])
+                self.restore(entity, {name: self.decode(value) for name, value in attributes.items()})
+        if paged:
+            _reattach(root, paged)
+        return root
+
+    @staticmethod
+    def restore(obj: object, state: Any) -> None:
+        setstate = getattr(obj, "__setstate__", None)
+        if setstate:
+            setstate(state)
+        else:
+            obj.__dict__.update(state)
+
+    def decode_container(self, record: dict) -> Any:
+        # Registered before the items are read, so items that refer back to the container get it.
+        if "list" in record:
+            obj: Any = []
+        elif "set" in record:
+            obj = set()
+        elif "deque" in record:
+            obj = deque(maxlen=record["maxlen"])
+        else:
+            obj = OrderedDict() if record.get("ordered") else {}
+        self.objects[record["id"]] = obj
+        if "dict" in record:
+            obj.update((self.decode(key), self.decode(value)) for key, value in record["dict"])
+        elif "set" in record:
+            obj.update(self.decode(item) for item in record["set"])
+        else:
+            obj.extend(self.decode(item) for item in record["list" if "list" in record else "deque"])
+        return obj
+
+    def decode_lazy(self, record: Any) -> Any:
+        """Decode a reference to an entity on a floor that isn't loaded as an EntityReference, without loading it."""
+        if isinstance(record, dict) and "entity" in record and record.get("floor") is not None:
+            uid, floor = record["entity"], record["floor"]
+            if uid not in self.archive.entities and floor not in self.archive.maps:
+                return EntityReference(self.archive, uid, floor)
+        return self.decode(record)
+
+    def decode(self, record: Any) -> Any:
+        if not isinstance(record, dict):
+            return record
+        if "ref" in record:
+            return self.objects[record["ref"]]
+        if "entity" in record:
+            return self.archive.entity(record["entity"], record.get("floor"))
+        if "component" in record:
+            uid, name = record["component"]
+            return getattr(self.archive.entity(uid, record.get("floor")), name)
+        if "floor" in record:
+            return self.archive.load_floor(record["floor"])
+        if "engine" in record:
+            return self.archive.engine
+        if "tuple" in record or record.get("frozen"):
+            items = [self.decode(item) for item in record.get("tuple", record.get("set"))]
+            obj = tuple(items) if "tuple" in record else frozenset(items)
+            if "id" in record:
+                self.objects[record["id"]] = obj
+            return obj
+        if "slice" in record:
+            return slice(*record["slice"])
+        if "list" in record or "set" in record or "deque" in record or "dict" in record:
+            return self.decode_container(record)
+        if "enum" in record:
+            return find_class(save_schema.ENUMS[record["enum"]])[record["name"]]
+        if "shared" in record:
+            return find_class(save_schema.SHARED[record["shared"]])
+
+        number = record["id"]
+        if "method" in record:
+            obj = self.objects[number] = getattr(self.decode(record["self"]), record["method"])
+            return obj
+        if "array" in record:
+            obj = self.objects[number] = self.arrays(record["array"])
+            return obj
+        if "stream" in record:
+            obj = self.objects[number] = Stream.resume(record["stream"], record["words"], record["gauss"])
+            return obj
+        if "random" in record:
+            obj = self.objects[number] = random.Random()
+            internal_state = tuple(self.arrays(record["random"]).tolist())
+            obj.setstate((record["version"], internal_state, record["gauss"]))
+            return obj
+        record_type = self.record_type(record["record"])
+        cls = find_class(record_type.path)
+        obj = self.objects[number] = cls.__new__(cls)
+        if number == 0:
+            # The root of the chunk exists from here on, so references back to it while it's read resolve.
+            self.archive.add_root(self.floor, obj)
+        lazy = getattr(cls, "lazy_references", ())
+        state = {
+            name: self.decode_lazy(value) if name in lazy else self.decode(value)
+            for name, value in self.upgrade(record_type, record["attributes"]).items()
+        }
+        self.restore(obj, state)
+        return obj
+
+
+def _reattach(gamemap: GameMap, paged: List[Entity]) -> None:
+    """Put entities that were kept alive while their floor was paged out back in the map that was read for it."""
+    ids = {id(entity) for entity in paged}
+    for entity in gamemap.entities:
+        if id(entity) in ids:
+            entity.parent = gamemap
+        inventory = getattr(entity, "inventory", None)
+        for item in getattr(inventory, "items", ()):
+            if id(item) in ids:
+                item.parent = inventory
+
+
+def _write_chunk(archive: zipfile.ZipFile, manifest: dict, arrays: List[np.ndarray]) -> None:
+    archive.writestr("manifest.json", json.dumps(manifest, separators=(",", ":")), compress_type=zipfile.ZIP_LZMA)
+    for number, array in enumerate(arrays):
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        archive.writestr(f"arrays/{number}.npy", buffer.getvalue(), compress_type=zipfile.ZIP_LZMA)
+
+
+def _read_chunk(archive: FloorArchive, data: zipfile.ZipFile, floor: Optional[int]) -> Tuple[dict, Any]:
+    """Read the chunk in an open zip archive, returning its manifest and its root object.
+
+    The root chunk's manifest also tells the archive which floors it has.
+    """
+    manifest = json.loads(data.read("manifest.json"))
+    if manifest.get("format") != SAVE_FORMAT:
+        raise SaveError(f"{archive.filename} isn't a save file.")
+    version = manifest["version"]
+    if version > SAVE_VERSION:
+        raise SaveError(f"{archive.filename} was saved by a newer version of the game (format {version}).")
+    while version < SAVE_VERSION:
+        manifest = MIGRATIONS[version](manifest)
+        version += 1
+
+    if floor is None:
+        archive.floors = set(manifest["floors"])
+        archive.next_uid = manifest["next_uid"]
+        archive.checkpoint = manifest.get("checkpoint")
+
+    def array(number: int) -> np.ndarray:
+        return np.load(io.BytesIO(data.read(f"arrays/{number}.npy")), allow_pickle=False)
+
+    return manifest, SaveReader(archive, manifest, array, floor).read()
+
+
+class FloorArchive:
+    """
+    The save file a GameWorld was loaded from or last saved to, which holds the floors it hasn't needed yet.
+
+    It also pages floors out of memory, when the GameWorld has a resident_limit. A floor whose chunk in the save is
+    up to date is just dropped, and read back from the save. Any other is written to a page file of its own in a
+    temporary directory first, in the same format as the chunks of a save, so the next save copies it across as is.
+    Entities on a paged floor that something else still refers to, like a monster in the player's damage log, stay
+    alive but unplaced, and are put back in the map when the floor is read again.
+    """
+
+    def __init__(self, filename: Optional[str], maps: Dict[int, GameMap]):
+        self.filename = filename
+        self.maps = maps  # The GameWorld's maps, which floors are added to as they're loaded.
+        self.floors: Set[int] = set()  # The floors with a chunk in the file.
+        self.clean: Set[int] = set()  # The floors whose chunk in the file is up to date.
+        self.next_uid = 0
+        self.checkpoint: Optional[str] = None  # The token of the save, which its ActionJournal records follow.
+        self.engine: Optional[Engine] = None
+        # Every entity read or written so far, by uid, for the floors loaded later that refer to them.
+        self.entities: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        # A save of this world being written in the background, and the future of its write().
+        self.writing: Optional[Tuple[SaveSnapshot, Future]] = None
+        self.pages: Dict[int, str] = {}  # Floors paged out since the last save, and the file each one is in.
+        self.page_dir: Optional[str] = None
+        self.page_count = 0
+        self.visits: OrderedDict = OrderedDict()  # The floors visited, the least recent first.
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "page_outs": 0, "page_bytes": 0}
+        self.reading = 0  # How many chunks are being read, one inside the other.
+        self.unindexed: List[GameMap] = []  # Floors read whose spatial index is waiting for the outermost chunk.
+
+    def settle(self) -> Optional[BaseException]:
+        """Wait for the save being written in the background, if there is one, and finish it.
+
+        Returns the error it failed with, if it did.
+        """
+        if self.writing is None:
+            return None
+        snapshot, future = self.writing
+        self.writing = None
+        error = future.exception()
+        snapshot.finish(error)
+        return error
+
+    def add_root(self, floor: Optional[int], obj: Any) -> None:
+        if floor is None:
+            self.engine = obj
+        else:
+            self.maps[floor] = obj
+
+    def entity(self, uid: int, floor: Optional[int]) -> Entity:
+        entity = self.entities.get(uid)
+        if entity is None and floor is not None:
+            self.load_floor(floor)
+            entity = self.entities.get(uid)
+        if entity is None:
+            raise SaveError(f"{self.filename} refers to entity {uid}, which isn't in it.")
+        return entity
+
+    def load_floor(self, floor: int) -> GameMap:
+        """Return the map of a floor, reading it from its page or the file if it isn't loaded."""
+        gamemap = self.maps.get(floor)
+        if gamemap is None:
+            if floor in self.pages:
+                with open(self.pages[floor], "rb") as f:
+                    data = f.read()
+            elif floor in self.floors:
+                with zipfile.ZipFile(self.filename) as archive:
+                    data = archive.read(f"floors/{floor}.sav")
+            else:
+                raise SaveError(f"{self.filename} doesn't have floor {floor}.")
+            with zipfile.ZipFile(io.BytesIO(data)) as chunk:
+                _, gamemap = _read_chunk(self, chunk, floor)
+        return gamemap
+
+    def visit(self, floor: int) -> None:
+        self.visits.pop(floor, None)
+        self.visits[floor] = None
+
+    def page_out(self, engine: Engine, floor: int) -> None:
+        """Drop a loaded floor from memory, writing it to a page file unless the save has it as it is."""
+        gamemap = self.maps[floor]
+        saved = self.filename and floor in self.floors and floor in self.clean and self.writing is None
+        if not saved:
+            writer = SaveWriter(engine)
+            chunk = writer.write_page(floor)
+            self.next_uid = writer.next_uid
+            if self.page_dir is None:
+                self.page_dir = tempfile.mkdtemp(prefix="yarl-floors-")
+                weakref.finalize(self, shutil.rmtree, self.page_dir, True)
+            self.page_count += 1
+            path = os.path.join(self.page_dir, f"{floor}-{self.page_count}.sav")
+            with zipfile.ZipFile(path, "w") as page:
+                _write_chunk(page, chunk.manifest, chunk.arrays)
+            self.drop_page(floor)
+            self.pages[floor] = path
+            self.stats["page_bytes"] += os.path.getsize(path)
+        self.engine = engine
+        for entity in gamemap.entities:
+            for carried in (entity, *getattr(getattr(entity, "inventory", None), "items", ())):
+                carried.paged_floor = floor
+            del entity.parent  # So the ones that stay alive don't keep the map alive.
+        del self.maps[floor]
+        self.stats["page_outs"] += 1
+
+    def drop_page(self, floor: int) -> None:
+        """Forget the page file of a floor, deleting it unless a save being written still needs it."""
+        path = self.pages.pop(floor, None)
+        if path is None:
+            return
+        self.stats["page_bytes"] -= os.path.getsize(path)
+        if self.writing is None or path not in self.writing[0].pages.values():
+            os.remove(path)
+
+    def metrics(self) -> Dict[str, int]:
+        """Return the cache's hits and misses, what it has paged out, and the memory the loaded floors take up."""
+        return dict(
+            self.stats,
+            resident=len(self.maps),
+            paged=len(self.pages),
+            resident_bytes=sum(
+                value.nbytes for gamemap in self.maps.values() for value in vars(gamemap).values()
+                if isinstance(value, np.ndarray)
+            ),
+            resident_entities=sum(len(gamemap.entities) for gamemap in self.maps.values()),
+        )
+
+
+class EntityReference:
+    """
+    An entity on a floor that wasn't loaded when the reference to it was read, which loads the floor when resolved.
+
+    Attributes that are rarely followed, like the attacker in a damage log entry, are read as these when the class
+    lists them in `lazy_references`, so that loading a save doesn't load every floor they point to. The class
+    resolves them when they're used.
+    """
+
+    def __init__(self, archive: Optional[FloorArchive], uid: int, floor: int):
+        self.archive = archive
+        self.uid = uid
+        self.floor = floor
+
+    def resolve(self) -> Entity:
+        return self.archive.entity(self.uid, self.floor)
+
+
+class FloorStub:
+    """
+    Stands in for a floor that a SaveSnapshot doesn't write, in the snapshot's copy of the game.
+
+    It's written as a reference to the floor, and holds the copies of the entities on it that the snapshot reached,
+    so they are written as being on that floor.
+    """
+
+    def __init__(self, floor: int):
+        self.floor = floor
+        self.entities: List[Entity] = []
+
+
+class SnapshotPickler(pickle.Pickler):
+    """
+    Pickles the game for a SaveSnapshot.
+
+    The floors in `unchanged`, by id, are pickled as FloorStubs, and the GameWorld's archive as None. Shared
+    definitions, and the data entities share with their prototypes, are pickled as the way to look them up again,
+    so the copies refer to the same objects. Entities are given their save_uid, and collected in `entities`.
+    Only instances of classes go through reducer_override, so this costs little on top of the pickling itself.
+    """
+
+    def __init__(self, file: io.BytesIO, archive: FloorArchive, unchanged: Dict[int, int]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.archive = archive
+        self.unchanged = unchanged
+        self.shared = prototypes.shared_objects()
+        self.entities: List[Entity] = []
+
+    def reducer_override(self, obj: Any) -> Any:
+        if isinstance(obj, Entity):
+            if obj.save_uid is None:
+                obj.save_uid = self.archive.next_uid
+                self.archive.next_uid += 1
+            self.archive.entities[obj.save_uid] = obj
+            self.entities.append(obj)
+            return NotImplemented
+        if obj is self.archive:
+            return type(None), ()
+        floor = self.unchanged.get(id(obj))
+        if floor is not None:
+            return FloorStub, (floor,)
+        shared = self.shared.get(id(obj))
+        if shared is not None:
+            return prototypes.shared_object, shared
+        if isinstance(obj, prototypes.SHARED_TYPES):
+            name = global_name(obj)
+            if name:
+                return find_class, (name,)
+        return NotImplemented
+
+
+class SaveSnapshot:
+    """
+    A save taken on the main thread, to be written to a file from any thread.
+
+    Taking it pickles the Engine, leaving out the floors that haven't changed since the last save, so the copy
+    doesn't change as the game goes on. Definitions that entities share with their prototypes are passed by
+    reference, like the prototypes' own snapshots do, so the copies still compare as unchanged. Entities are given
+    their save_uid as they're pickled. write() does the rest on the copy: comparing entities with their prototypes,
+    encoding the chunks, the JSON, the compression, copying the unchanged floors across from the last save, and
+    moving the new file over the old one. Call finish() on the main thread after write() has returned or raised.
+    Each save has a new checkpoint token, which the ActionJournal, if there is one, notes when the snapshot is taken
+    and cuts itself back to once the save is on disk.
+    The GameWorld's archive counts the save as written from the moment it's taken, so the floors entered after it
+    are written by the next one. It goes on reading floors from the last save until finish(), which is fine since
+    the floors it reads were copied across unchanged.
+    """
+
+    def __init__(self, engine: Engine, filename: str, journal: Optional[ActionJournal] = None):
+        world = engine.game_world
+        archive = world.floor_archive()
+        archive.settle()  # A failure is rolled back, and this save writes what that one didn't.
+
+        self.archive = archive
+        self.filename = filename
+        self.journal = journal
+        self.checkpoint = os.urandom(8).hex()
+        self.source = archive.filename  # Where the unchanged floors are copied from.
+        self.previous_floors = archive.floors
+        self.pages = dict(archive.pages)  # Copied across like the floors in the source.
+        floors = set(world.maps) | archive.floors | set(archive.pages)
+        self.floors = sorted(floors)
+        unchanged = {
+            id(gamemap): floor for floor, gamemap in world.maps.items()
+            if floor in archive.clean and floor != world.current_floor
+        }
+        self.written = sorted(floor for floor in world.maps if id(world.maps[floor]) not in unchanged)
+
+        buffer = io.BytesIO()
+        pickler = SnapshotPickler(buffer, archive, unchanged)
+        pickler.dump(engine)
+        pickler.dump(pickler.entities)  # Every entity reached, to find the ones on the floors left out.
+        self.data = buffer.getvalue()
+        self.next_uid = archive.next_uid
+
+        archive.floors = floors
+        archive.clean = floors - {world.current_floor}
+        archive.engine = engine
+        if journal:
+            journal.record_checkpoint(self.checkpoint)
+
+    def encode(self) -> Tuple[dict, Dict[int, Tuple[dict, List[np.ndarray]]]]:
+        """Unpickle the copy of the game and encode it, returning the root manifest and the floors' chunks."""
+        unpickler = pickle.Unpickler(io.BytesIO(self.data))
+        engine = unpickler.load()
+        entities = unpickler.load()
+        for entity in entities:
+            parent = vars(entity).get("parent")
+            while parent is not None and not isinstance(parent, (GameMap, FloorStub)):
+                parent = vars(parent).get("parent")
+            if isinstance(parent, FloorStub):
+                parent.entities.append(entity)
+        for floor in self.written:
+            engine.game_world.maps[floor].spatial_index.finish_loading()
+
+        writer = SaveWriter(engine)
+        writer.write()
+        manifest = dict(
+            writer.chunks[None].manifest, floors=self.floors, next_uid=self.next_uid, checkpoint=self.checkpoint
+        )
+        return manifest, {floor: (chunk.manifest, chunk.arrays) for floor, chunk in writer.chunks.items()}
+
+    def write(self) -> None:
+        """Write the save next to its file first and then move it over it, so a save that fails part way leaves
+        the last one as it was."""
+        manifest, chunks = self.encode()
+        temporary = f"{self.filename}.tmp"
+        copied = [floor for floor in self.floors if floor not in chunks and floor not in self.pages]
+        source = zipfile.ZipFile(self.source) if copied else None
+        try:
+            with zipfile.ZipFile(temporary, "w") as save:
+                _write_chunk(save, manifest, chunks[None][1])
+                for floor in self.floors:
+                    if floor in chunks:
+                        buffer = io.BytesIO()
+                        with zipfile.ZipFile(buffer, "w") as chunk:
+                            _write_chunk(chunk, *chunks[floor])
+                        data = buffer.getvalue()
+                    elif floor in self.pages:
+                        with open(self.pages[floor], "rb") as page:
+                            data = page.read()
+                    else:
+                        data = source.read(f"floors/{floor}.sav")
+                    save.writestr(f"floors/{floor}.sav", data)
+        finally:
+            if source:
+                source.close()
+        os.replace(temporary, self.filename)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Start reading floors from the new file, or if writing it failed, go back to counting on the last one."""
+        if error is None:
+            self.archive.filename = self.filename
+            self.archive.checkpoint = self.checkpoint
+            if self.journal:
+                self.journal.committed(self.checkpoint)
+            # The floors that were paged out are in the save now, and are read from there.
+            for floor, path in self.pages.items():
+                if self.archive.pages.get(floor) == path:
+                    self.archive.drop_page(floor)
+                elif os.path.exists(path):
+                    os.remove(path)  # Paged out again since, and left for this save to copy.
+        else:
+            self.archive.floors = self.previous_floors
+            self.archive.clean = set()
+
+
+def save_engine(engine: Engine, filename: str, journal: Optional[ActionJournal] = None) -> None:
+    """Write the engine to filename in the structured save format, waiting for any save still being written."""
+    snapshot = SaveSnapshot(engine, filename, journal)
+    try:
+        snapshot.write()
+    except BaseException as error:
+        snapshot.finish(error)
+        raise
+    snapshot.finish()
+
+
+def is_save_file(filename: str) -> bool:
+    return zipfile.is_zipfile(filename)
+
+
+def load_engine(filename: str) -> Engine:
+    """Read the engine, and the current floor, from a file written by save_engine.
+
+    The other floors are read when they're needed.
+    """
+    archive = FloorArchive(filename, {})
+    with zipfile.ZipFile(filename) as data:
+        _, engine = _read_chunk(archive, data, None)
+    world = engine.game_world
+    archive.clean = archive.floors - {world.current_floor}
+    world.maps = archive.maps
+    world.archive = archive
+    return engine
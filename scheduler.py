@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import heapq
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from entity import Actor
+
+
+class TurnScheduler:
+    """
+    Orders the actors of a GameMap in a heap keyed on the round they are next due to act.
+
+    Every actor keeps the sequence number it was first scheduled with, so actors due in the same round always act
+    in the same order. The scheduler also owns the actors' time pools: when an actor's turn ends it is refilled to
+    its max_time and queued for the next round.
+    Actors that due_actors has yielded are "taken" until they're handed back with end_turn, schedule or unschedule.
+    requeue_taken puts any that weren't back at the front of the queue, so a round cut short by an error doesn't
+    lose them, and a save taken in the middle of a round keeps them queued.
+
+    Actors can also be moved to a sleep tier, where they are never yielded until they are woken.
+    """
+
+    def __init__(self):
+        self.current_round = 0
+        self.dormant: Dict[Actor, int] = {}  # Sleeping actor -> the round it fell asleep in.
+        self._queue: List[Tuple[int, int, int, Actor]] = []
+        self._entries: Dict[Actor, Tuple[int, int, int, Actor]] = {}
+        self._order: Dict[Actor, int] = {}
+        self._taken: Dict[Actor, None] = {}
+        self._next_order = 0
+        self._next_entry = 0
+
+    def __getstate__(self) -> dict:
+        # The heap, with its stale entries, is rebuilt from the queued actors' rounds and places in the turn order.
+        # Taken actors are saved as due in the current round, like requeue_taken leaves them.
+        queued = [(actor, entry[0], entry[1]) for actor, entry in self._entries.items()]
+        queued += [(actor, self.current_round, self._order[actor]) for actor in self._taken]
+        return {
+            "current_round": self.current_round,
+            "dormant": self.dormant,
+            "queued": queued,
+            "asleep": [
+                (actor, order) for actor, order in self._order.items()
+                if actor not in self._entries and actor not in self._taken
+            ],
+            "_next_order": self._next_order,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.current_round = state["current_round"]
+        self.dormant = state["dormant"]
+        self._next_order = state["_next_order"]
+        self._order = dict(state["asleep"])
+        for actor, next_round, order in state["queued"]:
+            self._order[actor] = order
+            self._entries[actor] = (next_round, order, self._next_entry, actor)
+            self._next_entry += 1
+        self._queue = list(self._entries.values())
+        heapq.heapify(self._queue)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, actor: Actor) -> bool:
+        return actor in self._entries
+
+    def awake(self) -> List[Actor]:
+        """Return the actors that are queued, in the order they were queued."""
+        return list(self._entries)
+
+    def schedule(self, actor: Actor) -> None:
+        """Queue an actor to act next round, replacing any entry it already has."""
+        if actor not in self._order:
+            self._order[actor] = self._next_order
+            self._next_order += 1
+        self.dormant.pop(actor, None)
+        self._taken.pop(actor, None)
+        self._push(actor, self.current_round + 1)
+
+    def _push(self, actor: Actor, due_round: int) -> None:
+        entry = (due_round, self._order[actor], self._next_entry, actor)
+        self._next_entry += 1
+        self._entries[actor] = entry
+        heapq.heappush(self._queue, entry)
+
+    def unschedule(self, actor: Actor) -> None:
+        """Remove an actor from the queue. Its stale heap entry is discarded when it surfaces."""
+        self._entries.pop(actor, None)
+        self._order.pop(actor, None)
+        self.dormant.pop(actor, None)
+        self._taken.pop(actor, None)
+
+    def sleep(self, actor: Actor) -> None:
+        """Move an actor to the sleep tier. It keeps its place in the turn order for when it wakes."""
+        self._entries.pop(actor, None)
+        self._taken.pop(actor, None)
+        self.dormant[actor] = self.current_round
+
+    def wake(self, actor: Actor) -> int:
+        """Queue a sleeping actor again and return the number of rounds it slept through."""
+        slept_since = self.dormant.pop(actor)
+        self.schedule(actor)
+        return self.current_round - slept_since
+
+    def next_round_of(self, actor: Actor) -> int:
+        """Return the round the actor is next due in, or -1 if it isn't scheduled."""
+        entry = self._entries.get(actor)
+        return entry[0] if entry else -1
+
+    def due_actors(self) -> Iterator[Actor]:
+        """Advance to the next round and yield, in order, every actor due to act in it.
+
+        Yielded actors are taken off the queue; the caller hands them back with end_turn (or schedule), or puts
+        the ones it didn't get to back with requeue_taken.
+        """
+        self.current_round += 1
+        while self._queue and self._queue[0][0] <= self.current_round:
+            entry = heapq.heappop(self._queue)
+            actor = entry[3]
+            if self._entries.get(actor) is not entry:
+                continue  # Stale entry, the actor was rescheduled or removed.
+            del self._entries[actor]
+            self._taken[actor] = None
+            yield actor
+
+    def requeue_taken(self) -> None:
+        """Queue the taken actors that weren't handed back again, to act first in the next round."""
+        for actor in self._taken:
+            self._push(actor, self.current_round)
+        self._taken.clear()
+
+    def end_turn(self, actor: Actor) -> None:
+        """Refill the actor's time pool and queue it for the next round."""
+        actor.fighter.time = actor.fighter.max_time
+        self.schedule(actor)
@@ -2,17 +2,17 @@
 from __future__ import annotations
 
 import copy
-import lzma
+import os
 import traceback
 from typing import Optional
 
-import dill
 import tcod
 from tcod import libtcodpy
 
 import color
 import entity_factories
 import input_handlers
+import savefile
 from engine import Engine
 from game_map import GameWorld
 from skill_factories import Fireball, PowerShot
@@ -22,15 +22,20 @@ background_image = tcod.image.load("dungeon.png")[:, :, :3]
 
 
 def load_game(filename: str) -> Engine:
-    """Load an Engine instance from a file."""
-    with open(filename, "rb") as f:
-        engine = dill.loads(lzma.decompress(f.read()))
-    assert isinstance(engine, Engine)
-    return engine
+    """Load an Engine instance from a file written by savefile.
+
+    Saves from before the save file format, which were dill pickles, can't be loaded and raise a SaveError.
+    """
+    if os.path.exists(filename) and not savefile.is_save_file(filename):
+        raise savefile.SaveError(f"{filename} was saved by an older version of the game and can't be loaded.")
+    return savefile.load_engine(filename)
 
 
-def new_game() -> Engine:
-    """Return a brand new game session as an Engine instance."""
+def new_game(seed: Optional[int] = None) -> Engine:
+    """Return a brand new game session as an Engine instance.
+
+    Games started with the same seed generate the same dungeon and make the same rolls.
+    """
     map_width = 80
     map_height = 40
 
@@ -40,7 +45,7 @@ def new_game() -> Engine:
 
     player = copy.deepcopy(entity_factories.player)
 
-    engine = Engine(player=player)
+    engine = Engine(player=player, seed=seed)
 
     engine.game_world = GameWorld(
         engine=engine,
@@ -90,6 +95,9 @@ def new_game() -> Engine:
 class MainMenu(input_handlers.BaseEventHandler):
     """Handle the main menu rendering and input."""
 
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed  # For new games, None for a random one.
+
     def on_render(self, console: tcod.Console) -> None:
         """Render the main menu on a background image."""
         console.draw_semigraphics(background_image, 0, 0)
@@ -130,13 +138,19 @@ class MainMenu(input_handlers.BaseEventHandler):
             raise SystemExit()
         elif event.sym == tcod.event.KeySym.c:
             try:
-                return input_handlers.MainGameEventHandler(load_game("savegame.sav"))
+                engine = load_game("savegame.sav")
+                journal = input_handlers.BaseEventHandler.journal
+                if journal and journal.recover(engine):
+                    engine.message_log.add_message("Recovered the turns played since the last save.")
+                return input_handlers.MainGameEventHandler(engine)
             except FileNotFoundError:
                 return input_handlers.PopupMessage(self, "No saved game to load.")
             except Exception as exc:
                 traceback.print_exc()  # Print to stderr.
                 return input_handlers.PopupMessage(self, f"Failed to load save:\n{exc}")
         elif event.sym == tcod.event.KeySym.n:
-            return input_handlers.MainGameEventHandler(new_game())
+            if input_handlers.BaseEventHandler.journal:
+                input_handlers.BaseEventHandler.journal.reset()  # Its records are for the last game's save.
+            return input_handlers.MainGameEventHandler(new_game(self.seed))
 
         return None
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+
+class SpatialIndex:
+    """
+    Keeps track of which entities are on which tile of a GameMap, so lookups by position don't scan every entity.
+
+    `buckets` holds the entities on each occupied tile, in the order they arrived, and `blockers` counts the
+    movement-blocking entities on every tile so "is something in the way" is a single array read. Entities are
+    re-indexed with update whenever their position or blocks_movement changes. `on_blocker_change`, if set, is called
+    with (x, y, delta) every time the blocker count of a tile changes.
+    With `debug` on, every lookup is checked against a brute force scan of the indexed entities.
+    """
+
+    debug = False  # Set on the class to check every index in the game.
+
+    def __init__(
+            self, width: int, height: int, entities: Iterable[Entity] = (),
+            on_blocker_change: Optional[Callable[[int, int, int], None]] = None,
+    ):
+        self.on_blocker_change = on_blocker_change
+        self.blockers = np.zeros((width, height), dtype=np.int16, order="F")
+        self.buckets: Dict[Tuple[int, int], List[Entity]] = {}
+        # Where, and whether as a blocker, each entity is currently indexed.
+        self.indexed: Dict[Entity, Tuple[int, int, bool]] = {}
+        for entity in entities:
+            self.add(entity)
+
+    def __getstate__(self) -> dict:
+        # Only the entities, in the order they were indexed, which is also the order of every bucket. The rest is
+        # rebuilt by finish_loading once the entities have their positions back.
+        return {
+            "on_blocker_change": self.on_blocker_change,
+            "shape": self.blockers.shape,
+            "entities": list(self.indexed),
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(*state["shape"], on_blocker_change=state["on_blocker_change"])
+        self.loading: List[Entity] = state["entities"]
+
+    def finish_loading(self) -> None:
+        """Index the entities a loaded index was saved with."""
+        for entity in self.__dict__.pop("loading", ()):
+            self.add(entity)
+
+    def __contains__(self, entity: Entity) -> bool:
+        return entity in self.indexed
+
+    def add(self, entity: Entity) -> None:
+        if entity in self.indexed:
+            self.update(entity)
+            return
+        x, y, blocks = entity.x, entity.y, entity.blocks_movement
+        self.indexed[entity] = (x, y, blocks)
+        self.buckets.setdefault((x, y), []).append(entity)
+        if blocks:
+            self.blockers[x, y] += 1
+            if self.on_blocker_change:
+                self.on_blocker_change(x, y, 1)
+
+    def remove(self, entity: Entity) -> None:
+        x, y, blocks = self.indexed.pop(entity)
+        bucket = self.buckets[x, y]
+        bucket.remove(entity)
+        if not bucket:
+            del self.buckets[x, y]
+        if blocks:
+            self.blockers[x, y] -= 1
+            if self.on_blocker_change:
+                self.on_blocker_change(x, y, -1)
+
+    def update(self, entity: Entity) -> None:
+        """Re-index an entity that moved or started/stopped blocking movement. Unknown entities are ignored."""
+        if self.indexed.get(entity, (entity.x, entity.y, entity.blocks_movement)) == (
+            entity.x, entity.y, entity.blocks_movement
+        ):
+            return
+        self.remove(entity)
+        self.add(entity)
+
+    def at(self, x: int, y: int) -> List[Entity]:
+        """Return the entities on this tile."""
+        found = list(self.buckets.get((x, y), ()))
+        if self.debug:
+            self.verify_tile(x, y, found)
+        return found
+
+    def blocking_at(self, x: int, y: int) -> Optional[Entity]:
+        """Return the first entity on this tile that blocks movement, if any."""
+        found = None
+        if self.blockers[x, y]:
+            found = next(entity for entity in self.buckets[x, y] if entity.blocks_movement)
+        if self.debug:
+            self.verify_tile(x, y, self.buckets.get((x, y), []))
+        return found
+
+    def blocking_in(self, x0: int, y0: int, x1: int, y1: int, mask: Optional[np.ndarray] = None) -> List[Entity]:
+        """Return the blocking entities in the box from (x0, y0) up to, not including, (x1, y1).
+
+        With a `mask` the shape of the box, only the tiles where it's True count. Only the occupied tiles are
+        visited, ordered by x then y.
+        """
+        occupied = self.blockers[x0:x1, y0:y1] > 0
+        if mask is not None:
+            occupied &= mask
+        xs, ys = np.nonzero(occupied)
+        return [
+            entity
+            for x, y in zip((xs + x0).tolist(), (ys + y0).tolist())
+            for entity in self.buckets[x, y]
+            if entity.blocks_movement
+        ]
+
+    def verify_tile(self, x: int, y: int, found: List[Entity]) -> None:
+        expected = [
+            entity for entity in self.indexed if entity.x == x and entity.y == y
+        ]
+        blocking = sum(entity.blocks_movement for entity in expected)
+        if set(found) != set(expected) or blocking != self.blockers[x, y]:
+            raise AssertionError(f"Spatial index out of sync at {(x, y)}: has {found}, expected {expected}.")
+
+    def verify(self, entities: Iterable[Entity]) -> None:
+        """Check the whole index against a brute force scan of the given entities."""
+        entities = set(entities)
+        if entities != set(self.indexed):
+            raise AssertionError("Spatial index holds different entities than the map.")
+        blockers = np.zeros_like(self.blockers)
+        for entity in entities:
+            if entity not in self.buckets.get((entity.x, entity.y), ()):
+                raise AssertionError(f"{entity.name} is not indexed at {(entity.x, entity.y)}.")
+            if entity.blocks_movement:
+                blockers[entity.x, entity.y] += 1
+        if not np.array_equal(blockers, self.blockers):
+            raise AssertionError("Spatial index blocker counts are out of sync.")
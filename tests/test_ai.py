@@ -0,0 +1,73 @@
+import random
+
+import entity_factories
+import setup_game
+import tile_types
+from components.ai import DesireMap
+from game_map import GameMap
+from procgen import RectangularRoom
+
+
+def open_room(engine, width=21, height=11):
+    """Make the current map a single empty room with walls around it."""
+    gamemap = GameMap(engine, width, height)
+    gamemap.tiles[1:-1, 1:-1] = tile_types.floor
+    gamemap.rooms = [RectangularRoom(0, 0, width - 1, height - 1)]
+    engine.game_map = gamemap
+    return gamemap
+
+
+def distance(a, b):
+    return max(abs(a.x - b.x), abs(a.y - b.y))
+
+
+def test_desire_map_queries_do_not_pile_up_desires():
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    gamemap = open_room(engine)
+    engine.player.place(3, 5, gamemap)
+    kobold = entity_factories.kobold.spawn(gamemap, 10, 5)
+
+    desire_map = DesireMap(kobold)
+    first = desire_map.get_path_to([engine.player])
+    assert desire_map.get_path_to([engine.player]) == first
+    assert len(desire_map.desires) == 1
+
+
+def test_fleeing_actor_runs_from_every_hostile_in_sight():
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    gamemap = open_room(engine)
+    player = engine.player
+    player.place(7, 5, gamemap)
+    kobold = entity_factories.kobold.spawn(gamemap, 10, 5)
+    troll = entity_factories.troll.spawn(gamemap, 13, 5)  # Trolls hunt kobolds.
+    kobold.ai.state = "Fleeing"
+    kobold.ai.set_target(player)
+
+    for _ in range(3):
+        before = min(distance(kobold, player), distance(kobold, troll))
+        kobold.fighter.time = kobold.fighter.max_time
+        kobold.ai.perform()
+        # Running straight from the player would be running into the troll.
+        assert min(distance(kobold, player), distance(kobold, troll)) >= before
+        assert len(kobold.ai.desire_map.desires) == 2  # The threats, and the room.
+
+
+def test_path_queries_to_unreachable_spots_return_no_path_without_acting():
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    gamemap = open_room(engine)
+    engine.player.place(3, 5, gamemap)
+    kobold = entity_factories.kobold.spawn(gamemap, 10, 5)
+    gamemap.tiles[15, 1:-1] = tile_types.wall
+    time = kobold.fighter.time
+
+    assert kobold.ai.get_path_to(18, 5) == []
+    assert kobold.fighter.time == time
+
+    # Moving without a path is what spends the turn waiting.
+    kobold.ai.set_path(kobold.ai.get_path_to(18, 5))
+    kobold.ai.move_along_path()
+    assert kobold.fighter.time < time
+    assert (kobold.x, kobold.y) == (10, 5)
@@ -0,0 +1,19 @@
+import random
+
+import headless
+import replay
+import setup_game
+
+
+def play(seed, enabled, workers):
+    random.seed(seed)
+    engine = setup_game.new_game(seed)
+    engine.prefetcher.enabled = enabled
+    engine.prefetcher.workers = workers
+    engine.player.fighter.max_hp = engine.player.fighter.hp = 10 ** 6  # So the game doesn't end early.
+    headless.HeadlessRunner(engine, headless.BOTS["random"]()).run(400, 6)
+    return replay.state_checksum(engine)
+
+
+def test_prefetching_does_not_change_how_a_seeded_game_plays_out():
+    assert play(3, True, 2) == play(3, True, 0) == play(3, False, 0)
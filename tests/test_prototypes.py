@@ -0,0 +1,39 @@
+import threading
+import time
+
+import prototypes
+
+
+def test_spawning_from_several_threads_builds_one_snapshot_per_prototype(monkeypatch):
+    names = ["player", "orc", "kobold", "troll"]
+    for name in names:
+        prototypes._snapshots.pop(prototypes.get(name), None)
+    built = []
+    snapshot_init = prototypes.Snapshot.__init__
+
+    def counting_init(self, prototype):
+        built.append(prototype.prototype_id)
+        time.sleep(0.01)  # Let the other threads run while the snapshot is built.
+        snapshot_init(self, prototype)
+
+    monkeypatch.setattr(prototypes.Snapshot, "__init__", counting_init)
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def spawn():
+        barrier.wait()
+        try:
+            for name in names:
+                prototypes.instantiate(prototypes.get(name))
+                prototypes.shared_objects()
+        except Exception as error:  # Reported below, since the thread would swallow it.
+            errors.append(error)
+
+    threads = [threading.Thread(target=spawn) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(built) == sorted(names)
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+import savefile
+import setup_game
+
+
+class Stray:
+    """A class the save schema doesn't know."""
+
+
+def other_actor(engine):
+    return next(actor for actor in engine.game_map.actors if actor is not engine.player)
+
+
+def test_references_to_other_floors_load_only_the_current_floor(tmp_path):
+    random.seed(2)
+    engine = setup_game.new_game(2)
+    world = engine.game_world
+    fighter = engine.player.fighter
+    attackers = []
+    for _ in range(2):
+        attacker = other_actor(engine)
+        fighter.create_damage_log(category="Attack", source_entity=attacker, details="test")
+        attackers.append((world.current_floor, attacker.name, attacker.x, attacker.y))
+        world.move_down()
+    assert world.current_floor == 3
+
+    filename = str(tmp_path / "save.sav")
+    savefile.save_engine(engine, filename)
+    loaded = savefile.load_engine(filename)
+    world = loaded.game_world
+    assert set(world.maps) == {3}
+
+    log = list(loaded.player.fighter.damage_log)
+    assert set(world.maps) == {3}
+    for entry, (floor, name, x, y) in zip(log, attackers):
+        attacker = entry.source_entity
+        assert floor in world.maps
+        assert attacker.gamemap is world.maps[floor]
+        assert (attacker.name, attacker.x, attacker.y) == (name, x, y)
+
+
+def test_writing_an_attribute_outside_the_schema_fails(tmp_path):
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    engine.player.fighter.stray = 1
+    with pytest.raises(savefile.SaveError, match=r"fighter\.stray"):
+        savefile.save_engine(engine, str(tmp_path / "save.sav"))
+
+
+def test_writing_a_class_outside_the_schema_fails(tmp_path):
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    engine.message_log.messages.append(Stray())
+    with pytest.raises(savefile.SaveError, match="test_savefile:Stray"):
+        savefile.save_engine(engine, str(tmp_path / "save.sav"))
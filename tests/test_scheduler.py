@@ -0,0 +1,69 @@
+import pickle
+import random
+
+import pytest
+
+import setup_game
+from scheduler import TurnScheduler
+
+
+class Token:
+    """Stands in for an actor: the scheduler only hashes and orders them."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def test_error_in_one_turn_keeps_the_rest_of_the_round_scheduled():
+    random.seed(1)
+    engine = setup_game.new_game(1)
+    game_map = engine.game_map
+    scheduler = game_map.scheduler
+    engine.dormancy.wake_radius = engine.dormancy.sleep_radius = 10 ** 6  # Keep everyone awake.
+    engine.handle_enemy_turns()
+    queued = set(scheduler.awake())
+    assert len(queued) > 2
+
+    broken = next(actor for actor in scheduler.awake() if actor.ai)
+
+    def perform():
+        raise RuntimeError("broken AI")
+
+    broken.ai.perform = perform
+    with pytest.raises(RuntimeError):
+        engine.handle_enemy_turns()
+    assert set(scheduler.awake()) == queued
+
+    del broken.ai.perform
+    engine.handle_enemy_turns()
+    assert set(scheduler.awake()) == {actor for actor in queued if actor.is_alive}
+
+
+def test_save_in_the_middle_of_a_round_keeps_the_taken_actors():
+    scheduler = TurnScheduler()
+    tokens = [Token(name) for name in "abcd"]
+    for token in tokens:
+        scheduler.schedule(token)
+    due = scheduler.due_actors()
+    first = next(due)
+    second = next(due)
+    scheduler.schedule(first)
+
+    loaded = pickle.loads(pickle.dumps((tokens, scheduler)))[1]
+    assert len(loaded) == 4
+    assert second.name == "b"
+    # b was taken but not handed back, so it goes first, then the rest of its round, then a's.
+    assert [token.name for token in loaded.due_actors()] == ["b", "c", "d", "a"]
+
+
+def test_requeue_taken_puts_them_ahead_of_the_next_round():
+    scheduler = TurnScheduler()
+    tokens = [Token(name) for name in "abc"]
+    for token in tokens:
+        scheduler.schedule(token)
+    due = scheduler.due_actors()
+    scheduler.schedule(next(due))
+    next(due)
+    scheduler.requeue_taken()
+    # b and c never got their turn, so they go before a, which had its turn and is due in the next round.
+    assert [token.name for token in scheduler.due_actors()] == ["b", "c", "a"]
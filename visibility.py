@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List
+
+import numpy as np  # type: ignore
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from game_map import GameMap
+
+
+class VisibilityTable:
+    """
+    Answers "can A see B" for every pair of living actors on a GameMap.
+
+    The table is built for all actors in one pass: their fields of view are stacked into one array, which is then
+    indexed with every actor's position to give an actors x actors matrix. When an actor moves only its row (what it
+    sees) and column (who sees it) are updated. Spawns and floor changes mark the table dirty, and it is rebuilt the
+    next time it is queried.
+    """
+
+    def __init__(self, gamemap: GameMap):
+        self.gamemap = gamemap
+        self.dirty = True
+        self.tiles_revision = -1
+        self.actors: List[Actor] = []
+        self.index: Dict[Actor, int] = {}
+        self.radii = np.zeros(0, dtype=np.int32)
+        self.xs = np.zeros(0, dtype=np.intp)
+        self.ys = np.zeros(0, dtype=np.intp)
+        # Sized by the first rebuild, since the map may still be half loaded here.
+        self.fovs = np.zeros((0, 0, 0), dtype=bool)
+        self.matrix = np.zeros((0, 0), dtype=bool)
+
+    def __getstate__(self) -> dict:
+        # Rebuilt on the first query after loading, so only keep what's needed to do that.
+        return {"gamemap": self.gamemap}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["gamemap"])
+
+    def invalidate(self) -> None:
+        self.dirty = True
+
+    def rebuild(self) -> None:
+        """Compute the visibility of every living actor on the map at once."""
+        gamemap = self.gamemap
+        self.actors = list(gamemap.actors)
+        self.index = {actor: i for i, actor in enumerate(self.actors)}
+        self.radii = np.array([actor.fighter.sight_range for actor in self.actors], dtype=np.int32)
+        self.xs = np.array([actor.x for actor in self.actors], dtype=np.intp)
+        self.ys = np.array([actor.y for actor in self.actors], dtype=np.intp)
+        if self.actors:
+            self.fovs = np.stack(
+                [gamemap.compute_fov(actor.x, actor.y, actor.fighter.sight_range) for actor in self.actors]
+            )
+        else:
+            self.fovs = np.zeros((0, gamemap.width, gamemap.height), dtype=bool)
+        self.matrix = self.fovs[:, self.xs, self.ys]
+        np.fill_diagonal(self.matrix, False)
+        self.tiles_revision = gamemap.tiles_revision
+        self.dirty = False
+        gamemap.engine.profiler.count("visibility_rebuild")
+
+    def ensure_current(self) -> None:
+        if self.dirty or self.tiles_revision != self.gamemap.tiles_revision:
+            self.rebuild()
+
+    def refresh_actor(self, actor: Actor) -> None:
+        """Update the row and column of an actor that moved or whose sight range changed."""
+        i = self.index.get(actor)
+        if self.dirty or i is None:
+            self.dirty = True
+            return
+        self.xs[i] = actor.x
+        self.ys[i] = actor.y
+        self.radii[i] = actor.fighter.sight_range
+        self.fovs[i] = self.gamemap.compute_fov(actor.x, actor.y, self.radii[i])
+        self.matrix[i, :] = self.fovs[i][self.xs, self.ys]
+        self.matrix[:, i] = self.fovs[:, actor.x, actor.y]
+        self.matrix[i, i] = False
+
+    def _row(self, actor: Actor) -> int:
+        self.ensure_current()
+        i = self.index.get(actor)
+        if i is None:
+            self.rebuild()
+            i = self.index.get(actor)
+        elif self.radii[i] != actor.fighter.sight_range:
+            self.refresh_actor(actor)
+        return i
+
+    def can_see(self, viewer: Actor, target: Actor) -> bool:
+        """Return True if the target stands in the viewer's field of view."""
+        i = self._row(viewer)
+        j = self.index.get(target)
+        if i is None or j is None:
+            return False
+        return bool(self.matrix[i, j]) and target.is_alive
+
+    def visible_actors(self, viewer: Actor) -> List[Actor]:
+        """Return the living actors in the viewer's field of view, excluding the viewer itself."""
+        i = self._row(viewer)
+        if i is None:
+            return []
+        return [self.actors[j] for j in np.flatnonzero(self.matrix[i]) if self.actors[j].is_alive]